@@ -0,0 +1,440 @@
+import ast
+import keyword
+import types
+import warnings
+from lexer import *
+from parser import *
+from object import *
+from constants import *
+
+# Returns the numbers from `start` to `end` by `step`, including `end` if `inclusive` is set.
+def makeRange(start, end, step=1, inclusive=False):
+	if inclusive:
+		end += 1 if step > 0 else -1
+	return range(start, end, step)
+
+# The runtime of compiled programs, with the arithmetic shared with the constant folder. The helpers and
+# values are bound to names that aren't identifiers, so no symbol of a program can shadow them.
+runtimeNames = {"$divide": divide, "$remainder": remainder, "$cast": cast, "$range": makeRange, "$bool": bool, "$true": True, "$false": False}
+
+# The runtime names of the identifiers that always mean the same value.
+runtimeIdentifiers = {"true": "$true", "false": "$false"}
+
+# Returns the Python name of an identifier. The identifiers that are Python keywords get a `$`, which no
+# identifier can contain.
+def getPythonName(name):
+	return name + "$" if keyword.iskeyword(name) else name
+
+binaryOperators = {
+	"+": ast.Add, "-": ast.Sub, "*": ast.Mult, "<<": ast.LShift, ">>": ast.RShift,
+	"&": ast.BitAnd, "|": ast.BitOr, "^": ast.BitXor,
+}
+comparisonOperators = {
+	"==": ast.Eq, "!=": ast.NotEq, "<": ast.Lt, "<=": ast.LtE, ">": ast.Gt, ">=": ast.GtE,
+	"is": ast.Is, "isnot": ast.IsNot,
+}
+unaryOperators = {"-": ast.USub, "+": ast.UAdd, "~": ast.Invert, "not": ast.Not}
+
+# The value that a variable defined without one starts with, by basic type.
+defaultValues = {**{type: 0 for type in integerTypes}, "float32": 0.0, "float64": 0.0, "bool": False}
+
+def loadName(name):
+	return ast.Name(name, ast.Load())
+
+def callRuntime(name, *arguments):
+	return ast.Call(loadName(name), list(arguments), [])
+
+# Returns the identifier tokens in `tree`.
+def getIdentifiers(tree):
+	identifiers = set()
+	stack = [tree]
+	while stack:
+		node = stack.pop()
+		if isinstance(node, Node):
+			stack.extend(node.children)
+		elif node.type == "identifier":
+			identifiers.add(node.text)
+	return identifiers
+
+# A range of a `for` loop being lowered: `start thru end` or `start until end`, maybe with `by step`.
+class RangeExpression:
+	def __init__(self, start, end, inclusive):
+		self.start = start
+		self.end = end
+		self.inclusive = inclusive
+		self.step = None
+
+	def toAst(self):
+		return callRuntime("$range", self.start, self.end, self.step or ast.Constant(1), ast.Constant(self.inclusive))
+
+# Lowers the function definitions and variable initializers of a program to Python syntax trees. Locals
+# can live in one Python scope per function, since validation doesn't let a local be defined again in an
+# inner scope. Constructs without a meaning at run time, like pointers, are reported as errors.
+class Lowering:
+	forLoopKind = nodeKindOf("for loop")
+	functionDefinitionKind = nodeKindOf("function definition")
+	blockKind = nodeKindOf("block")
+	infixExpressionKind = nodeKindOf("infix expression")
+	prefixExpressionKind = nodeKindOf("prefix expression")
+
+	def __init__(self, globalVariables):
+		self.globalVariables = globalVariables
+		self.errors = []
+		# The locals of each function being lowered, innermost last.
+		self.functionLocals = []
+		self.hiddenNameCount = 0
+		self.statementHandlers = {
+			"variable definition": self.lowerVariableDefinition,
+			"expression or assignment": self.lowerExpressionOrAssignment,
+			"return statement": self.lowerReturnStatement,
+			"if statement": self.lowerIfStatement,
+			"while loop": self.lowerWhileLoop,
+			"for loop": self.lowerForLoop,
+			"break statement": lambda tree: [ast.Break()],
+			"continue statement": lambda tree: [ast.Continue()],
+			"block": self.lowerBlock,
+			"function definition": lambda tree: [self.lowerFunction(tree)],
+		}
+
+	def addError(self, message, tree):
+		self.errors.append(CompilerError(message, tree.start, tree.end))
+
+	# Returns a name for a variable of the compiler that no identifier can clash with.
+	def newHiddenName(self, prefix):
+		self.hiddenNameCount += 1
+		return f"${prefix}{self.hiddenNameCount}"
+
+	def lowerFunction(self, tree):
+		name = getDefinitionName(tree).text
+		parameters = []
+		for child in tree.children:
+			if isinstance(child, Node) and child.type == "function parameters":
+				parameters = [parameter.children[0].text for parameter in child.children if isinstance(parameter, Node)]
+		block = getChildOfKind(tree, frozenset([self.blockKind]))
+		locals = set(parameters)
+		self.collectLocals(block, locals)
+		self.functionLocals.append(locals)
+		body = self.lowerBlock(block)
+		self.functionLocals.pop()
+
+		# Assigned names that aren't locals belong to an enclosing function or the program.
+		(nonlocals, globals) = (set(), set())
+		for (target, token) in self.collectAssignedNames(block).items():
+			if target in locals:
+				continue
+			if any(target in outerLocals for outerLocals in self.functionLocals):
+				nonlocals.add(getPythonName(target))
+			elif target in self.globalVariables:
+				globals.add(getPythonName(target))
+			else:
+				self.addError(f"Assignment to undefined symbol `{target}`.", token)
+		declarations = []
+		if nonlocals:
+			declarations.append(ast.Nonlocal(sorted(nonlocals)))
+		if globals:
+			declarations.append(ast.Global(sorted(globals)))
+		arguments = ast.arguments(posonlyargs=[], args=[ast.arg(getPythonName(parameter)) for parameter in parameters], kwonlyargs=[], kw_defaults=[], defaults=[])
+		return ast.FunctionDef(name=getPythonName(name), args=arguments, body=declarations + (body or [ast.Pass()]), decorator_list=[])
+
+	# Adds the names of the locals that `tree` defines, but not those of nested functions, to `locals`.
+	def collectLocals(self, tree, locals):
+		stack = [tree]
+		while stack:
+			node = stack.pop()
+			if node.type == "variable definition" or node.type == "function definition":
+				locals.add(getDefinitionName(node).text)
+				if node.type == "function definition":
+					continue
+			elif node.kind == self.forLoopKind:
+				locals.add(node.children[1].text)
+			stack.extend(child for child in node.children if isinstance(child, Node))
+
+	# Returns the names that the assignments in `tree`, but not in nested functions, assign to, each with
+	# its first token.
+	def collectAssignedNames(self, tree):
+		names = {}
+		stack = [tree]
+		while stack:
+			node = stack.pop()
+			if node.kind == self.functionDefinitionKind and node is not tree:
+				continue
+			if node.type == "expression or assignment" and len(node.children) == 3 and not isinstance(node.children[0], Node) and node.children[0].type == "identifier":
+				names.setdefault(node.children[0].text, node.children[0])
+			stack.extend(child for child in node.children if isinstance(child, Node))
+		return names
+
+	def lowerBlock(self, tree):
+		statements = []
+		for child in tree.children:
+			if isinstance(child, Node) and (handler := self.statementHandlers.get(child.type)) is not None:
+				statements.extend(handler(child))
+		return statements
+
+	def lowerBody(self, tree):
+		return self.lowerBlock(tree) or [ast.Pass()]
+
+	# var name type = value ;
+	def lowerVariableDefinition(self, tree):
+		name = getDefinitionName(tree).text
+		assignment = getChildOfKind(tree, frozenset([nodeKindOf("assignment")]))
+		if assignment is not None:
+			value = self.lowerExpression(assignment.children[-1])
+		else:
+			type = getChildOfKind(tree, typeKinds)
+			value = ast.Constant(defaultValues.get(type.children[0].text) if type is not None and type.type == "basic type" and len(type.children) == 1 else None)
+		return [ast.Assign([ast.Name(getPythonName(name), ast.Store())], value)]
+
+	# expression = value ;
+	def lowerExpressionOrAssignment(self, tree):
+		expression = self.lowerExpression(tree.children[0])
+		if isinstance(tree.children[1], Node) and tree.children[1].type == "assignment":
+			if not isinstance(expression, (ast.Name, ast.Attribute, ast.Subscript)):
+				self.addError("Can't assign to this expression.", tree.children[0])
+				return []
+			expression.ctx = ast.Store()
+			return [ast.Assign([expression], self.lowerExpression(tree.children[1].children[-1]))]
+		return [ast.Expr(expression)]
+
+	def lowerReturnStatement(self, tree):
+		return [ast.Return(self.lowerExpression(tree.children[1]) if len(tree.children) == 3 else None)]
+
+	# if condition {body} else if condition {body} else {body}
+	def lowerIfStatement(self, tree):
+		statement = ast.If(self.lowerExpression(tree.children[1]), self.lowerBody(tree.children[2]), [])
+		last = statement
+		for child in tree.children[3:]:
+			if child.type == "else-if block":
+				elseIf = ast.If(self.lowerExpression(child.children[2]), self.lowerBody(child.children[3]), [])
+				last.orelse = [elseIf]
+				last = elseIf
+			else:
+				last.orelse = self.lowerBody(child.children[1])
+		return [statement]
+
+	# A `do while` loop runs its body once before checking the condition, which a hidden flag takes care
+	# of so that `continue` still checks it.
+	def lowerWhileLoop(self, tree):
+		(condition, block) = (self.lowerExpression(tree.children[-2]), tree.children[-1])
+		if tree.children[0].text != "do":
+			return [ast.While(condition, self.lowerBody(block), [])]
+		first = self.newHiddenName("first")
+		return [
+			ast.Assign([ast.Name(first, ast.Store())], ast.Constant(True)),
+			ast.While(ast.BoolOp(ast.Or(), [loadName(first), condition]), [ast.Assign([ast.Name(first, ast.Store())], ast.Constant(False))] + self.lowerBody(block), []),
+		]
+
+	# for name type in expression {body}
+	def lowerForLoop(self, tree):
+		return [ast.For(ast.Name(getPythonName(tree.children[1].text), ast.Store()), self.lowerExpression(tree.children[-2], allowRange=True), self.lowerBody(tree.children[-1]), [])]
+
+	def lowerExpression(self, tree, allowRange=False):
+		if not isinstance(tree, Node):
+			return self.lowerToken(tree)
+		if tree.kind == self.prefixExpressionKind:
+			return self.lowerPrefixExpression(tree)
+		if tree.kind == self.infixExpressionKind:
+			expression = self.lowerInfixExpression(tree)
+			if isinstance(expression, RangeExpression):
+				if allowRange:
+					return expression.toAst()
+				self.addError("Ranges can only be used in `for` loops.", tree)
+				return ast.Constant(None)
+			return expression
+		self.addError(f"Can't run a {tree.type}.", tree)
+		return ast.Constant(None)
+
+	def lowerToken(self, token):
+		if token.type == "number":
+			return ast.Constant(int(token.text))
+		if token.type == "identifier":
+			return loadName(runtimeIdentifiers.get(token.text) or getPythonName(token.text))
+		if token.type == "string":
+			return ast.Constant(ast.literal_eval(token.text))
+		if token.type == "character":
+			return ast.Constant(ord(ast.literal_eval(token.text)))
+		self.addError(f"Expected an expression, not `{token.text}`.", token)
+		return ast.Constant(None)
+
+	# Returns the expressions of the comma separated list `children`.
+	def lowerList(self, children):
+		return [self.lowerExpression(child) for child in children if isinstance(child, Node) or child.text != ","]
+
+	def lowerPrefixExpression(self, tree):
+		operator = tree.children[0].text
+		if operator == "(":
+			items = self.lowerList(tree.children[1:-1])
+			return items[0] if len(items) == 1 else ast.Tuple(items, ast.Load())
+		if operator == "[":
+			return ast.List(self.lowerList(tree.children[1:-1]), ast.Load())
+		if operator in unaryOperators:
+			return ast.UnaryOp(unaryOperators[operator](), self.lowerExpression(tree.children[1]))
+		self.addError(f"Can't run the prefix operator `{operator}`.", tree.children[0])
+		return ast.Constant(None)
+
+	# The children of an infix expression are applied from left to right: the operators that bind tighter
+	# are already in nodes of their own.
+	def lowerInfixExpression(self, tree):
+		children = tree.children
+		left = self.lowerExpression(children[0])
+		index = 1
+		while index < len(children):
+			operator = children[index].text
+			if operator == "(" or operator == "[":
+				end = index + 1
+				while isinstance(children[end], Node) or children[end].text != ("]" if operator == "[" else ")"):
+					end += 1
+				items = self.lowerList(children[index + 1:end])
+				if operator == "(":
+					left = ast.Call(left, items, [])
+				else:
+					left = ast.Subscript(left, items[0] if len(items) == 1 else ast.Tuple(items, ast.Load()), ast.Load())
+				index = end + 1
+				continue
+			right = children[index + 1]
+			index += 2
+			if isinstance(left, RangeExpression) and operator == "by" and left.step is None:
+				left.step = self.lowerExpression(right)
+				continue
+			if isinstance(left, RangeExpression):
+				self.addError("Ranges can only be used in `for` loops.", tree)
+				left = ast.Constant(None)
+			left = self.lowerInfixOperator(left, operator, right, tree)
+		return left
+
+	def lowerInfixOperator(self, left, operator, right, tree):
+		if operator == ".":
+			if right.type == "number":
+				return ast.Subscript(left, ast.Constant(int(right.text)), ast.Load())
+			return ast.Attribute(left, getPythonName(right.text), ast.Load())
+		if operator == "as":
+			if right.type == "basic type" and len(right.children) == 1:
+				return callRuntime("$cast", left, ast.Constant(right.children[0].text))
+			return left
+		if operator == "->":
+			# `value->function(arguments)` calls `function(value, arguments)`.
+			call = self.lowerExpression(right)
+			if isinstance(call, ast.Call):
+				call.args.insert(0, left)
+				return call
+			return ast.Call(call, [left], [])
+		if operator == "thru" or operator == "until":
+			return RangeExpression(left, self.lowerExpression(right), operator == "thru")
+		right = self.lowerExpression(right)
+		if operator in binaryOperators:
+			return ast.BinOp(left, binaryOperators[operator](), right)
+		if operator in comparisonOperators:
+			return ast.Compare(left, [comparisonOperators[operator]()], [right])
+		if operator == "/":
+			return callRuntime("$divide", left, right)
+		if operator == "%":
+			return callRuntime("$remainder", left, right)
+		if operator == "and":
+			return ast.BoolOp(ast.And(), [left, right])
+		if operator == "or":
+			return ast.BoolOp(ast.Or(), [left, right])
+		if operator == "xor":
+			return ast.Compare(callRuntime("$bool", left), [ast.NotEq()], [callRuntime("$bool", right)])
+		self.addError(f"Can't run the operator `{operator}`.", tree)
+		return ast.Constant(None)
+
+# Compiles Python statements into the code object of a module.
+def compileModule(statements, filename):
+	module = ast.fix_missing_locations(ast.Module(statements, []))
+	# Python warns about things like calling a number, which are only errors once they run.
+	with warnings.catch_warnings():
+		warnings.simplefilter("ignore", SyntaxWarning)
+		return compile(module, filename, "exec")
+
+# A compiled program. Its functions and variables are Python objects in `globals`, under their names
+# without the namespace. The variables are initialized by `initialize`, which calling a function does
+# first if it wasn't done yet.
+class Program:
+	def __init__(self, globals, initializer):
+		self.globals = globals
+		self.initializer = initializer
+
+	# Runs the initializers of the program's variables, in order.
+	def initialize(self):
+		if self.initializer is not None:
+			(initializer, self.initializer) = (self.initializer, None)
+			exec(initializer, self.globals)
+
+	def getFunction(self, name):
+		return self.globals.get(getPythonName(name))
+
+	def getVariable(self, name):
+		return self.globals.get(getPythonName(name))
+
+	def call(self, name, *arguments):
+		self.initialize()
+		return self.getFunction(name)(*arguments)
+
+# Compiles programs to Python code objects. The code object of each top-level function is cached by its
+# namespace, its tokens and the program variables it uses, so compiling a program again only lowers and compiles the
+# functions that changed.
+class Backend:
+	def __init__(self):
+		self.codeCache = {}
+		self.hits = 0
+		self.misses = 0
+
+	# Returns the code object of the top-level function definition `tree`, or None if it has errors, which
+	# are added to `errors`.
+	def getFunctionCode(self, tree, globalVariables, namespace, errors):
+		key = (namespace, getTokenTexts(tree), tuple(sorted(getIdentifiers(tree) & globalVariables)))
+		code = self.codeCache.get(key)
+		if code is not None:
+			self.hits += 1
+			return code
+		self.misses += 1
+		lowering = Lowering(globalVariables)
+		function = lowering.lowerFunction(tree)
+		if lowering.errors:
+			errors.extend(lowering.errors)
+			return None
+		moduleCode = compileModule([function], f"<{namespace}.{getDefinitionName(tree).text}>")
+		code = self.codeCache[key] = next(constant for constant in moduleCode.co_consts if isinstance(constant, types.CodeType))
+		return code
+
+	# Compiles the validated program `tree`. Returns the program and any errors, in which case it is None.
+	def compileProgram(self, tree):
+		errors = []
+		namespace = ""
+		functions = []
+		variables = []
+		for child in tree.children:
+			if not isinstance(child, Node):
+				continue
+			if child.type == "namespace statement":
+				namespace = qualifiedNameToStr(child.children[-2])
+			elif child.type == "function definition":
+				functions.append(child)
+			elif child.type == "variable definition":
+				variables.append(child)
+		globalVariables = frozenset(getDefinitionName(variable).text for variable in variables)
+
+		globals = dict(runtimeNames)
+		functionNames = set()
+		for function in functions:
+			# Calls aren't typed yet, so there is nothing to choose an overload by.
+			name = getDefinitionName(function)
+			if name.text in functionNames:
+				errors.append(CompilerError(f"Overloaded function `{name.text}` can't be compiled yet.", name.start, name.end))
+				continue
+			functionNames.add(name.text)
+			code = self.getFunctionCode(function, globalVariables, namespace, errors)
+			if code is not None:
+				globals[code.co_name] = types.FunctionType(code, globals)
+		lowering = Lowering(globalVariables)
+		initializers = [statement for variable in variables for statement in lowering.lowerVariableDefinition(variable)]
+		errors.extend(lowering.errors)
+		if errors:
+			return (None, errors)
+		return (Program(globals, compileModule(initializers, f"<{namespace}>")), errors)
+
+defaultBackend = Backend()
+
+# Compiles the validated program `tree` with `backend`, or with a backend shared by every call. Returns the
+# program and any errors.
+def compileProgram(tree, backend=None):
+	return (backend or defaultBackend).compileProgram(tree)
@@ -0,0 +1,487 @@
+import random
+import time
+import tracemalloc
+from lexer import *
+from parser import *
+from object import *
+from walker import *
+
+# The original character-at-a-time lexer, kept as the baseline that `lex` is measured against.
+def referenceLex(text):
+	keywordList = sorted(keywords)
+	lineComment = "//"
+
+	tokens = []
+	errors = []
+	currentToken = ""
+	i = 0
+	while i < len(text):
+		# Skip whitespace.
+		if text[i] in whitespace:
+			i += 1
+			continue
+		# Skip comments.
+		if text.startswith(lineComment, i):
+			while i < len(text) and text[i] != "\n":
+				i += 1
+			continue
+
+		# Lex a number.
+		if text[i].isdigit():
+			while i < len(text) and text[i].isdigit():
+				currentToken += text[i]
+				i += 1
+			tokens.append(Token("number", currentToken))
+			currentToken = ""
+		# Lex a character.
+		elif text[i] == "'":
+			currentToken += text[i]
+			i += 1
+			while i < len(text) and text[i] != "'" and text[i] != "\n":
+				if text.startswith("\\'", i):
+					currentToken += "\\'"
+					i += 2
+				else:
+					currentToken += text[i]
+					i += 1
+
+			if i < len(text) and text[i] == "'":
+				currentToken += "'"
+				i += 1
+				tokens.append(Token("character", currentToken))
+			else:
+				errors.append(LexerError("Unclosed single quote.", currentToken))
+			currentToken = ""
+		# Lex a string.
+		elif text[i] == '"':
+			currentToken += text[i]
+			i += 1
+			while i < len(text) and text[i] != '"' and text[i] != "\n":
+				if text.startswith('\\"', i):
+					currentToken += '\\"'
+					i += 2
+				else:
+					currentToken += text[i]
+					i += 1
+
+			if i < len(text) and text[i] == '"':
+				currentToken += '"'
+				i += 1
+				tokens.append(Token("string", currentToken))
+			else:
+				errors.append(LexerError("Unclosed double quote.", currentToken))
+			currentToken = ""
+		# Lex an identifier or keyword.
+		elif text[i].isalpha() or text[i] == "_":
+			while i < len(text) and (text[i].isalnum() or text[i] == "_"):
+				currentToken += text[i]
+				i += 1
+			tokens.append(Token("keyword" if currentToken in keywordList else "identifier", currentToken))
+			currentToken = ""
+		# Lex an operator.
+		else:
+			for operator in operators:
+				if text.startswith(operator, i):
+					if operator == "<" and i > 0 and text[i-1] not in whitespace:
+						tokens.append(Token("operator", "generic <"))
+					else:
+						tokens.append(Token("operator", operator))
+					i += len(operator)
+					break
+			else:
+				while i < len(text) and text[i] != "\n":
+					currentToken += text[i]
+					i += 1
+				errors.append(LexerError("Invalid token.", currentToken))
+				currentToken = ""
+	return (tokens, errors)
+
+# The parser as it was before statements and types were dispatched on their first token.
+class ReferenceParser(Parser):
+	def parseType(self):
+		if self.parseTupleType(): return True
+		if self.parseArrayType(): return True
+		if self.parsePointerType(): return True
+		if self.parseFunctionType(): return True
+		if self.parseMutableType(): return True
+		if self.parseBasicType(): return True
+		return False
+
+	def parseBlockStatement(self):
+		if self.parseUsingStatement(): return True
+		if self.parseVariableDefinition(False): return True
+		if self.parseFunctionDefinition(False): return True
+		if self.parseMethodDefinition(False): return True
+		if self.parseStructDefinition(False): return True
+		if self.parseTraitDefinition(False): return True
+		if self.parseBlock(): return True
+		if self.parseIfStatement(): return True
+		if self.parseWhileLoop(): return True
+		if self.parseForLoop(): return True
+		if self.parseBreakStatement(): return True
+		if self.parseContinueStatement(): return True
+		if self.parseReturnStatement(): return True
+		if self.parseExpressionOrAssignment(): return True
+		return False
+
+	def parseTypeCase(self):
+		if self.parseUsingStatement(): return True
+		if self.parseStructDefinition(False): return True
+		if self.parseTraitDefinition(False): return True
+		return self.parseEnumCase()
+
+	def parseProgramStatement(self):
+		if self.parseUsingStatement(): return True
+		if self.parseVariableDefinition(): return True
+		if self.parseFunctionDefinition(): return True
+		if self.parseMethodDefinition(): return True
+		if self.parseStructDefinition(): return True
+		if self.parseTraitDefinition(): return True
+		return False
+
+# The parser as it was before expressions were parsed from the operator tables, with a node opened for
+# every level of an expression.
+class NodeExpressionParser(Parser):
+	parseInfixExpression = Parser.parseInfixExpressionWithNodes
+
+# A parse tree node as it was before nodes used slots and kinds.
+class ReferenceNode:
+	def __init__(self, type, parent, *children):
+		self.type = type
+		self.parent = parent
+		self.children = list(children)
+
+def copyToReferenceNodes(tree, parent=None):
+	node = ReferenceNode(tree.type, parent)
+	node.children = [copyToReferenceNodes(child, node) if isinstance(child, Node) else child for child in tree.children]
+	return node
+
+def copyToNodes(tree):
+	node = Node(tree.type)
+	node.children = tuple(copyToNodes(child) if isinstance(child, Node) else child for child in tree.children)
+	return node
+
+# The symbol table as it was before qualified names were interned into one flat table: every lookup
+# splits the name and walks nested dictionaries.
+class ReferenceObject:
+	def __init__(self):
+		self.publicSymbols = {}
+		self.privateSymbols = {}
+
+	def getPublicSymbol(self, name):
+		identifiers = name.split(".")
+		namespace = self.publicSymbols
+		for identifier in identifiers:
+			if identifier not in namespace:
+				return None
+			namespace = namespace[identifier]
+		return namespace
+
+	def getPrivateSymbol(self, name):
+		identifiers = name.split(".")
+		namespace = self.privateSymbols
+		for identifier in identifiers:
+			if identifier not in namespace:
+				return None
+			namespace = namespace[identifier]
+		return namespace
+
+	def getSymbol(self, name):
+		symbol = self.getPublicSymbol(name)
+		if symbol is not None:
+			return symbol
+		return self.getPrivateSymbol(name)
+
+	def addPublicSymbol(self, name, value):
+		if self.getPublicSymbol(name) is not None:
+			return True
+		identifiers = name.split(".")
+		namespace = self.publicSymbols
+		for identifier in identifiers[:-1]:
+			namespace = namespace.setdefault(identifier, {})
+		namespace[identifiers[-1]] = value
+		return False
+
+	def addPrivateSymbol(self, name, value):
+		if self.getPrivateSymbol(name) is not None:
+			return True
+		identifiers = name.split(".")
+		namespace = self.privateSymbols
+		for identifier in identifiers[:-1]:
+			namespace = namespace.setdefault(identifier, {})
+		namespace[identifiers[-1]] = value
+		return False
+
+# The scopes as they were before bindings were chained by name: a lookup searches every scope from the
+# innermost out.
+class ReferenceScope:
+	def __init__(self):
+		self.symbols = {}
+
+	def getSymbol(self, name):
+		return self.symbols.get(name)
+
+	def addSymbol(self, symbol):
+		if self.getSymbol(symbol.name) is not None:
+			return True
+		self.symbols[symbol.name] = symbol
+
+class ReferenceEnvironment:
+	def __init__(self):
+		self.scopes = []
+
+	def pushScope(self):
+		self.scopes.append(ReferenceScope())
+
+	def popScope(self):
+		self.scopes.pop()
+
+	def getSymbol(self, name):
+		for i in range(len(self.scopes) - 1, -1, -1):
+			symbol = self.scopes[i].getSymbol(name)
+			if symbol is not None:
+				return symbol
+		return None
+
+	def addSymbol(self, symbol):
+		if self.getSymbol(symbol.name) is not None:
+			return True
+		self.scopes[-1].addSymbol(symbol)
+		return False
+
+# The program that the benchmarks lex, parse and validate. It must parse without errors, or the parser
+# stops early and the timings only cover part of it, so `names` is made by `makeList(16)`: a generic type
+# can't be called, and `List<string>()` doesn't parse ("Expected a semicolon.").
+sampleProgram = """
+pub namespace shapes.geometry;
+using std.math.pi, std.io.printLine;
+
+// A shape with a few cases.
+pub struct Shape {
+	pub name string;
+	using Printable;
+} cases {
+	struct Circle {pub radius float64;}
+	struct Rectangle {pub width float64; pub height float64;}
+}
+
+pub trait Printable<type T> {
+	pub count uint32;
+}
+
+pub method area(shape &Shape) float64;
+
+var table [16]int32 = [1, 2, 3, 4];
+pub var names List<string> = makeList(16);
+
+pub func scale(values &mut [16]int32, factor int32) int32 {
+	var total int32 = 0;
+	for i int32 in values {
+		total = total + values[i]*factor - (i << 2) % 7;
+		if total >= 1000 and not done {
+			break;
+		} else if total != 0 {
+			continue;
+		} else {
+			total = -total;
+		}
+	}
+	while total > 0 {
+		total = total / 2;
+	}
+	printLine("total: \\"done\\"", 'x', '\\'');
+	return total as int32->clamp(0, 255);
+}
+"""
+
+# Returns the best time out of several runs of `function`.
+def timeIt(function, *arguments, repeat=5):
+	best = float("inf")
+	for _ in range(repeat):
+		start = time.perf_counter()
+		function(*arguments)
+		best = min(best, time.perf_counter() - start)
+	return best
+
+# Returns the result of `function` and how much of the memory it allocated is still in use.
+def measureMemory(function, *arguments):
+	tracemalloc.start()
+	result = function(*arguments)
+	(size, peak) = tracemalloc.get_traced_memory()
+	tracemalloc.stop()
+	return (result, size)
+
+def tokenSummary(result):
+	(tokens, errors) = result
+	return ([(token.type, token.text) for token in tokens], [(error.message, error.text) for error in errors])
+
+def benchmarkLexer(copies=2000):
+	text = sampleProgram*copies
+	if tokenSummary(lex(text)) != tokenSummary(referenceLex(text)):
+		raise AssertionError("`lex` and `referenceLex` disagree.")
+	referenceTime = timeIt(referenceLex, text, repeat=3)
+	lexTime = timeIt(lex, text)
+	print(f"lex: {len(text)/1e6:.1f} MB, reference {referenceTime:.3f}s, lex {lexTime:.3f}s, speedup {referenceTime/lexTime:.1f}x")
+
+def benchmarkTokenBuffer(copies=200):
+	text = sampleProgram*copies
+	((tokens, _), listSize) = measureMemory(lex, text)
+	(_, bufferSize) = measureMemory(lexBuffer, text)
+	lexTime = timeIt(lex, text)
+	bufferTime = timeIt(lexBuffer, text)
+	print(f"lexBuffer: {len(tokens)} tokens, list {listSize/len(tokens):.1f} B/token, buffer {bufferSize/len(tokens):.1f} B/token, lex {lexTime:.3f}s, lexBuffer {bufferTime:.3f}s")
+
+# The sample program without its namespace statement, which can be repeated to make a larger program.
+def sampleBody():
+	return sampleProgram.split(";", 1)[1]
+
+def benchmarkDispatch(copies=300):
+	text = sampleProgram + sampleBody()*copies
+	(tokens, _) = lex(text)
+	parsers = {}
+	for parserClass in (ReferenceParser, Parser):
+		parser = parserClass(tokens)
+		start = time.perf_counter()
+		parser.parseProgram()
+		parsers[parserClass] = (parser, time.perf_counter() - start)
+	((reference, referenceTime), (parser, parserTime)) = (parsers[ReferenceParser], parsers[Parser])
+	if repr(reference.tree) != repr(parser.tree):
+		raise AssertionError("`Parser` and `ReferenceParser` disagree.")
+	for (name, parser, parserTime) in (("reference", reference, referenceTime), ("dispatch", parser, parserTime)):
+		print(f"{name}: {parser.nodeCount/len(tokens):.2f} nodes/token, {parser.backtrackCount/len(tokens):.2f} backtracks/token, {parserTime:.3f}s")
+
+def benchmarkNodeMemory(copies=300):
+	(tokens, _) = lex(sampleProgram + sampleBody()*copies)
+	(tree, _) = parse(tokens)
+	(_, referenceSize) = measureMemory(copyToReferenceNodes, tree)
+	(_, nodeSize) = measureMemory(copyToNodes, tree)
+	print(f"nodes: reference {referenceSize/1e6:.2f} MB, slots {nodeSize/1e6:.2f} MB, {referenceSize/nodeSize:.1f}x smaller")
+
+# Looks up `lookups` names, a third of them private and a few missing, in objects with `symbolCount`
+# symbols spread over namespaces up to `depth` levels deep.
+def benchmarkSymbolLookup(symbolCount=20000, depth=6, lookups=2000000):
+	generator = random.Random(0)
+	names = []
+	for i in range(symbolCount):
+		namespace = ".".join(f"n{generator.randrange(4)}" for _ in range(generator.randint(1, depth)))
+		names.append((f"{namespace}.s{i}", i % 3 == 0))
+	queries = [generator.choice(names)[0] for _ in range(lookups - lookups//20)] + [f"n0.missing{i}" for i in range(lookups//20)]
+	for objectClass in (ReferenceObject, Object):
+		object = objectClass()
+		for (name, private) in names:
+			(object.addPrivateSymbol if private else object.addPublicSymbol)(name, Symbol(name, "priv" if private else "pub", None, None))
+		getSymbol = object.getSymbol
+		start = time.perf_counter()
+		for name in queries:
+			getSymbol(name)
+		lookupTime = time.perf_counter() - start
+		print(f"{objectClass.__name__}: {lookups} lookups, {lookupTime:.3f}s, {lookups/lookupTime/1e6:.2f}M lookups/s")
+
+# Binds a few names in each of `depth` nested scopes and looks up names from every level in the innermost
+# one, then pops the scopes.
+def benchmarkScopes(depth=64, namesPerScope=4, lookups=1000000):
+	generator = random.Random(0)
+	names = [f"local{i}" for i in range(depth*namesPerScope)]
+	queries = [generator.choice(names) for _ in range(lookups)]
+	for environmentClass in (ReferenceEnvironment, Environment):
+		environment = environmentClass()
+		start = time.perf_counter()
+		for level in range(depth):
+			environment.pushScope()
+			for name in names[level*namesPerScope:(level + 1)*namesPerScope]:
+				environment.addSymbol(Symbol(name, "priv", None, None))
+		getSymbol = environment.getSymbol
+		for name in queries:
+			getSymbol(name)
+		for level in range(depth):
+			environment.popScope()
+		print(f"{environmentClass.__name__}: depth {depth}, {lookups} lookups, {time.perf_counter() - start:.3f}s")
+
+# Counts the nodes of a few types, standing in for a real analysis.
+class CountingAnalysis(Analysis):
+	enterHandlers = {type: "countNode" for type in ("infix expression", "variable definition", "block", "basic type")}
+
+	def __init__(self):
+		self.count = 0
+
+	def countNode(self, node, parent):
+		self.count += 1
+
+# Runs an analysis the way it was done before the walker: one recursive traversal per analysis, matching
+# on the node type.
+def countRecursively(analysis, tree):
+	for child in tree.children:
+		if isinstance(child, Node):
+			countRecursively(analysis, child)
+	match tree.type:
+		case "infix expression" | "variable definition" | "block" | "basic type":
+			analysis.countNode(tree, None)
+
+def benchmarkWalker(copies=300, analysisCounts=(1, 4, 16)):
+	(tokens, _) = lex(sampleProgram + sampleBody()*copies)
+	(tree, _) = parse(tokens)
+	for analysisCount in analysisCounts:
+		analyses = [CountingAnalysis() for _ in range(analysisCount)]
+		start = time.perf_counter()
+		for analysis in analyses:
+			countRecursively(analysis, tree)
+		recursiveTime = time.perf_counter() - start
+		analyses = [CountingAnalysis() for _ in range(analysisCount)]
+		start = time.perf_counter()
+		Walker(analyses).walk(tree)
+		walkerTime = time.perf_counter() - start
+		print(f"{analysisCount} analyses: separate traversals {recursiveTime:.3f}s, one walk {walkerTime:.3f}s")
+
+# Returns a function whose body has `count` statements with long chains of arithmetic, calls or both.
+def makeExpressionProgram(count, shape):
+	generator = random.Random(0)
+	statements = []
+	for i in range(count):
+		if shape == "arithmetic":
+			terms = [f"{generator.choice('abcd')}{generator.choice(['', '[i]', '.x'])}" for _ in range(20)]
+			expression = terms[0] + "".join(f" {generator.choice(['+', '-', '*', '/', '<<', '&'])} {term}" for term in terms[1:])
+		else:
+			expression = "value" + "".join(f"->{generator.choice(['map', 'filter', 'get'])}(x, {i})" for _ in range(10))
+		statements.append(f"\ttotal = {expression};")
+	return "namespace benchmark;\nfunc run() {\n" + "\n".join(statements) + "\n}\n"
+
+def benchmarkExpressions(count=3000):
+	for shape in ("arithmetic", "calls"):
+		(tokens, _) = lex(makeExpressionProgram(count, shape))
+		parsers = {}
+		for parserClass in (NodeExpressionParser, Parser):
+			parser = parserClass(tokens)
+			start = time.perf_counter()
+			parser.parseProgram()
+			parsers[parserClass] = (parser, time.perf_counter() - start)
+		((reference, referenceTime), (parser, parserTime)) = (parsers[NodeExpressionParser], parsers[Parser])
+		if repr(reference.tree) != repr(parser.tree) or reference.errors or parser.errors:
+			raise AssertionError("`Parser` and `NodeExpressionParser` disagree.")
+		print(f"{shape}: {len(tokens)} tokens, nodes per level {referenceTime:.3f}s ({reference.nodeCount} nodes), tables {parserTime:.3f}s ({parser.nodeCount} nodes), speedup {referenceTime/parserTime:.1f}x")
+
+# Times an expression with `depth` unclosed calls or parentheses, which has an error at every level. The
+# operator tables have to fall back to the rules with a node per level, but only once for each level.
+def benchmarkBrokenNesting(depth=200):
+	for opening in ("f(", "("):
+		(tokens, _) = lex("var x = " + opening*depth + "1;")
+		parsers = {}
+		for parserClass in (NodeExpressionParser, Parser):
+			parser = parserClass(tokens)
+			start = time.perf_counter()
+			parser.parseProgram()
+			parsers[parserClass] = (parser, time.perf_counter() - start)
+		((reference, referenceTime), (parser, parserTime)) = (parsers[NodeExpressionParser], parsers[Parser])
+		if repr(reference.tree) != repr(parser.tree) or repr(reference.errors) != repr(parser.errors) or not parser.errors:
+			raise AssertionError("`Parser` and `NodeExpressionParser` disagree.")
+		print(f"{depth} unclosed `{opening}`: nodes per level {referenceTime:.3f}s, tables {parserTime:.3f}s")
+
+if __name__ == "__main__":
+	benchmarkLexer()
+	benchmarkTokenBuffer()
+	benchmarkDispatch()
+	benchmarkNodeMemory()
+	benchmarkSymbolLookup()
+	benchmarkScopes()
+	benchmarkWalker()
+	benchmarkExpressions()
+	benchmarkBrokenNesting()
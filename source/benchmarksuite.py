@@ -0,0 +1,137 @@
+import argparse
+import gc
+import json
+import platform
+import sys
+import time
+from lexer import *
+from parser import *
+from object import *
+from generator import *
+
+# The programs that the suite compiles, as a name, a program shape and a size (see `ProgramGenerator`).
+benchmarkCases = [
+	("mixed", "mixed", 400),
+	("expressions", "expressions", 40),
+	("namespaces", "namespaces", 400),
+	("structs", "structs", 200),
+	("bodies", "bodies", 20),
+	("generics", "generics", 300),
+]
+
+# The measurements of each phase whose drop or rise counts as a regression.
+throughputMetrics = {"lex": ["tokensPerSecond"], "parse": ["tokensPerSecond", "nodesPerSecond"], "validate": ["nodesPerSecond"]}
+
+def countNodes(tree):
+	count = 0
+	stack = [tree]
+	while stack:
+		node = stack.pop()
+		if isinstance(node, Node):
+			count += 1
+			stack.extend(node.children)
+	return count
+
+# Returns the best time out of `repeat` runs of `function` and its last result. Garbage left by earlier runs
+# is collected first, so collecting it doesn't land in the middle of a run.
+def timeBest(function, repeat):
+	best = float("inf")
+	for _ in range(repeat):
+		gc.collect()
+		start = time.perf_counter()
+		result = function()
+		best = min(best, time.perf_counter() - start)
+	return (best, result)
+
+# Compiles the program of one case, timing lex, parse and validate on their own. Peak memory is measured
+# in a separate run, since tracing allocations slows everything down.
+def runCase(shape, size, seed=0, repeat=5):
+	text = generateProgram(seed, size, shape)
+	(lexTime, (tokens, lexerErrors)) = timeBest(lambda: lex(text), repeat)
+	(parseTime, (tree, parserErrors)) = timeBest(lambda: parse(tokens), repeat)
+	(validateTime, (object, compilerErrors)) = timeBest(lambda: validate(tree), repeat)
+	errors = lexerErrors + parserErrors + compilerErrors
+	if errors:
+		locateErrors(errors, text)
+		raise AssertionError(f"The generated {shape} program has errors: {errors[:3]}")
+
+	del (object, lexerErrors, parserErrors, compilerErrors)
+	gc.collect()
+	instrumentation = Instrumentation(memory=True)
+	(tokens, _) = lex(text, instrumentation)
+	(tree, _) = parse(tokens, instrumentation=instrumentation)
+	validate(tree, instrumentation=instrumentation)
+	peaks = {name: total["peak"] for (name, total) in instrumentation.report()["totals"].items()}
+
+	nodeCount = countNodes(tree)
+	return {
+		"characters": len(text),
+		"tokens": len(tokens),
+		"nodes": nodeCount,
+		"lex": {"seconds": lexTime, "tokensPerSecond": len(tokens)/lexTime, "peakBytes": peaks["lex"]},
+		"parse": {"seconds": parseTime, "tokensPerSecond": len(tokens)/parseTime, "nodesPerSecond": nodeCount/parseTime, "peakBytes": peaks["parse"]},
+		"validate": {"seconds": validateTime, "nodesPerSecond": nodeCount/validateTime, "peakBytes": peaks["validate"]},
+	}
+
+def runSuite(cases=benchmarkCases, seed=0, repeat=5, scale=1.0):
+	results = {}
+	for (name, shape, size) in cases:
+		results[name] = runCase(shape, max(1, round(size*scale)), seed, repeat)
+	return {"python": platform.python_version(), "machine": platform.machine(), "seed": seed, "scale": scale, "cases": results}
+
+# Returns a message for each measurement in `results` that is worse than in `baseline` by more than
+# `tolerance`, as a fraction. Cases whose programs differ from the baseline's can't be compared.
+def findRegressions(results, baseline, tolerance=0.1):
+	regressions = []
+	for (name, case) in results["cases"].items():
+		baselineCase = baseline["cases"].get(name)
+		if baselineCase is None:
+			continue
+		if (case["tokens"], case["nodes"]) != (baselineCase["tokens"], baselineCase["nodes"]):
+			regressions.append(f"{name}: the program differs from the baseline's ({case['tokens']} tokens, baseline {baselineCase['tokens']}).")
+			continue
+		for (phase, metrics) in throughputMetrics.items():
+			for metric in metrics:
+				(value, baselineValue) = (case[phase][metric], baselineCase[phase][metric])
+				if value < baselineValue*(1 - tolerance):
+					regressions.append(f"{name}: {phase} {metric} fell from {baselineValue:.0f} to {value:.0f} ({value/baselineValue - 1:+.0%}).")
+			(value, baselineValue) = (case[phase]["peakBytes"], baselineCase[phase]["peakBytes"])
+			if value > baselineValue*(1 + tolerance):
+				regressions.append(f"{name}: {phase} peak memory rose from {baselineValue} to {value} bytes ({value/baselineValue - 1:+.0%}).")
+	return regressions
+
+def printResults(results):
+	for (name, case) in results["cases"].items():
+		print(f"{name}: {case['characters']} characters, {case['tokens']} tokens, {case['nodes']} nodes")
+		for phase in ("lex", "parse", "validate"):
+			measurements = case[phase]
+			rates = ", ".join(f"{measurements[metric]/1e3:.0f}k {metric.removesuffix('PerSecond')}/s" for metric in throughputMetrics[phase])
+			print(f"\t{phase}: {measurements['seconds']*1e3:.1f} ms, {rates}, peak {measurements['peakBytes']/(1 << 20):.1f} MiB")
+
+def main(arguments=None):
+	argumentParser = argparse.ArgumentParser(description="Times lex, parse and validate on generated programs.")
+	argumentParser.add_argument("--case", action="append", choices=[name for (name, _, _) in benchmarkCases], help="case to run (default: all)")
+	argumentParser.add_argument("--seed", type=int, default=0, help="seed of the program generator")
+	argumentParser.add_argument("--scale", type=float, default=1.0, help="factor for the size of each program")
+	argumentParser.add_argument("--repeat", type=int, default=5, help="runs per phase, of which the fastest counts")
+	argumentParser.add_argument("--baseline", default=None, help="results to compare against, as written by --save")
+	argumentParser.add_argument("--tolerance", type=float, default=0.1, help="fraction a measurement may be worse than the baseline")
+	argumentParser.add_argument("--save", default=None, help="JSON file to write the results to")
+	arguments = argumentParser.parse_args(arguments)
+
+	cases = [case for case in benchmarkCases if arguments.case is None or case[0] in arguments.case]
+	results = runSuite(cases, arguments.seed, arguments.repeat, arguments.scale)
+	printResults(results)
+	if arguments.save is not None:
+		with open(arguments.save, "w", encoding="utf-8") as file:
+			json.dump(results, file, indent="\t")
+	if arguments.baseline is not None:
+		with open(arguments.baseline, encoding="utf-8") as file:
+			baseline = json.load(file)
+		regressions = findRegressions(results, baseline, arguments.tolerance)
+		print("\n".join(regressions) if regressions else "No regressions.")
+		return 1 if regressions else 0
+	return 0
+
+if __name__ == "__main__":
+	sys.exit(main())
@@ -0,0 +1,178 @@
+import argparse
+import functools
+import hashlib
+import json
+import os
+import sys
+from lexer import *
+from parser import *
+from object import *
+from walker import *
+from cache import *
+from objectfile import *
+from driver import *
+
+# Collects the names that a program's using statements refer to.
+class UsingAnalysis(Analysis):
+	enterHandlers = {"using statement": "visitUsingStatement"}
+
+	def __init__(self):
+		self.names = set()
+
+	def visitUsingStatement(self, tree, parent):
+		for child in tree.children:
+			if isinstance(child, Node):
+				self.names.add(qualifiedNameToStr(child).removesuffix(".*"))
+
+def getUsedNames(tree):
+	analysis = UsingAnalysis()
+	Walker([analysis]).walk(tree)
+	return sorted(analysis.names)
+
+def getNamespace(tree):
+	if tree is not None and tree.children and isinstance(tree.children[0], Node) and tree.children[0].type == "namespace statement":
+		return qualifiedNameToStr(tree.children[0].children[-2])
+	return ""
+
+# Returns what a symbol shows to the files that use it. The body of a function and the initial value of a
+# variable are left out, so changing them doesn't change the interface: a variable only shows its declared
+# type.
+def getInterface(symbol):
+	if isinstance(symbol, dict):
+		return "namespace"
+	if isinstance(symbol, OverloadSet):
+		return "\n".join(map(getInterface, symbol.symbols))
+	if isinstance(symbol.value, Node) and symbol.value.type == "function definition":
+		return repr([child for child in symbol.value.children if not (isinstance(child, Node) and child.type == "block")])
+	if isinstance(symbol.value, Node) and symbol.value.type in ("method definition", "struct definintion", "trait definintion"):
+		return repr(symbol.value)
+	return repr(symbol.type)
+
+# Returns a hash of the public symbols of `object`.
+def fingerprint(object):
+	hash = hashlib.sha256()
+	for name in sorted(object.publicSymbols):
+		hash.update(f"{name}\0{getInterface(object.publicSymbols[name])}\0".encode("utf-8"))
+	return hash.hexdigest()
+
+# Returns whether the used name `name` refers to `namespace` or something in it.
+def isInNamespace(name, namespace):
+	return name == namespace or name.startswith(namespace + ".")
+
+# Returns a hash of every module of the compiler, so the errors and objects that a build graph keeps are
+# only reused by the compiler that made them. `compilerVersion` only covers the lexer and parser.
+@functools.cache
+def buildVersion():
+	directory = os.path.dirname(os.path.abspath(__file__))
+	hash = hashlib.sha256(sys.byteorder.encode())
+	for module in sorted(name for name in os.listdir(directory) if name.endswith(".py")):
+		hash.update(module.encode("utf-8") + b"\0")
+		with open(os.path.join(directory, module), "rb") as file:
+			hash.update(file.read())
+	return hash.hexdigest()[:16]
+
+# What the build graph knows about one source file.
+class FileNode:
+	def __init__(self, textHash, namespace, usedNames, fingerprint, errors):
+		self.textHash = textHash
+		self.namespace = namespace
+		self.usedNames = usedNames
+		self.fingerprint = fingerprint
+		self.errors = errors
+
+# The files of a project with the namespace each one defines, the names it uses and a fingerprint of its
+# public interface, kept in `directory` between builds along with the object of each file. A build only
+# recompiles the files whose text changed and the files that use a namespace whose interface changed.
+class BuildGraph:
+	def __init__(self, directory):
+		self.directory = directory
+		self.files = {}
+		os.makedirs(os.path.join(directory, "objects"), exist_ok=True)
+		try:
+			with open(os.path.join(directory, "graph.json"), encoding="utf-8") as file:
+				state = json.load(file)
+		except (OSError, ValueError):
+			state = None
+		if state is not None and state["version"] == buildVersion():
+			self.files = {path: FileNode(**fields) for (path, fields) in state["files"].items()}
+
+	def save(self):
+		state = {"version": buildVersion(), "files": {path: vars(node) for (path, node) in self.files.items()}}
+		temporaryPath = os.path.join(self.directory, f"graph.json.{os.getpid()}.tmp")
+		with open(temporaryPath, "w", encoding="utf-8") as file:
+			json.dump(state, file)
+		os.replace(temporaryPath, os.path.join(self.directory, "graph.json"))
+
+	def getObjectPath(self, path):
+		return os.path.join(self.directory, "objects", hashlib.sha256(os.path.abspath(path).encode("utf-8")).hexdigest() + ".obj")
+
+	# Returns the fingerprints of the files at `paths` by the namespace they define.
+	def getNamespaceFingerprints(self, paths):
+		fingerprints = {}
+		for path in paths:
+			node = self.files[path]
+			fingerprints.setdefault(node.namespace, []).append(node.fingerprint)
+		return {namespace: sorted(namespaceFingerprints) for (namespace, namespaceFingerprints) in fingerprints.items()}
+
+	# Returns the paths that use a namespace in `changedNamespaces` and weren't compiled yet.
+	def findDependents(self, changedNamespaces, paths, compiledPaths):
+		return [path for path in paths if path not in compiledPaths and any(isInNamespace(name, namespace) for name in self.files[path].usedNames for namespace in changedNamespaces)]
+
+	# Builds the project in `projectDirectory`. Returns the merged object, the result of each file and the
+	# paths that were compiled.
+	def build(self, projectDirectory, jobs=None, cacheDirectory=None, libraryPaths=()):
+		paths = findSourceFiles(projectDirectory)
+		textHashes = {}
+		for path in paths:
+			with open(path, "rb") as file:
+				textHashes[path] = hashlib.sha256(file.read()).hexdigest()
+		oldFingerprints = self.getNamespaceFingerprints(self.files)
+		for path in set(self.files) - set(paths):
+			del self.files[path]
+			if os.path.exists(self.getObjectPath(path)):
+				os.remove(self.getObjectPath(path))
+
+		# Compile the files that changed, then the files that use an interface that changed.
+		results = {}
+		changedPaths = [path for path in paths if path not in self.files or self.files[path].textHash != textHashes[path]]
+		while changedPaths:
+			for result in compileFiles(changedPaths, jobs, cacheDirectory, libraryPaths):
+				results[result.path] = result
+				self.files[result.path] = FileNode(textHashes[result.path], getNamespace(result.tree), getUsedNames(result.tree), fingerprint(result.object), list(map(repr, result.errors)))
+				writeObjectFile(self.getObjectPath(result.path), result.object)
+			newFingerprints = self.getNamespaceFingerprints(paths)
+			changedNamespaces = {namespace for namespace in oldFingerprints.keys() | newFingerprints.keys() if oldFingerprints.get(namespace) != newFingerprints.get(namespace)}
+			oldFingerprints = newFingerprints
+			changedPaths = self.findDependents(changedNamespaces, paths, results)
+		self.save()
+
+		compiledPaths = [path for path in paths if path in results]
+		# The other files keep their errors and objects from the last build.
+		for path in paths:
+			if path not in results:
+				node = self.files[path]
+				results[path] = FileResult(path, None, readObjectFile(self.getObjectPath(path)), list(map(CompilerError, node.errors)))
+		results = [results[path] for path in paths]
+		return (mergeResults(results), results, compiledPaths)
+
+def main(arguments=None):
+	argumentParser = argparse.ArgumentParser(description="Rebuilds a project directory, only compiling what changed.")
+	argumentParser.add_argument("directory")
+	argumentParser.add_argument("state", help="directory of the build graph")
+	argumentParser.add_argument("-j", "--jobs", type=int, default=None, help="number of processes (default: one per core)")
+	argumentParser.add_argument("--cache", default=None, help="directory of the build cache")
+	argumentParser.add_argument("-l", "--link", action="append", default=[], help="object file to link against")
+	arguments = argumentParser.parse_args(arguments)
+
+	(object, results, compiledPaths) = BuildGraph(arguments.state).build(arguments.directory, arguments.jobs, arguments.cache, arguments.link)
+	errorCount = 0
+	for result in results:
+		if result.errors:
+			print(f"---- {result.path} ----")
+			print("\n".join(map(str, result.errors)))
+			errorCount += len(result.errors)
+	print(f"Compiled {len(compiledPaths)} of {len(results)} files with {errorCount} errors.")
+	return 1 if errorCount else 0
+
+if __name__ == "__main__":
+	sys.exit(main())
@@ -0,0 +1,140 @@
+from array import array
+import functools
+import hashlib
+import os
+import re
+import shutil
+import sys
+from lexer import *
+from parser import *
+from serialize import *
+
+cacheMagic = b"PLC2"
+# The directory that the cache keeps in the directory it is given, so it never deletes anything else.
+cacheDirectoryName = ".lexcache"
+# The names of the directories of compiler versions, as made by `compilerVersion`.
+versionPattern = re.compile(r"[0-9a-f]{16}")
+
+# Returns a hash of the compiler code that produces cached results, so the cache starts over whenever
+# it changes.
+@functools.cache
+def compilerVersion():
+	hash = hashlib.sha256(cacheMagic + sys.byteorder.encode())
+	for module in ("lexer", "parser", "serialize", "cache"):
+		with open(os.path.join(os.path.dirname(os.path.abspath(__file__)), module + ".py"), "rb") as file:
+			hash.update(file.read())
+	return hash.hexdigest()[:16]
+
+# A cache of lexer and parser output on disk, keyed by a hash of the source text. The cache lives in a
+# `.lexcache` directory inside `directory`, where each compiler version gets its own directory and the
+# directories of other versions are deleted. Once the entries take up more than `maxBytes`, the least
+# recently used ones are removed by `evict`.
+class BuildCache:
+	def __init__(self, directory, maxBytes=256 << 20):
+		self.root = os.path.join(directory, cacheDirectoryName)
+		self.directory = os.path.join(self.root, compilerVersion())
+		self.maxBytes = maxBytes
+		self.hits = 0
+		self.misses = 0
+		os.makedirs(self.directory, exist_ok=True)
+		self.removeVersions(self.directory)
+
+	# Removes the directories of the compiler versions other than `keep`. Only directories named like a
+	# version are removed.
+	def removeVersions(self, keep=None):
+		for entry in os.scandir(self.root):
+			if entry.is_dir(follow_symlinks=False) and versionPattern.fullmatch(entry.name) and entry.path != keep:
+				shutil.rmtree(entry.path, ignore_errors=True)
+
+	def getPath(self, text):
+		return os.path.join(self.directory, hashlib.sha256(text.encode("utf-8")).hexdigest())
+
+	# Returns the tokens, tree, lexer errors and parser errors cached for `text`, or None. An entry that
+	# can't be decoded, because it is truncated or corrupt, is a miss and is deleted.
+	def load(self, text):
+		path = self.getPath(text)
+		try:
+			result = self.decode(path)
+		except OSError:
+			result = None
+		except Exception:
+			result = None
+			self.remove(path)
+		if result is None:
+			self.misses += 1
+			return None
+		# Mark the entry as recently used, unless it was just evicted.
+		try:
+			os.utime(path)
+		except OSError:
+			pass
+		self.hits += 1
+		return result
+
+	def decode(self, path):
+		result = readSections(path, cacheMagic)
+		if result is None:
+			return None
+		(map, sections) = result
+		try:
+			strings = list(StringReader(*sections[0:2]))
+			tokens = decodeTokens(sections[2:6], strings)
+			tree = decodeTree(sections[6], sections[7], tokens, strings)
+			spans = [None if offset < 0 else offset for offset in sections[10]]
+			lexerErrors = [LexerError(strings[message], strings[text], *spans[2*i:2*i + 2]) for (i, (message, text)) in enumerate(zip(sections[8][0::2], sections[8][1::2]))]
+			parserErrors = [ParserError(strings[message], *spans[2*i:2*i + 2]) for (i, message) in enumerate(sections[9], len(lexerErrors))]
+		finally:
+			for section in sections:
+				section.release()
+			map.close()
+		return (tokens, tree, lexerErrors, parserErrors)
+
+	def remove(self, path):
+		try:
+			os.remove(path)
+		except OSError:
+			pass
+
+	def store(self, text, tokens, tree, lexerErrors, parserErrors):
+		strings = StringTable()
+		tokenTable = TokenTable(strings)
+		for token in tokens:
+			tokenTable.add(token)
+		treeSections = encodeTree(tree, tokenTable)
+		tokenSections = tokenTable.encode()
+		lexerErrorItems = array("I")
+		for error in lexerErrors:
+			lexerErrorItems.extend((strings.add(error.message), strings.add(error.text)))
+		parserErrorItems = array("I", (strings.add(error.message) for error in parserErrors))
+		# The spans of the lexer errors and then the parser errors, with -1 for a missing offset.
+		spans = array("q", (-1 if offset is None else offset for error in lexerErrors + parserErrors for offset in (error.start, error.end)))
+		writeSections(self.getPath(text), cacheMagic, [*strings.encode(), *tokenSections, *treeSections, lexerErrorItems, parserErrorItems, spans])
+
+	# Removes the least recently used entries until the cache fits in `maxBytes`.
+	def evict(self):
+		entries = [(entry.stat().st_mtime, entry.stat().st_size, entry.path) for entry in os.scandir(self.directory) if entry.is_file()]
+		size = sum(entrySize for (_, entrySize, _) in entries)
+		for (_, entrySize, path) in sorted(entries):
+			if size <= self.maxBytes:
+				break
+			self.remove(path)
+			size -= entrySize
+
+	# Removes every entry of every compiler version.
+	def clear(self):
+		self.removeVersions()
+		os.makedirs(self.directory, exist_ok=True)
+
+# Lexes and parses `text` in recovery mode, using `cache` when it is given.
+def lexAndParse(text, cache=None, instrumentation=None):
+	if cache is not None:
+		with measure(instrumentation, "load cache"):
+			result = cache.load(text)
+		if result is not None:
+			return result
+	(tokens, lexerErrors) = lex(text, instrumentation)
+	(tree, parserErrors) = parse(tokens, recover=True, instrumentation=instrumentation)
+	if cache is not None:
+		with measure(instrumentation, "store cache"):
+			cache.store(text, tokens, tree, lexerErrors, parserErrors)
+	return (tokens, tree, lexerErrors, parserErrors)
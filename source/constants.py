@@ -0,0 +1,287 @@
+import ast
+from lexer import *
+from parser import *
+
+# Integer arithmetic as the language does it, for constants and compiled programs. Division and remainder
+# truncate toward zero.
+def divide(a, b):
+	if isinstance(a, int) and isinstance(b, int):
+		quotient = abs(a)//abs(b)
+		return quotient if (a < 0) == (b < 0) else -quotient
+	return a/b
+
+def remainder(a, b):
+	if isinstance(a, int) and isinstance(b, int):
+		return a - b*divide(a, b)
+	return a % b
+
+# The bit width and signedness of each integer type.
+integerTypes = {
+	"int8": (8, True), "int16": (16, True), "int32": (32, True), "int64": (64, True),
+	"uint8": (8, False), "uint16": (16, False), "uint32": (32, False), "uint64": (64, False),
+}
+
+# Converts `value` to the basic type named `type`. Integers wrap around to the width of the type. Other
+# types leave the value as it is.
+def cast(value, type):
+	if type in integerTypes:
+		(width, signed) = integerTypes[type]
+		value = int(value) & ((1 << width) - 1)
+		if signed and value >> (width - 1):
+			value -= 1 << width
+		return value
+	if type in ("float32", "float64"):
+		return float(value)
+	if type == "bool":
+		return bool(value)
+	return value
+
+# The value of an expression that can't be evaluated at compile time.
+notConstant = object()
+
+# An error in a constant expression, like division by zero.
+class ConstantError:
+	def __init__(self, message, start=None, end=None):
+		self.message = message
+		self.start = start
+		self.end = end
+		self.location = None
+
+	def __repr__(self):
+		return formatErrorMessage(self, self.message)
+
+# A number that the compiler computed from a constant expression, which takes the expression's place in
+# the tree. It is a number token to the later phases, spanning the whole expression, and keeps its value
+# so it doesn't need decoding again.
+class Constant(Token):
+	__slots__ = ("value",)
+
+	def __init__(self, value, start=None, end=None):
+		super().__init__("number", str(value), start, end)
+		self.value = value
+
+# The values of literal tokens, each decoded once. A number is an integer, a character is its code point
+# and a string is its text.
+class ConstantPool:
+	def __init__(self):
+		self.values = {}
+
+	def getValue(self, token):
+		if type(token) is Constant:
+			return token.value
+		key = (token.type, token.text)
+		value = self.values.get(key)
+		if value is None:
+			value = self.values[key] = self.decode(token)
+		return value
+
+	@staticmethod
+	def decode(token):
+		try:
+			if token.type == "number":
+				return int(token.text)
+			if token.type == "character":
+				return ord(ast.literal_eval(token.text))
+			if token.type == "string":
+				return ast.literal_eval(token.text)
+		except (ValueError, TypeError, SyntaxError):
+			pass
+		return notConstant
+
+comparisonAndLogicOperators = frozenset(["==", "!=", "<", "<=", ">", ">=", "and", "or", "xor"])
+
+def evaluateBinaryOperator(operator, left, right):
+	if operator == "+": return left + right
+	if operator == "-": return left - right
+	if operator == "*": return left*right
+	if operator == "/": return divide(left, right)
+	if operator == "%": return remainder(left, right)
+	if operator == "<<": return left << right
+	if operator == ">>": return left >> right
+	if operator == "&": return left & right
+	if operator == "|": return left | right
+	if operator == "^": return left ^ right
+	if operator == "==": return left == right
+	if operator == "!=": return left != right
+	if operator == "<": return left < right
+	if operator == "<=": return left <= right
+	if operator == ">": return left > right
+	if operator == ">=": return left >= right
+	if operator == "and": return bool(left) and bool(right)
+	if operator == "or": return bool(left) or bool(right)
+	if operator == "xor": return bool(left) != bool(right)
+	return notConstant
+
+def evaluatePrefixOperator(operator, value):
+	if operator == "-": return -value
+	if operator == "+": return +value
+	if operator == "~": return ~value
+	if operator == "not": return not value
+	return notConstant
+
+# Evaluates the constant expressions of a tree, on the way back up, and puts a `Constant` in place of each
+# one whose value is an integer, so the phases after it walk smaller trees. In a chain of operators, the
+# constant operands that it starts with are folded too. The value of every expression is remembered,
+# including those that aren't folded, like the results of comparisons. The tree that is folded isn't
+# changed: the nodes with a folded expression below them are copied, and the others are shared.
+class ConstantFolder:
+	expressionKinds = frozenset(map(nodeKindOf, ["infix expression", "prefix expression"]))
+	prefixExpressionKind = nodeKindOf("prefix expression")
+
+	def __init__(self, pool=None):
+		self.pool = pool or ConstantPool()
+		# The value of each constant expression node that isn't folded, like a comparison, by its id. Such a
+		# node stays in one of the trees, so its id can't be reused while folding, but the values are only
+		# meant for the fold that found them.
+		self.values = {}
+		self.errors = []
+		self.foldCount = 0
+
+	# Returns the value of the operand `tree`, or `notConstant`.
+	def getValue(self, tree):
+		if isinstance(tree, Node):
+			return self.values.get(id(tree), notConstant)
+		if tree.type in ("number", "character", "string"):
+			return self.pool.getValue(tree)
+		return notConstant
+
+	# Applies the operators of the infix expression with `children` from left to right while the operands
+	# are constant. Returns the value so far and the index of the first operator that wasn't applied. A
+	# tree with syntax errors can miss operands, which ends the chain.
+	def evaluateChain(self, children):
+		if not children:
+			return (notConstant, 1)
+		value = self.getValue(children[0])
+		if value is notConstant:
+			return (value, 1)
+		index = 1
+		while index + 1 < len(children):
+			if isinstance(children[index], Node):
+				break
+			(operator, right) = (children[index].text, children[index + 1])
+			if operator == "as":
+				result = cast(value, right.children[0].text) if right.type == "basic type" and len(right.children) == 1 and right.children[0].text in integerTypes and isinstance(value, int) else notConstant
+			else:
+				rightValue = self.getValue(right)
+				result = notConstant if rightValue is notConstant else self.evaluateBinary(operator, value, rightValue, right)
+			if result is notConstant:
+				break
+			value = result
+			index += 2
+		return (value, index)
+
+	def evaluateBinary(self, operator, left, right, tree):
+		# Only integers have arithmetic. Other values can only be compared.
+		if operator not in comparisonAndLogicOperators and not (isinstance(left, int) and isinstance(right, int)):
+			return notConstant
+		if operator in ("/", "%") and right == 0:
+			self.errors.append(ConstantError("Division by zero in a constant expression.", tree.start, tree.end))
+			return notConstant
+		if operator in ("<<", ">>") and (not isinstance(right, int) or right < 0 or right > 4096):
+			return notConstant
+		try:
+			return evaluateBinaryOperator(operator, left, right)
+		except TypeError:
+			return notConstant
+
+	def evaluatePrefix(self, tree):
+		# An operator without an operand, which a tree with syntax errors can have.
+		if len(tree.children) < 2 or isinstance(tree.children[0], Node):
+			return notConstant
+		operator = tree.children[0].text
+		if operator == "(":
+			return self.getValue(tree.children[1]) if len(tree.children) == 3 else notConstant
+		value = self.getValue(tree.children[1])
+		if value is notConstant or (operator != "not" and not isinstance(value, int)):
+			return notConstant
+		return evaluatePrefixOperator(operator, value)
+
+	# Returns the infix expression `tree` with the constant start of its chain folded into its first
+	# operand, or `tree` if there is nothing to fold, along with the value of the whole expression.
+	def evaluateInfix(self, tree):
+		children = tree.children
+		(value, index) = self.evaluateChain(children)
+		if value is notConstant or index >= len(children):
+			return (tree, value)
+		if index > 1 and type(value) is int:
+			tree = copyNode(tree, (Constant(value, children[0].start, children[index - 1].end), *children[index:]))
+			self.foldCount += 1
+		return (tree, notConstant)
+
+	# Returns what takes the place of the expression `tree`: a `Constant`, a copy with part of it folded or
+	# `tree` itself.
+	def foldExpression(self, tree):
+		if tree.kind == self.prefixExpressionKind:
+			value = self.evaluatePrefix(tree)
+		else:
+			(tree, value) = self.evaluateInfix(tree)
+		if value is notConstant:
+			return tree
+		if type(value) is not int:
+			self.values[id(tree)] = value
+			return tree
+		self.foldCount += 1
+		return Constant(value, tree.start, tree.end)
+
+	# Returns `tree` with its constant expressions folded, depth-first so operands are folded before the
+	# expressions that use them. The walk keeps its own stack, like `Walker`.
+	def fold(self, tree):
+		if not isinstance(tree, Node):
+			return tree
+		# What took the place of each node that changed, by id.
+		replaced = {}
+		expressionKinds = self.expressionKinds
+		# The stack holds nodes to enter and an `exit` for each node to exit, which is the last node of
+		# `path`, the nodes entered so far and not exited. `changed` tells whether a child of each node in
+		# `path` changed.
+		exit = object()
+		stack = [tree]
+		path = []
+		changed = [False]
+		(push, pop) = (stack.append, stack.pop)
+		while stack:
+			node = pop()
+			if node is not exit:
+				# A node without child nodes only needs exiting if it is an expression.
+				depth = len(stack)
+				for child in reversed(node.children):
+					if type(child) is Node:
+						push(child)
+				if len(stack) != depth or node.kind in expressionKinds:
+					stack.insert(depth, exit)
+					path.append(node)
+					changed.append(False)
+				continue
+			node = path.pop()
+			result = node
+			if changed.pop():
+				result = copyNode(node, tuple(replaced.get(id(child), child) for child in node.children))
+			if result.kind in expressionKinds:
+				result = self.foldExpression(result)
+			if result is not node:
+				replaced[id(node)] = result
+				changed[-1] = True
+		return replaced.get(id(tree), tree)
+
+# Returns a node of the same kind as `node` with `children`.
+def copyNode(node, children):
+	copy = Node.__new__(Node)
+	copy.kind = node.kind
+	copy.children = children
+	return copy
+
+# Folds the constant expressions of `tree`. Returns the folded tree, in which the nodes that didn't change
+# are shared with `tree`, and the errors found, like division by zero. `tree` itself isn't changed, so it
+# still matches its tokens, as `parseIncremental` needs.
+def foldConstants(tree, pool=None):
+	folder = ConstantFolder(pool)
+	return (folder.fold(tree), folder.errors)
+
+# Returns the size of the array type `tree` if it is known at compile time, or None. The size expression
+# must have been folded.
+def getArraySize(tree):
+	size = tree.children[1]
+	if type(size) is Constant or (not isinstance(size, Node) and size.type == "number"):
+		value = int(size.text)
+		return value if value >= 0 else None
+	return None
@@ -0,0 +1,263 @@
+from lexer import *
+from parser import *
+from typetable import *
+
+overloadableKinds = frozenset(map(nodeKindOf, ["function definition", "method definition"]))
+methodDefinitionKind = nodeKindOf("method definition")
+compositeKinds = frozenset(map(nodeKindOf, ["struct definintion", "trait definintion"]))
+structBodyKind = nodeKindOf("struct body")
+usingTypeKind = nodeKindOf("using type")
+
+# Returns whether the symbol table value `value` is a function or method, which can be overloaded. The type
+# is checked too, since a syntax error can leave a definition as the value of a variable.
+def isOverloadable(value):
+	return not isinstance(value, (dict, OverloadSet)) and isinstance(value.value, Node) and value.value.kind in overloadableKinds and isinstance(value.type, FunctionType)
+
+# The functions and methods that share a qualified name, indexed by their parameter types. It takes the
+# place of their symbols in a symbol table. Since the types are canonical, finding an overload by its
+# parameter types is one hash.
+class OverloadSet:
+	def __init__(self, name, visibility):
+		self.name = name
+		self.visibility = visibility
+		self.symbols = []
+		self.overloads = {}
+
+	def __repr__(self):
+		return self.name
+
+	# Adds the function or method `symbol`. Returns True instead if there already is an overload with the
+	# same parameter types.
+	def add(self, symbol):
+		parameters = symbol.type.parameters
+		if parameters in self.overloads:
+			return True
+		self.overloads[parameters] = symbol
+		self.symbols.append(symbol)
+		return False
+
+	def getOverload(self, parameters):
+		return self.overloads.get(tuple(parameters))
+
+# Returns the overload set of the functions and methods in the symbol table values `first` and `second`,
+# which are overload sets or overloadable symbols, or None if they can't be overloaded. Neither is changed.
+def combineOverloads(first, second):
+	if not all(isinstance(value, OverloadSet) or isOverloadable(value) for value in (first, second)) or first.visibility != second.visibility:
+		return None
+	overloads = OverloadSet(first.name, first.visibility)
+	for value in (first, second):
+		for symbol in (value.symbols if isinstance(value, OverloadSet) else (value,)):
+			if overloads.add(symbol):
+				return None
+	return overloads
+
+# Returns the symbols of the symbol table value `value`: the overloads of an overload set, or the symbol.
+def getOverloads(value):
+	return value.symbols if isinstance(value, OverloadSet) else (value,)
+
+# Returns the type inside any pointers and `mut` of `type`.
+def getTargetType(type):
+	while isinstance(type, (PointerType, MutableType)):
+		type = type.target
+	return type
+
+# An error in the methods of a program, like a method whose receiver isn't a struct or trait.
+class DispatchError:
+	def __init__(self, message, start=None, end=None):
+		self.message = message
+		self.start = start
+		self.end = end
+		self.location = None
+
+	def __repr__(self):
+		return formatErrorMessage(self, self.message)
+
+# The dispatch tables of a program's methods, and the resolution of calls to overloaded functions.
+#
+# A method is declared on the struct or trait of its first parameter, its receiver, like `method
+# makeNoise(animal &Animal)`, and gets a slot. The types that use that struct or trait, directly or
+# through others, implement the method with functions of the same name whose receiver is one of them.
+# Each struct and trait has a table with the implementation of every slot, or None, taken from the type
+# itself or else from the nearest type it uses, in the order of its `using` declarations. A call that is
+# only known at runtime then takes one index into the table of the receiver's type.
+#
+# Type names are looked up in the namespace of the symbol they appear in, then as they are written, in
+# `object` and the public symbols of `libraries`.
+class DispatchTables:
+	def __init__(self, object, libraries=()):
+		self.object = object
+		self.libraries = libraries
+		self.errors = []
+		# The qualified names of the structs and traits that each one uses directly.
+		self.compositions = {}
+		# The qualified name of each type followed by those of the types it uses, nearest first.
+		self.linearizations = {}
+		# The qualified type names that names resolved to, by namespace and name.
+		self.resolved = {}
+		# The method of each slot, with the qualified name of its receiver type, and the slot of each method
+		# by its name and receiver type.
+		self.methods = []
+		self.slots = {}
+		# The table of each struct and trait by qualified name.
+		self.tables = {}
+		# The overload that calls with the given argument types resolve to, by overload set and types.
+		self.resolutions = {}
+		self.build()
+
+	# Returns the qualified name of the struct or trait that `name` refers to in `namespace`, or None.
+	def resolveTypeName(self, name, namespace):
+		key = (namespace, name)
+		if key in self.resolved:
+			return self.resolved[key]
+		qualifiedType = None
+		for qualifiedName in (namespace + "." + name, name):
+			symbol = self.object.getSymbol(qualifiedName)
+			for library in self.libraries:
+				if symbol is not None:
+					break
+				symbol = library.getPublicSymbol(qualifiedName)
+			if symbol is not None:
+				if not isinstance(symbol, (dict, OverloadSet)) and isinstance(symbol.value, Node) and symbol.value.kind in compositeKinds:
+					qualifiedType = qualifiedName
+				break
+		self.resolved[key] = qualifiedType
+		return qualifiedType
+
+	# Returns the qualified name of the struct or trait of the receiver of the function or method `symbol`,
+	# or None.
+	def getReceiverType(self, symbol):
+		if symbol.type is None or not symbol.type.parameters:
+			return None
+		target = getTargetType(symbol.type.parameters[0])
+		if not isinstance(target, BasicType) or target.arguments:
+			return None
+		return self.resolveTypeName(target.name, symbol.name.rpartition(".")[0])
+
+	# Returns the qualified names of `name` and the types it uses, directly or not, nearest first.
+	def getLinearization(self, name):
+		linearization = self.linearizations.get(name)
+		if linearization is None:
+			linearization = []
+			seen = set()
+			queue = [name]
+			# Breadth first, so a type's own uses come before those of the types it uses.
+			while queue:
+				current = queue.pop(0)
+				if current in seen:
+					continue
+				seen.add(current)
+				linearization.append(current)
+				queue.extend(self.compositions.get(current, ()))
+			linearization = self.linearizations[name] = tuple(linearization)
+		return linearization
+
+	def build(self):
+		implementations = {}
+		for symbols in (self.object.publicSymbols, self.object.privateSymbols):
+			for (name, value) in symbols.items():
+				if isinstance(value, dict):
+					continue
+				if isinstance(value, OverloadSet) or isOverloadable(value):
+					for symbol in getOverloads(value):
+						receiver = self.getReceiverType(symbol)
+						if symbol.value.kind != methodDefinitionKind:
+							if receiver is not None:
+								implementations[(name, receiver)] = symbol
+						elif receiver is None:
+							definitionName = symbol.value.children[2 if symbol.value.children[0].text == "pub" else 1]
+							self.errors.append(DispatchError(f"The receiver of the method `{name}` must be a struct or trait, or a pointer to one.", definitionName.start, definitionName.end))
+						elif (name, receiver) not in self.slots:
+							self.slots[(name, receiver)] = len(self.methods)
+							self.methods.append((symbol, receiver))
+				elif isinstance(value.value, Node) and value.value.kind in compositeKinds:
+					self.compositions[name] = self.getUsedTypes(value.value, name.rpartition(".")[0])
+		for name in self.compositions:
+			table = self.tables[name] = [None]*len(self.methods)
+			linearization = self.getLinearization(name)
+			for (slot, (method, receiver)) in enumerate(self.methods):
+				if receiver not in linearization:
+					continue
+				for type in linearization:
+					implementation = implementations.get((method.name, type))
+					if implementation is not None:
+						table[slot] = implementation
+						break
+
+	# Returns the qualified names of the structs and traits that the struct or trait `tree` uses.
+	def getUsedTypes(self, tree, namespace):
+		used = []
+		for child in tree.children:
+			if isinstance(child, Node) and child.kind == structBodyKind:
+				for member in child.children:
+					if isinstance(member, Node) and member.kind == usingTypeKind:
+						for type in member.children:
+							if isinstance(type, Node) and type.kind in typeKinds:
+								target = getTargetType(internType(type))
+								if isinstance(target, BasicType) and (usedName := self.resolveTypeName(target.name, namespace)) is not None:
+									used.append(usedName)
+		return tuple(used)
+
+	# Returns the slot of the method `name` declared on the type `receiver`, or None.
+	def getSlot(self, name, receiver):
+		return self.slots.get((name, receiver))
+
+	# Returns the function that implements `slot` for values of the type `type`, which is one lookup in the
+	# table of the type, or None if the type has no implementation.
+	def dispatch(self, type, slot):
+		table = self.tables.get(type)
+		return None if table is None else table[slot]
+
+	# Returns the number of conversions that passing a value of type `argument` as `parameter` takes (0 if
+	# they are the same), or None if it can't be passed. A pointer to a type converts to a pointer to a type
+	# it uses, and `mut` can be dropped. Names are looked up in `namespace`.
+	def getConversionCost(self, argument, parameter, namespace):
+		if argument is parameter:
+			return 0
+		if isinstance(argument, MutableType) and not isinstance(parameter, MutableType):
+			cost = self.getConversionCost(argument.target, parameter, namespace)
+			return None if cost is None else cost + 1
+		if isinstance(argument, PointerType) and isinstance(parameter, PointerType):
+			(argumentTarget, parameterTarget) = (getTargetType(argument.target), parameter.target)
+			if isinstance(parameterTarget, MutableType) and not isinstance(argument.target, MutableType):
+				return None
+			parameterTarget = getTargetType(parameterTarget)
+			if argumentTarget is parameterTarget:
+				return 1
+			if isinstance(argumentTarget, BasicType) and isinstance(parameterTarget, BasicType):
+				argumentName = self.resolveTypeName(argumentTarget.name, namespace)
+				parameterName = self.resolveTypeName(parameterTarget.name, namespace)
+				if argumentName is not None and parameterName is not None:
+					linearization = self.getLinearization(argumentName)
+					if parameterName in linearization:
+						return 1 + linearization.index(parameterName)
+		return None
+
+	# Returns the overload of `overloads` (an overload set or a symbol) that a call with arguments of the
+	# canonical types `argumentTypes` resolves to, or None if no overload or more than one fits best. The
+	# overload whose parameters need the fewest conversions wins. The result is remembered for each set and
+	# argument types, so every call with the same signature after the first costs one lookup. Resolving to
+	# a method means that the call is dispatched at runtime, through `dispatch`.
+	def resolveCall(self, overloads, argumentTypes):
+		argumentTypes = tuple(argumentTypes)
+		key = (overloads.name, argumentTypes)
+		if key in self.resolutions:
+			return self.resolutions[key]
+		namespace = overloads.name.rpartition(".")[0]
+		(best, bestCost) = (None, None)
+		for symbol in getOverloads(overloads):
+			parameters = symbol.type.parameters if symbol.type is not None else ()
+			if len(parameters) != len(argumentTypes):
+				continue
+			cost = 0
+			for (argument, parameter) in zip(argumentTypes, parameters):
+				conversionCost = self.getConversionCost(argument, parameter, namespace)
+				if conversionCost is None:
+					break
+				cost += conversionCost
+			else:
+				if bestCost is None or cost < bestCost:
+					(best, bestCost) = (symbol, cost)
+				elif cost == bestCost:
+					best = None
+		self.resolutions[key] = best
+		return best
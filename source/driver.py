@@ -0,0 +1,122 @@
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+import functools
+import os
+import sys
+from lexer import *
+from parser import *
+from object import *
+from cache import *
+from objectfile import *
+
+sourceExtension = ".src"
+
+# The result of compiling one source file.
+class FileResult:
+	def __init__(self, path, tree, object, errors):
+		self.path = path
+		self.tree = tree
+		self.object = object
+		self.errors = errors
+
+	def __repr__(self):
+		return self.path
+
+# Returns the source files under `directory` in a fixed order.
+def findSourceFiles(directory):
+	paths = []
+	for (root, directories, files) in os.walk(directory):
+		directories.sort()
+		paths.extend(os.path.join(root, file) for file in sorted(files) if file.endswith(sourceExtension))
+	return paths
+
+# Returns the build cache in `directory`, opening it once per process.
+@functools.cache
+def openCache(directory):
+	return BuildCache(directory)
+
+# Returns the object file at `path`, opening it once per process.
+@functools.cache
+def openLibrary(path):
+	return ObjectFile(path)
+
+# Lexes, parses and validates one file on its own, linking against the object files in `libraryPaths`.
+# Lexing and parsing are skipped when the build cache in `cacheDirectory` has the file. Generic instances
+# are looked up in and added to `instantiations`, if given.
+def compileFile(path, cacheDirectory=None, libraryPaths=(), instrumentation=None, instantiations=None):
+	with measure(instrumentation, "compile", path=path):
+		with open(path, encoding="utf-8") as file:
+			text = file.read()
+		cache = None if cacheDirectory is None else openCache(cacheDirectory)
+		(tokens, tree, lexerErrors, parserErrors) = lexAndParse(text, cache, instrumentation)
+		(object, compilerErrors) = validate(tree, [openLibrary(libraryPath) for libraryPath in libraryPaths], instrumentation=instrumentation, instantiations=instantiations)
+		errors = lexerErrors + parserErrors + compilerErrors
+		locateErrors(errors, text)
+	return FileResult(path, tree, object, errors)
+
+# Compiles the files at `paths`, spreading them over `jobs` processes (one per core by default). Returns
+# the result of each file in the same order. The files are compiled in this process when they are
+# measured by `instrumentation`, since it can't collect measurements from other processes. The files
+# compiled in this process share their generic instances, so an instance of a library definition is only
+# checked once.
+def compileFiles(paths, jobs=None, cacheDirectory=None, libraryPaths=(), instrumentation=None):
+	compile = functools.partial(compileFile, cacheDirectory=cacheDirectory, libraryPaths=tuple(libraryPaths), instrumentation=instrumentation)
+	if jobs == 1 or len(paths) <= 1 or instrumentation is not None:
+		instantiations = InstantiationCache()
+		results = [compile(path, instantiations=instantiations) for path in paths]
+	else:
+		with ProcessPoolExecutor(jobs) as executor:
+			results = list(executor.map(compile, paths, chunksize=max(1, len(paths)//(4*(jobs or os.cpu_count() or 1)))))
+	if cacheDirectory is not None:
+		openCache(cacheDirectory).evict()
+	return results
+
+# Merges the objects of `results` in order into one object, adding an error to a result for each symbol
+# it defines again.
+def mergeResults(results):
+	object = Object()
+	for result in results:
+		for name in object.merge(result.object):
+			result.errors.append(CompilerError(f"Redefinition of symbol `{name}`."))
+	return object
+
+# Compiles every source file under `directory`. The objects of the files are merged in path order, so the
+# result and the order of the errors don't depend on the number of jobs. Returns the merged object and
+# the result of each file.
+def compileProject(directory, jobs=None, cacheDirectory=None, libraryPaths=(), instrumentation=None):
+	results = compileFiles(findSourceFiles(directory), jobs, cacheDirectory, libraryPaths, instrumentation)
+	return (mergeResults(results), results)
+
+def main(arguments=None):
+	argumentParser = argparse.ArgumentParser(description="Compiles a project directory.")
+	argumentParser.add_argument("directory")
+	argumentParser.add_argument("-j", "--jobs", type=int, default=None, help="number of processes (default: one per core)")
+	argumentParser.add_argument("--cache", default=None, help="directory of the build cache")
+	argumentParser.add_argument("-l", "--link", action="append", default=[], help="object file to link against")
+	argumentParser.add_argument("-o", "--output", default=None, help="object file to write")
+	argumentParser.add_argument("--profile", default=None, help="JSON file to write the phase times and counters to (compiles in one process)")
+	argumentParser.add_argument("--trace", default=None, help="Chrome trace event file to write the phases to (compiles in one process)")
+	argumentParser.add_argument("--profile-memory", action="store_true", help="also measure the allocations of each phase, which is much slower")
+	arguments = argumentParser.parse_args(arguments)
+
+	instrumentation = None
+	if arguments.profile is not None or arguments.trace is not None:
+		instrumentation = Instrumentation(arguments.profile_memory)
+	(object, results) = compileProject(arguments.directory, arguments.jobs, arguments.cache, arguments.link, instrumentation)
+	errorCount = 0
+	for result in results:
+		if result.errors:
+			print(f"---- {result.path} ----")
+			print("\n".join(map(str, result.errors)))
+			errorCount += len(result.errors)
+	print(f"Compiled {len(results)} files with {errorCount} errors.")
+	if arguments.output is not None and not errorCount:
+		writeObjectFile(arguments.output, object)
+	if arguments.profile is not None:
+		instrumentation.writeReport(arguments.profile)
+	if arguments.trace is not None:
+		instrumentation.writeTrace(arguments.trace)
+	return 1 if errorCount else 0
+
+if __name__ == "__main__":
+	sys.exit(main())
@@ -0,0 +1,290 @@
+import os
+import random
+
+# The shapes of programs that `ProgramGenerator` can make. Each one leans on a different part of the
+# compiler, while every program still has some of everything.
+programShapes = ("mixed", "expressions", "namespaces", "structs", "bodies", "generics")
+
+binaryOperators = ["+", "-", "*", "/", "%", "<<", ">>", "&", "|", "^", "==", "!=", "<", "<=", ">", ">=", "and", "or", "xor"]
+prefixOperators = ["-", "+", "~", "not "]
+basicTypes = ["int8", "int16", "int32", "int64", "uint8", "uint32", "float32", "float64", "bool"]
+
+# Makes programs that lex, parse and validate without errors. The same seed and settings always give the
+# same text, so a benchmark measures the same work each time. `size` is roughly the number of top-level
+# definitions and `shape` (see `programShapes`) decides which kind gets most of them.
+class ProgramGenerator:
+	def __init__(self, seed=0, size=100, shape="mixed", expressionDepth=6, nestingDepth=24, bodyLength=12, namespaceCount=16):
+		if shape not in programShapes:
+			raise ValueError(f"Unknown program shape `{shape}`.")
+		self.random = random.Random(seed)
+		self.size = size
+		self.shape = shape
+		self.expressionDepth = expressionDepth
+		# How deeply the parentheses of the nested expressions of the "expressions" shape go.
+		self.nestingDepth = nestingDepth
+		self.bodyLength = bodyLength
+		self.namespaceCount = namespaceCount
+		self.nameCount = 0
+		self.lines = []
+		self.indentation = 0
+		# The local names in scope in the function being generated, and the loops around the current
+		# statement.
+		self.locals = []
+		self.loopDepth = 0
+		# The number of statements left for the function being generated.
+		self.statementBudget = 0
+		self.globals = []
+		self.structs = []
+		# The generic structs with their numbers of parameters, and the parameters of the one being generated.
+		self.genericStructs = []
+		self.typeParameters = []
+
+	# Returns a name that wasn't used before in the program.
+	def newName(self, prefix):
+		self.nameCount += 1
+		return f"{prefix}{self.nameCount}"
+
+	def addLine(self, line):
+		self.lines.append("\t"*self.indentation + line)
+
+	def generateType(self, depth=0):
+		roll = self.random.random()
+		if depth < 2 and roll < 0.1:
+			return f"[{self.random.randint(1, 64)}]{self.generateType(depth + 1)}"
+		if depth < 2 and roll < 0.2:
+			return f"&{self.generateType(depth + 1)}"
+		if depth < 2 and roll < 0.25:
+			return f"({self.generateType(depth + 1)}, {self.generateType(depth + 1)})"
+		if self.genericStructs and depth < 2 and roll < 0.45:
+			(name, parameterCount) = self.random.choice(self.genericStructs)
+			return f"{name}<{', '.join(self.generateType(depth + 1) for _ in range(parameterCount))}>"
+		if self.typeParameters and roll < 0.7:
+			return self.random.choice(self.typeParameters)
+		if self.structs and roll < 0.35:
+			return self.random.choice(self.structs)
+		return self.random.choice(basicTypes)
+
+	def generateLeaf(self):
+		roll = self.random.random()
+		names = self.locals or self.globals
+		if names and roll < 0.6:
+			return self.random.choice(names)
+		if roll < 0.9:
+			return str(self.random.randint(0, 1000))
+		if roll < 0.95:
+			return f"'{self.random.choice('abcxyz')}'"
+		return f"\"{self.random.choice(['text', 'value', 'name'])}\""
+
+	# Returns an expression whose operators nest at most `depth` deep.
+	def generateExpression(self, depth=None):
+		if depth is None:
+			depth = self.random.randint(1, self.expressionDepth)
+		if depth <= 0:
+			return self.generateLeaf()
+		roll = self.random.random()
+		if roll < 0.5:
+			operator = self.random.choice(binaryOperators)
+			return f"{self.generateExpression(depth - 1)} {operator} {self.generateRightOperand(operator, depth - 1)}"
+		if roll < 0.6:
+			return f"{self.random.choice(prefixOperators)}{self.generateExpression(depth - 1)}"
+		if roll < 0.7:
+			return f"({self.generateExpression(depth - 1)})"
+		if roll < 0.8:
+			arguments = ", ".join(self.generateExpression(depth - 1) for _ in range(self.random.randint(0, 3)))
+			return f"{self.generateLeaf() if self.locals else 'run'}({arguments})"
+		if roll < 0.85:
+			return f"{self.generateLeaf()}[{self.generateExpression(depth - 1)}]"
+		if roll < 0.9:
+			return f"{self.generateLeaf()}.{self.random.choice(['x', 'y', 'size'])}"
+		if roll < 0.95:
+			return f"{self.generateLeaf()}->{self.random.choice(['get', 'map', 'clamp'])}({self.generateExpression(depth - 1)})"
+		return f"{self.generateExpression(depth - 1)} as {self.random.choice(basicTypes)}"
+
+	# Returns the right operand of `operator`. Divisors are positive numbers, so no constant expression
+	# divides by zero.
+	def generateRightOperand(self, operator, depth):
+		if operator == "/" or operator == "%":
+			return str(self.random.randint(1, 100))
+		return self.generateExpression(depth)
+
+	# Returns an expression nested in `depth` levels of parentheses, each with an operator around it.
+	def generateNestedExpression(self, depth):
+		expression = self.generateLeaf()
+		for _ in range(depth):
+			operator = self.random.choice(binaryOperators)
+			expression = f"({expression} {operator} {self.generateRightOperand(operator, 0)})"
+		return expression
+
+	def generateBlock(self, length):
+		self.addLine("{")
+		self.indentation += 1
+		scopeSize = len(self.locals)
+		for _ in range(length):
+			if self.statementBudget <= 0:
+				break
+			self.generateStatement()
+		del self.locals[scopeSize:]
+		self.indentation -= 1
+		self.addLine("}")
+
+	# Adds a statement of a function body. The statements in compound statements count against the budget
+	# of the function too, so a body has about as many statements as it was given.
+	def generateStatement(self):
+		self.statementBudget -= 1
+		roll = self.random.random()
+		if self.indentation > 6:
+			roll *= 0.5
+		if roll < 0.25:
+			name = self.newName("v")
+			self.addLine(f"var {name} {self.random.choice(basicTypes)} = {self.generateExpression()};")
+			self.locals.append(name)
+		elif roll < 0.45 and self.locals:
+			self.addLine(f"{self.random.choice(self.locals)} = {self.generateExpression()};")
+		elif roll < 0.55:
+			self.addLine(f"{self.generateExpression()};")
+		elif roll < 0.6 and self.loopDepth:
+			self.addLine(self.random.choice(["break;", "continue;"]))
+		elif roll < 0.7:
+			self.addLine(f"if {self.generateExpression()}")
+			self.generateBlock(self.random.randint(1, 3))
+			while self.random.random() < 0.3:
+				self.addLine(f"else if {self.generateExpression()}")
+				self.generateBlock(self.random.randint(1, 3))
+			if self.random.random() < 0.5:
+				self.addLine("else")
+				self.generateBlock(self.random.randint(1, 3))
+		elif roll < 0.8:
+			self.addLine(f"while {self.generateExpression()}")
+			self.loopDepth += 1
+			self.generateBlock(self.random.randint(1, 4))
+			self.loopDepth -= 1
+		elif roll < 0.9:
+			name = self.newName("i")
+			self.addLine(f"for {name} {self.random.choice(basicTypes)} in {self.generateExpression()}")
+			self.locals.append(name)
+			self.loopDepth += 1
+			self.generateBlock(self.random.randint(1, 4))
+			self.loopDepth -= 1
+			self.locals.remove(name)
+		elif roll < 0.95:
+			self.generateBlock(self.random.randint(1, 3))
+		else:
+			self.addLine(f"return {self.generateExpression()};")
+
+	def generateFunction(self, bodyLength):
+		name = self.newName("f")
+		parameters = [(self.newName("p"), self.generateType()) for _ in range(self.random.randint(0, 4))]
+		self.locals = [parameter for (parameter, _) in parameters]
+		self.loopDepth = 0
+		self.statementBudget = bodyLength
+		pub = "pub " if self.random.random() < 0.5 else ""
+		self.addLine(f"{pub}func {name}({', '.join(f'{parameter} {type}' for (parameter, type) in parameters)}) {self.random.choice(basicTypes)}")
+		self.generateBlock(bodyLength)
+		self.locals = []
+
+	def generateExpressionFunction(self):
+		self.locals = ["a", "b", "c", "d"]
+		self.addLine(f"func {self.newName('f')}(a int32, b int32, c int32, d int32) int32 {{")
+		self.indentation += 1
+		for _ in range(self.bodyLength):
+			self.addLine(f"a = {self.generateNestedExpression(self.nestingDepth)};")
+			self.addLine(f"b = {self.generateExpression(self.expressionDepth)};")
+		self.addLine("return a;")
+		self.indentation -= 1
+		self.addLine("}")
+		self.locals = []
+
+	def generateStruct(self, fieldCount, caseCount):
+		name = self.newName("S")
+		pub = "pub " if self.random.random() < 0.5 else ""
+		kind = "trait" if self.random.random() < 0.2 else "struct"
+		self.addLine(f"{pub}{kind} {name} {{")
+		self.indentation += 1
+		for _ in range(fieldCount):
+			self.addLine(f"{'pub ' if self.random.random() < 0.3 else ''}{self.newName('m')} {self.generateType()};")
+		if self.structs and self.random.random() < 0.3:
+			self.addLine(f"using {self.random.choice(self.structs)};")
+		self.indentation -= 1
+		if caseCount:
+			self.addLine("} cases {")
+			self.indentation += 1
+			for i in range(caseCount):
+				roll = self.random.random()
+				if roll < 0.6:
+					self.addLine(f"{self.newName('C')};")
+				elif roll < 0.8:
+					self.addLine(f"{self.newName('C')} = {i};")
+				else:
+					self.addLine(f"struct {self.newName('S')} {{ {self.newName('m')} {self.generateType()}; }}")
+			self.indentation -= 1
+		self.addLine("}")
+		self.structs.append(name)
+		if self.random.random() < 0.5:
+			self.addLine(f"{pub}method {self.newName('m')}(self &{name}, x {self.generateType()}) {self.random.choice(basicTypes)};")
+
+	# Adds a struct with generic parameters, whose fields use its parameters and the generic structs before
+	# it, so instantiating it instantiates those too.
+	def generateGenericStruct(self, fieldCount):
+		name = self.newName("G")
+		self.typeParameters = [self.newName("T") for _ in range(self.random.randint(1, 3))]
+		self.addLine(f"pub struct {name}<{', '.join(f'type {parameter}' for parameter in self.typeParameters)}> {{")
+		self.indentation += 1
+		for _ in range(fieldCount):
+			self.addLine(f"{self.newName('m')} {self.generateType()};")
+		self.indentation -= 1
+		self.addLine("}")
+		self.genericStructs.append((name, len(self.typeParameters)))
+		self.typeParameters = []
+
+	def generateGlobal(self):
+		name = self.newName("g")
+		pub = "pub " if self.random.random() < 0.5 else ""
+		self.addLine(f"{pub}var {name} {self.random.choice(basicTypes)} = {self.generateExpression()};")
+		self.globals.append(name)
+
+	def generateUsings(self, namespace, count):
+		for _ in range(count):
+			used = f"bench.n{self.random.randrange(self.namespaceCount)}"
+			if used != namespace:
+				self.addLine(f"using {used}{'.*' if self.random.random() < 0.5 else ''};")
+
+	# Returns the text of a program in the namespace `namespace`.
+	def generate(self, namespace="bench.n0"):
+		self.lines = []
+		self.addLine(f"pub namespace {namespace};")
+		shape = self.shape
+		self.generateUsings(namespace, self.size if shape == "namespaces" else max(1, self.size//20))
+		for _ in range(max(1, self.size//10)):
+			self.generateGlobal()
+		for _ in range(self.size):
+			roll = self.random.random()
+			if shape == "structs" or (shape == "mixed" and roll < 0.3):
+				self.generateStruct(self.random.randint(8, 32) if shape == "structs" else self.random.randint(1, 6), self.random.randint(4, 24) if shape == "structs" else self.random.randint(0, 4))
+			elif shape == "expressions":
+				self.generateExpressionFunction()
+			elif shape == "generics" and (roll < 0.3 or not self.genericStructs):
+				self.generateGenericStruct(self.random.randint(2, 8))
+			elif shape == "bodies":
+				self.generateFunction(self.bodyLength*8)
+			elif shape == "namespaces" and roll < 0.5:
+				self.generateGlobal()
+			else:
+				self.generateFunction(self.bodyLength)
+		return "\n".join(self.lines) + "\n"
+
+# Returns a program made by `ProgramGenerator` with these settings.
+def generateProgram(seed=0, size=100, shape="mixed", **settings):
+	return ProgramGenerator(seed, size, shape, **settings).generate()
+
+# Writes a project of `fileCount` programs to `directory`, one per namespace, which use each other's
+# namespaces. Returns the paths of the files.
+def generateProject(directory, fileCount=16, seed=0, size=50, shape="mixed", **settings):
+	paths = []
+	for i in range(fileCount):
+		generator = ProgramGenerator(seed*fileCount + i, size, shape, namespaceCount=fileCount, **settings)
+		path = os.path.join(directory, f"n{i}.src")
+		os.makedirs(directory, exist_ok=True)
+		with open(path, "w", encoding="utf-8") as file:
+			file.write(generator.generate(f"bench.n{i}"))
+		paths.append(path)
+	return paths
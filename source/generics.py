@@ -0,0 +1,280 @@
+from lexer import *
+from parser import *
+from walker import *
+from typetable import *
+from dispatch import *
+
+# How deeply instantiations may cause each other before a definition counts as expanding forever, like a
+# `struct List<type T>` with a field of type `List<&T>`.
+maxInstantiationDepth = 64
+
+definitionKinds = frozenset(map(nodeKindOf, ["struct definintion", "trait definintion", "function definition", "method definition"]))
+genericParametersKind = nodeKindOf("generic parameters")
+typeParameterKind = nodeKindOf("type parameter")
+basicTypeKind = nodeKindOf("basic type")
+structBodyKind = nodeKindOf("struct body")
+structFieldKind = nodeKindOf("struct field")
+qualifiedNameKind = nodeKindOf("qualified name")
+
+# An error in a use of a generic definition, like a wrong number of generic arguments.
+class InstantiationError:
+	def __init__(self, message, start=None, end=None):
+		self.message = message
+		self.start = start
+		self.end = end
+		self.location = None
+
+	def __repr__(self):
+		return formatErrorMessage(self, self.message)
+
+# Returns the generic parameters node of the definition `tree`, or None if it isn't generic.
+def getGenericParameters(tree):
+	for child in tree.children:
+		if isinstance(child, Node) and child.kind == genericParametersKind:
+			return child
+	return None
+
+# A struct, trait, function or method definition with generic parameters, as it is instantiated. The
+# types in the definition are interned once, so each instance only substitutes canonical types.
+class GenericDefinition:
+	def __init__(self, name, tree, typeTable):
+		self.name = name
+		self.namespace = name.rpartition(".")[0]
+		self.tree = tree
+		# The name of each parameter, None if it has none, and whether its argument must be a type. `type T`,
+		# `struct T` and `trait T` take types, while a parameter like `N` takes a constant.
+		self.parameters = []
+		for child in getGenericParameters(tree).children:
+			if not isinstance(child, Node):
+				continue
+			if child.kind == typeParameterKind:
+				name = child.children[-1]
+				self.parameters.append((name.text if name.type == "identifier" else None, True))
+			elif child.kind == basicTypeKind and len(child.children) == 1:
+				self.parameters.append((child.children[0].text, False))
+			else:
+				self.parameters.append((None, False))
+		# Every distinct type written in the definition, outside of its generic parameters.
+		types = {}
+		stack = [child for child in tree.children if isinstance(child, Node) and child.kind != genericParametersKind]
+		while stack:
+			node = stack.pop()
+			if node.kind in typeKinds:
+				types[typeTable.intern(node)] = None
+			else:
+				stack.extend(child for child in node.children if isinstance(child, Node))
+		self.types = list(types)
+		# The fields of a struct or trait by name, and the type of a function or method.
+		self.fields = []
+		self.type = None
+		for child in tree.children:
+			if not isinstance(child, Node):
+				continue
+			if child.kind == structBodyKind:
+				for field in child.children:
+					if isinstance(field, Node) and field.kind == structFieldKind:
+						# A field with a syntax error may have no name, and is left out, or no type.
+						name = next((token for token in field.children if isinstance(token, Token) and token.type == "identifier"), None)
+						type = next((child for child in field.children if isinstance(child, Node) and child.kind in typeKinds), None)
+						if name is not None:
+							self.fields.append((name.text, typeTable.internChild(type)))
+			elif child.kind == functionParametersKind:
+				self.type = typeTable.internSignature(tree)
+
+	def __repr__(self):
+		return self.name
+
+	# Returns why `arguments` can't instantiate the definition, or None if they can.
+	def checkArguments(self, arguments):
+		if len(arguments) != len(self.parameters):
+			return f"`{self.name}` takes {len(self.parameters)} generic argument{'' if len(self.parameters) == 1 else 's'}, not {len(arguments)}."
+		for ((name, takesType), argument) in zip(self.parameters, arguments):
+			if takesType and argument is not None and not isinstance(argument, Type):
+				return f"The generic parameter `{name}` of `{self.name}` takes a type, not `{argument}`."
+		return None
+
+# A generic definition with its parameters replaced by arguments. `type` is the instantiated type: a basic
+# type with the arguments for a struct or trait, and the function type for a function or method. `errors`
+# has the messages of the instantiations that this one caused and that failed.
+class Instance:
+	def __init__(self, definition, arguments):
+		self.definition = definition
+		self.arguments = arguments
+		self.type = None
+		self.fields = {}
+		self.errors = []
+
+	def __repr__(self):
+		return f"{self.definition.name}<{', '.join(map(formatTypePart, self.arguments))}>"
+
+# The instances of generic definitions by definition and canonical arguments. Since equal arguments are
+# the same objects, an instance is found with one hash however it was spelled, and each one is made and
+# checked once. A cache can be shared by the files that use the same libraries, as `compileFiles` does.
+class InstantiationCache:
+	def __init__(self):
+		self.definitions = {}
+		self.instances = {}
+		# The generic types in each canonical type, including itself.
+		self.genericUses = {}
+		self.hits = 0
+		self.misses = 0
+
+	# Returns the `GenericDefinition` of the definition `tree` named `name`.
+	def getDefinition(self, name, tree, typeTable):
+		definition = self.definitions.get(tree)
+		if definition is None:
+			definition = self.definitions[tree] = GenericDefinition(name, tree, typeTable)
+		return definition
+
+	def getInstance(self, definition, arguments):
+		instance = self.instances.get((definition, arguments))
+		if instance is None:
+			self.misses += 1
+		else:
+			self.hits += 1
+		return instance
+
+	def addInstance(self, instance):
+		self.instances[(instance.definition, instance.arguments)] = instance
+
+	# Returns the basic types with generic arguments in the type `type`.
+	def getGenericUses(self, type):
+		uses = self.genericUses.get(type)
+		if uses is None:
+			uses = []
+			stack = [type]
+			while stack:
+				part = stack.pop()
+				if isinstance(part, Type):
+					if isinstance(part, BasicType) and part.arguments:
+						uses.append(part)
+					stack.extend(part.getParts())
+			uses = self.genericUses[type] = tuple(uses)
+		return uses
+
+	def statistics(self):
+		return {"definitions": len(self.definitions), "instances": len(self.instances), "hits": self.hits, "misses": self.misses}
+
+# Instantiates the generic definitions that a program uses. A use is a basic type with generic arguments
+# outside of any generic definition. The uses are collected while walking the program, along with the
+# declarations, and instantiated once all symbols are known. The name that a use refers to is looked up in
+# its namespace, then as it is written, in the object of the program and the public symbols of
+# `libraries`. Each new instance has the types in its definition substituted, and the generic types that
+# they use are instantiated in turn.
+class Instantiator(Analysis):
+	enterHandlers = {
+		"namespace statement": "visitNamespaceStatement",
+		"struct definintion": "enterDefinition",
+		"trait definintion": "enterDefinition",
+		"function definition": "enterDefinition",
+		"method definition": "enterDefinition",
+		"generic arguments": "visitGenericArguments",
+	}
+	exitHandlers = {
+		"struct definintion": "exitDefinition",
+		"trait definintion": "exitDefinition",
+		"function definition": "exitDefinition",
+		"method definition": "exitDefinition",
+	}
+
+	def __init__(self, libraries=(), cache=None, typeTable=None, instrumentation=None):
+		self.object = None
+		self.libraries = libraries
+		self.cache = cache or InstantiationCache()
+		self.typeTable = typeTable or defaultTypeTable
+		self.errors = []
+		self.currentNamespace = ""
+		# The number of generic definitions around the node being walked.
+		self.genericDepth = 0
+		# The basic type nodes of the uses, with their namespaces.
+		self.uses = []
+		# The definitions that names resolved to, by namespace and name.
+		self.resolved = {}
+		if instrumentation is not None:
+			instrumentation.countLookups(self, ("resolve", "lookUpInstance"))
+
+	# Returns the generic definition that the type name `name` refers to in `namespace`, or None.
+	def resolve(self, name, namespace):
+		key = (namespace, name)
+		if key in self.resolved:
+			return self.resolved[key]
+		definition = None
+		for qualifiedName in (namespace + "." + name, name):
+			symbol = self.object.getSymbol(qualifiedName)
+			for library in self.libraries:
+				if symbol is not None:
+					break
+				symbol = library.getPublicSymbol(qualifiedName)
+			if symbol is not None:
+				if not isinstance(symbol, (dict, OverloadSet)) and isinstance(symbol.value, Node) and symbol.value.kind in definitionKinds and getGenericParameters(symbol.value) is not None:
+					definition = self.cache.getDefinition(qualifiedName, symbol.value, self.typeTable)
+				break
+		self.resolved[key] = definition
+		return definition
+
+	def lookUpInstance(self, definition, arguments):
+		return self.cache.getInstance(definition, arguments)
+
+	# Returns the instance of `definition` with `arguments`, making and checking it if it is new.
+	def instantiate(self, definition, arguments, depth=0):
+		instance = self.lookUpInstance(definition, arguments)
+		if instance is not None:
+			return instance
+		instance = Instance(definition, arguments)
+		# The instance is cached before it is checked, so a definition that uses itself finds it.
+		self.cache.addInstance(instance)
+		if depth > maxInstantiationDepth:
+			instance.errors.append(f"The instantiations of `{definition.name}` are nested too deeply.")
+			return instance
+		substitution = {name: argument for ((name, _), argument) in zip(definition.parameters, arguments) if name is not None}
+		memo = {}
+		if definition.type is None:
+			instance.type = self.typeTable.getBasicType(definition.name, arguments)
+		else:
+			instance.type = self.typeTable.substitute(definition.type, substitution, memo)
+		instance.fields = {name: self.typeTable.substitute(type, substitution, memo) for (name, type) in definition.fields}
+		for type in definition.types:
+			for use in self.cache.getGenericUses(self.typeTable.substitute(type, substitution, memo)):
+				error = self.instantiateUse(use, definition.namespace, depth + 1)
+				if error is not None and error not in instance.errors:
+					instance.errors.append(error)
+		return instance
+
+	# Instantiates the definition that the generic type `use` refers to in `namespace`, if it refers to one.
+	# Returns an error message if the use is wrong or its instance failed, or None.
+	def instantiateUse(self, use, namespace, depth=0):
+		definition = self.resolve(use.name, namespace)
+		if definition is None:
+			return None
+		error = definition.checkArguments(use.arguments)
+		if error is not None:
+			return error
+		instance = self.instantiate(definition, use.arguments, depth)
+		return instance.errors[0] if instance.errors else None
+
+	def visitNamespaceStatement(self, tree, parent):
+		for child in tree.children:
+			if isinstance(child, Node) and child.kind == qualifiedNameKind:
+				self.currentNamespace = "".join(token.text for token in child.children if isinstance(token, Token))
+
+	def enterDefinition(self, tree, parent):
+		if getGenericParameters(tree) is not None:
+			self.genericDepth += 1
+
+	def exitDefinition(self, tree, parent):
+		if getGenericParameters(tree) is not None:
+			self.genericDepth -= 1
+
+	# The uses in generic definitions are instantiated with the definitions, once their parameters are known.
+	def visitGenericArguments(self, tree, parent):
+		if not self.genericDepth and parent is not None and parent.kind == basicTypeKind:
+			self.uses.append((parent, self.currentNamespace))
+
+	# Instantiates the uses collected from a program whose symbols are in `object`. Returns the errors.
+	def instantiateUses(self, object):
+		self.object = object
+		for (tree, namespace) in self.uses:
+			error = self.instantiateUse(self.typeTable.intern(tree), namespace)
+			if error is not None:
+				self.errors.append(InstantiationError(error, tree.start, tree.end))
+		return self.errors
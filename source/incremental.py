@@ -0,0 +1,154 @@
+from lexer import *
+from parser import *
+
+# A replacement of the text from `start` to `end` with `text`.
+class TextEdit:
+	def __init__(self, start, end, text):
+		self.start = start
+		self.end = end
+		self.text = text
+
+	def __repr__(self):
+		return f"TextEdit({self.start}, {self.end}, {self.text!r})"
+
+	def apply(self, text):
+		return text[:self.start] + self.text + text[self.end:]
+
+def firstToken(node):
+	while isinstance(node, Node):
+		node = node.children[0]
+	return node
+
+def lastToken(node):
+	while isinstance(node, Node):
+		node = node.children[-1]
+	return node
+
+# Returns whether the tokens of `node` cover the text from `start` to `end`.
+def covers(node, start, end):
+	return firstToken(node).start <= start and end <= lastToken(node).end
+
+# Returns the range of statements in `container` to reparse for an edit from `start` to `end`: the
+# statements that touch the edit, or the statements on either side if it falls between two. Returns None
+# if the edit touches a namespace statement or there are no statements.
+def findStatements(container, start, end):
+	statements = container.children
+	if container.type == "block":
+		(first, last) = (1, len(statements) - 1)
+	elif statements and statements[0].type == "namespace statement":
+		if start <= lastToken(statements[0]).end:
+			return None
+		(first, last) = (1, len(statements))
+	else:
+		(first, last) = (0, len(statements))
+	if first == last and container.type != "block":
+		return None
+	low = first
+	while low < last and lastToken(statements[low]).end < start:
+		low += 1
+	high = last
+	while high > first and firstToken(statements[high - 1]).start > end:
+		high -= 1
+	if low >= high:
+		(low, high) = (max(high - 1, first), min(low + 1, last))
+	return (low, high)
+
+# Returns the innermost block of `node` whose braces enclose the text from `start` to `end`.
+def findBlock(node, start, end):
+	block = None
+	while isinstance(node, Node):
+		if node.type == "block" and len(node.children) >= 2 and node.children[0].end <= start and end <= node.children[-1].start:
+			block = node
+		for child in node.children:
+			if isinstance(child, Node) and covers(child, start, end):
+				node = child
+				break
+		else:
+			break
+	return block
+
+# Returns the index of `token` in `tokens`, searching by offset.
+def findTokenIndex(tokens, token):
+	(low, high) = (0, len(tokens))
+	while low < high:
+		middle = (low + high)//2
+		if tokens[middle].start < token.start:
+			low = middle + 1
+		else:
+			high = middle
+	return low
+
+# Lexes and parses `text` from scratch.
+def parseFully(text):
+	(tokens, lexerErrors) = lex(text)
+	(tree, parserErrors) = parse(tokens)
+	return (text, tokens, tree, lexerErrors + parserErrors)
+
+# Applies `edit` to `text` and updates `tokens` and `tree`, which must come from an error-free lex and
+# parse of `text`. Only the statements around the edit, inside the innermost block that encloses it, are
+# relexed and reparsed and spliced back into the tree. Falls back to parsing the whole text whenever the
+# change can't be kept local. Returns the new text, tokens, tree and errors.
+def parseIncremental(tree, tokens, text, edit):
+	newText = edit.apply(text)
+	if not isinstance(tokens, list) or tree is None or tree.type != "program":
+		return parseFully(newText)
+	delta = len(edit.text) - (edit.end - edit.start)
+
+	# Find the smallest run of statements around the edit.
+	container = tree
+	while True:
+		statements = findStatements(container, edit.start, edit.end)
+		if statements is None:
+			return parseFully(newText)
+		(low, high) = statements
+		if high - low != 1 or (block := findBlock(container.children[low], edit.start, edit.end)) is None:
+			break
+		container = block
+
+	# Find the old tokens and text that the run covers.
+	if low < high:
+		firstIndex = findTokenIndex(tokens, firstToken(container.children[low]))
+		endIndex = findTokenIndex(tokens, lastToken(container.children[high - 1])) + 1
+	else:
+		# An empty block, so only the closing brace is left.
+		firstIndex = endIndex = findTokenIndex(tokens, container.children[-1])
+	regionStart = tokens[firstIndex - 1].end if firstIndex > 0 else 0
+	regionEnd = tokens[endIndex].start if endIndex < len(tokens) else len(text)
+	if not (regionStart <= edit.start and edit.end <= regionEnd):
+		return parseFully(newText)
+
+	# Relex the region, which must end right where the old tokens after it start again.
+	errors = []
+	regionTokens = []
+	nextToken = None
+	for token in tokensFromMatches(tokenPattern.finditer(newText, regionStart), errors):
+		if token.start >= regionEnd + delta:
+			nextToken = token
+			break
+		regionTokens.append(token)
+	if errors or (regionTokens and regionTokens[-1].end > regionEnd + delta):
+		return parseFully(newText)
+	if endIndex < len(tokens):
+		oldToken = tokens[endIndex]
+		if nextToken is None or (nextToken.type, nextToken.text, nextToken.start) != (oldToken.type, oldToken.text, oldToken.start + delta):
+			return parseFully(newText)
+	elif nextToken is not None:
+		return parseFully(newText)
+
+	# Reparse the region as a run of statements.
+	newTokens = tokens[:firstIndex] + regionTokens + tokens[endIndex:]
+	regionEndIndex = firstIndex + len(regionTokens)
+	parser = Parser(newTokens)
+	parser.beginNode(container.type)
+	parser.currentTokenIndex = firstIndex
+	parseStatement = parser.parseBlockStatement if container.type == "block" else parser.parseProgramStatement
+	while parser.currentTokenIndex < regionEndIndex and parseStatement(): pass
+	if parser.errors or parser.currentTokenIndex != regionEndIndex or parser.currentNode is not parser.tree:
+		return parseFully(newText)
+
+	# Splice the new statements in and move the tokens after the region.
+	container.children = (*container.children[:low], *parser.tree.children, *container.children[high:])
+	for token in tokens[endIndex:]:
+		token.start += delta
+		token.end += delta
+	return (newText, newTokens, tree, [])
@@ -0,0 +1,157 @@
+import contextlib
+import json
+import os
+import time
+import tracemalloc
+
+# Measurements of a compilation: the wall time (and, with `memory` set, the allocations) of each phase,
+# the calls, successes, backtracks and errors of each parser rule, and the lookups in objects and
+# environments. Nothing is measured unless an instance is passed to `lex`, `parse` or `validate`, which
+# otherwise only enter an empty context per call, and the counters are installed by wrapping the methods
+# of the instances being measured, so the classes themselves never pay for them.
+class Instrumentation:
+	def __init__(self, memory=False):
+		self.memory = memory
+		# Each finished phase is a dictionary with its name, arguments, start and duration in microseconds
+		# and, with `memory` set, the bytes it allocated and its peak above the memory at its start.
+		self.phases = []
+		# The open phases with their start time, memory at the start and highest peak so far.
+		self.openPhases = []
+		# The calls, successes, backtracks and errors of each rule by name.
+		self.ruleCounts = {}
+		# The calls and hits of each lookup by name.
+		self.lookupCounts = {}
+		self.startTime = time.perf_counter_ns()
+		self.startedTracing = False
+
+	# Measures the code run in a `with` block as the phase `name`. Phases can be nested.
+	def phase(self, name, **arguments):
+		return Phase(self, name, arguments)
+
+	def enterPhase(self, name, arguments):
+		(current, peak) = (0, 0)
+		if self.memory:
+			if not tracemalloc.is_tracing():
+				tracemalloc.start()
+				self.startedTracing = True
+			(current, peak) = tracemalloc.get_traced_memory()
+			# The peak is reset for the inner phase, so the outer one remembers its peak up to here.
+			if self.openPhases:
+				self.openPhases[-1][4] = max(self.openPhases[-1][4], peak)
+			tracemalloc.reset_peak()
+		self.openPhases.append([name, arguments, time.perf_counter_ns(), current, current])
+
+	def exitPhase(self):
+		endTime = time.perf_counter_ns()
+		(name, arguments, startTime, startMemory, peak) = self.openPhases.pop()
+		phase = {"name": name, "arguments": arguments, "start": (startTime - self.startTime)/1000, "duration": (endTime - startTime)/1000}
+		if self.memory:
+			(current, tracedPeak) = tracemalloc.get_traced_memory()
+			peak = max(peak, tracedPeak)
+			phase["allocated"] = current - startMemory
+			phase["peak"] = peak - startMemory
+			if self.openPhases:
+				self.openPhases[-1][4] = max(self.openPhases[-1][4], peak)
+			elif self.startedTracing:
+				tracemalloc.stop()
+				self.startedTracing = False
+		self.phases.append(phase)
+
+	# Replaces the rules of `parser` named in `names` with wrappers that count their calls and results. A
+	# rule succeeds with a true result, backtracks with False and stops at an error with None. Must be done
+	# before the parser binds its rules into dispatch tables or wraps them for memoization or recovery.
+	def countRules(self, parser, names):
+		for name in names:
+			setattr(parser, name, self.countRule(getattr(parser, name), self.ruleCounts.setdefault(name, [0, 0, 0, 0])))
+
+	@staticmethod
+	def countRule(rule, counts):
+		def countedRule(*arguments):
+			counts[0] += 1
+			result = rule(*arguments)
+			if result:
+				counts[1] += 1
+			elif result is False:
+				counts[2] += 1
+			elif result is None:
+				counts[3] += 1
+			return result
+		countedRule.__name__ = rule.__name__
+		return countedRule
+
+	# Replaces the lookup methods of `instance` named in `names` with wrappers that count their calls and the
+	# calls that found something (returned neither None nor False), under the name of the class and method.
+	def countLookups(self, instance, names):
+		for name in names:
+			setattr(instance, name, self.countLookup(getattr(instance, name), self.lookupCounts.setdefault(f"{type(instance).__name__}.{name}", [0, 0])))
+
+	@staticmethod
+	def countLookup(lookUp, counts):
+		def countedLookup(*arguments):
+			counts[0] += 1
+			result = lookUp(*arguments)
+			if result is not None and result is not False:
+				counts[1] += 1
+			return result
+		return countedLookup
+
+	# Returns the measurements as a dictionary that can be written as JSON. Each phase name is totaled over
+	# the times it ran.
+	def report(self):
+		totals = {}
+		for phase in self.phases:
+			total = totals.setdefault(phase["name"], {"count": 0, "duration": 0})
+			total["count"] += 1
+			total["duration"] += phase["duration"]
+			if "allocated" in phase:
+				total["allocated"] = total.get("allocated", 0) + phase["allocated"]
+				total["peak"] = max(total.get("peak", 0), phase["peak"])
+		return {
+			"phases": self.phases,
+			"totals": totals,
+			"rules": {name: dict(zip(("calls", "successes", "backtracks", "errors"), counts)) for (name, counts) in sorted(self.ruleCounts.items()) if counts[0]},
+			"lookups": {name: dict(zip(("calls", "hits"), counts)) for (name, counts) in sorted(self.lookupCounts.items()) if counts[0]},
+		}
+
+	# Returns the measurements in the Chrome trace event format, which `chrome://tracing` and Perfetto can
+	# show. Each phase is a complete event and the counters are kept with the trace as other data.
+	def trace(self):
+		events = []
+		for phase in self.phases:
+			arguments = dict(phase["arguments"])
+			for key in ("allocated", "peak"):
+				if key in phase:
+					arguments[key] = phase[key]
+			events.append({"name": phase["name"], "ph": "X", "ts": phase["start"], "dur": phase["duration"], "pid": os.getpid(), "tid": 0, "args": arguments})
+		report = self.report()
+		return {"traceEvents": events, "displayTimeUnit": "ms", "otherData": {"rules": report["rules"], "lookups": report["lookups"]}}
+
+	def writeReport(self, path):
+		with open(path, "w", encoding="utf-8") as file:
+			json.dump(self.report(), file, indent="\t")
+
+	def writeTrace(self, path):
+		with open(path, "w", encoding="utf-8") as file:
+			json.dump(self.trace(), file)
+
+class Phase:
+	def __init__(self, instrumentation, name, arguments):
+		self.instrumentation = instrumentation
+		self.name = name
+		self.arguments = arguments
+
+	def __enter__(self):
+		self.instrumentation.enterPhase(self.name, self.arguments)
+		return self
+
+	def __exit__(self, *exception):
+		self.instrumentation.exitPhase()
+		return False
+
+# Returns `instrumentation.phase(name)`, or a context that does nothing if `instrumentation` is None.
+def measure(instrumentation, name, **arguments):
+	if instrumentation is None:
+		return nullPhase
+	return instrumentation.phase(name, **arguments)
+
+nullPhase = contextlib.nullcontext()
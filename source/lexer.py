@@ -1,192 +1,373 @@
+from array import array
+from bisect import bisect_right
+import codecs
+import re
+from instrumentation import *
+
+# Formats the message of an error with a span, after its line and column once `locateErrors` has found
+# them.
+def formatErrorMessage(error, message):
+	if error.location is None:
+		return message
+	return f"{error.location[0]}:{error.location[1]}: {message}"
+
 class LexerError:
-	def __init__(self, message, text):
+	def __init__(self, message, text, start=None, end=None):
 		self.message = message
 		self.text = text
+		self.start = start
+		self.end = end
+		self.location = None
 
 	def __repr__(self) :
-		return f"{self.message} `{self.text}`"
+		return formatErrorMessage(self, f"{self.message} `{self.text}`")
 
 class Token:
-	def __init__(self, type, text):
+	__slots__ = ("type", "text", "start", "end")
+
+	def __init__(self, type, text, start=None, end=None):
 		self.type = type
 		self.text = text
+		self.start = start
+		self.end = end
 
 	def __repr__(self):
 		return f"{self.type} `{self.text}`"
 
-def lex(text):
-	whitespace = " \t\r\n"
-	keywords = [
-		"namespace",
-		"using",
-		"pub",
-		# "inline",
-		# "static",
-		"var",
-		"func",
-		"method",
-		"struct",
-		"trait",
-		"cases",
-		"mut",
-		# "owned",
-		# "weak",
-		# "raw",
-		"if",
-		"else",
-		"do",
-		"while",
-		"for",
-		"in",
-		"thru",
-		"until",
-		"by",
-		# "switch",
-		# "case",
-		"default",
-		# "next",
-		"break",
-		"continue",
-		"return",
-		# "yield",
-		"is",
-		"isnot",
-		"isa",
-		"isnota",
-		"as",
-		"and",
-		"or",
-		"xor",
-		"not",
-		# "new",
-		# "drop",
-		# "move",
-	]
-	operators = [
-		"+=",
-		"+",
-		"-=",
-		"->",
-		"-",
-		"*=",
-		"*",
-		"/=",
-		"/",
-		"%=",
-		"%",
-		"&=",
-		"&",
-		"|=",
-		"|",
-		"^=",
-		"^",
-		"~=",
-		"~",
-		"==",
-		"=",
-		"!=",
-		">>=",
-		">>"
-		">=",
-		">",
-		"<<=",
-		"<<",
-		"<=",
-		"<",
-		"(",
-		")",
-		"[",
-		"]",
-		"{",
-		"}",
-		".",
-		",",
-		":",
-		";",
+# Maps offsets in a text to line and column numbers, both starting at 1. The line starts are found once
+# and each lookup is a binary search.
+class LineIndex:
+	def __init__(self, text):
+		self.lineStarts = array("L", [0])
+		self.lineStarts.extend(match.end() for match in re.finditer("\n", text))
+
+	def getLineAndColumn(self, offset):
+		line = bisect_right(self.lineStarts, offset)
+		return (line, offset - self.lineStarts[line - 1] + 1)
+
+# Finds the line and column of each error in `errors` that has a span in `text`. The line index is only
+# built if there is such an error.
+def locateErrors(errors, text):
+	lineIndex = None
+	for error in errors:
+		if error.start is not None:
+			if lineIndex is None:
+				lineIndex = LineIndex(text)
+			error.location = lineIndex.getLineAndColumn(error.start)
+
+# Tokens stored column-wise as a kind id, a start offset and a length into the source text. Indexing
+# builds a `Token` on demand, so a buffer can stand in for a list of tokens.
+class TokenBuffer:
+	# Each kind is a token type and, for tokens whose text isn't a slice of the source, a fixed text.
+	kinds = [
+		("number", None),
+		("identifier", None),
+		("keyword", None),
+		("operator", None),
+		("character", None),
+		("string", None),
+		("operator", "generic <"),
 	]
-	lineComment = "//"
+	kindIds = {kind: id for (id, kind) in enumerate(kinds)}
 
-	tokens = []
-	errors = []
-	currentToken = ""
-	i = 0
-	while i < len(text):
-		# Skip whitespace.
-		if text[i] in whitespace:
-			i += 1
-			continue
-		# Skip comments.
-		if text.startswith(lineComment, i):
-			while i < len(text) and text[i] != "\n":
-				i += 1
+	def __init__(self, text):
+		self.text = text
+		self.kindColumn = array("B")
+		self.startColumn = array("I")
+		self.lengthColumn = array("I")
+		self.lineIndex = None
+
+	def __len__(self):
+		return len(self.kindColumn)
+
+	def __getitem__(self, index):
+		if isinstance(index, slice):
+			return [self[i] for i in range(*index.indices(len(self)))]
+		(type, text) = self.kinds[self.kindColumn[index]]
+		start = self.startColumn[index]
+		end = start + self.lengthColumn[index]
+		return Token(type, self.text[start:end] if text is None else text, start, end)
+
+	def __iter__(self):
+		for i in range(len(self)):
+			yield self[i]
+
+	def append(self, kindId, start, end):
+		self.kindColumn.append(kindId)
+		self.startColumn.append(start)
+		self.lengthColumn.append(end - start)
+
+	def getType(self, index):
+		return self.kinds[self.kindColumn[index]][0]
+
+	def getText(self, index):
+		text = self.kinds[self.kindColumn[index]][1]
+		if text is not None:
+			return text
+		start = self.startColumn[index]
+		return self.text[start:start + self.lengthColumn[index]]
+
+	def getSpan(self, index):
+		start = self.startColumn[index]
+		return (start, start + self.lengthColumn[index])
+
+	def getLineAndColumn(self, index):
+		if self.lineIndex is None:
+			self.lineIndex = LineIndex(self.text)
+		return self.lineIndex.getLineAndColumn(self.startColumn[index])
+
+whitespace = " \t\r\n"
+keywords = frozenset([
+	"namespace",
+	"using",
+	"pub",
+	# "inline",
+	# "static",
+	"var",
+	"func",
+	"method",
+	"struct",
+	"trait",
+	"cases",
+	"mut",
+	# "owned",
+	# "weak",
+	# "raw",
+	"if",
+	"else",
+	"do",
+	"while",
+	"for",
+	"in",
+	"thru",
+	"until",
+	"by",
+	# "switch",
+	# "case",
+	"default",
+	# "next",
+	"break",
+	"continue",
+	"return",
+	# "yield",
+	"is",
+	"isnot",
+	"isa",
+	"isnota",
+	"as",
+	"and",
+	"or",
+	"xor",
+	"not",
+	# "new",
+	# "drop",
+	# "move",
+])
+operators = [
+	"+=",
+	"+",
+	"-=",
+	"->",
+	"-",
+	"*=",
+	"*",
+	"/=",
+	"/",
+	"%=",
+	"%",
+	"&=",
+	"&",
+	"|=",
+	"|",
+	"^=",
+	"^",
+	"~=",
+	"~",
+	"==",
+	"=",
+	"!=",
+	">>=",
+	">>",
+	">=",
+	">",
+	"<<=",
+	"<<",
+	"<=",
+	"<",
+	"(",
+	")",
+	"[",
+	"]",
+	"{",
+	"}",
+	".",
+	",",
+	":",
+	";",
+]
+
+# Builds a trie of the operators with one level per character. The empty key marks the end of an
+# operator.
+def buildOperatorTrie(operators):
+	trie = {}
+	for operator in operators:
+		node = trie
+		for character in operator:
+			node = node.setdefault(character, {})
+		node[""] = operator
+	return trie
+
+# Turns an operator trie into a regex that always matches the longest operator. Each level is an
+# optional group when a shorter operator ends there, so the greedy match tries the longer one first.
+def operatorTrieToPattern(trie):
+	alternatives = []
+	for character, child in trie.items():
+		if character == "":
 			continue
-		
-		# Lex a number.
-		if text[i].isdigit():
-			while i < len(text) and text[i].isdigit():
-				currentToken += text[i]
-				i += 1
-			tokens.append(Token("number", currentToken))
-			currentToken = ""
-		# Lex a character.
-		elif text[i] == "'":
-			currentToken += text[i]
-			i += 1
-			while i < len(text) and text[i] != "'" and text[i] != "\n":
-				if text.startswith("\\'", i):
-					currentToken += "\\'"
-					i += 2
-				else:
-					currentToken += text[i]
-					i += 1
-
-			if i < len(text) and text[i] == "'":
-				currentToken += "'"
-				i += 1
-				tokens.append(Token("character", currentToken))
-			else:
-				errors.append(LexerError("Unclosed single quote.", currentToken))
-			currentToken = ""
-		# Lex a string.
-		elif text[i] == '"':
-			currentToken += text[i]
-			i += 1
-			while i < len(text) and text[i] != '"' and text[i] != "\n":
-				if text.startswith('\\"', i):
-					currentToken += '\\"'
-					i += 2
-				else:
-					currentToken += text[i]
-					i += 1
-
-			if i < len(text) and text[i] == '"':
-				currentToken += '"'
-				i += 1
-				tokens.append(Token("string", currentToken))
-			else:
-				errors.append(LexerError("Unclosed double quote.", currentToken))
-			currentToken = ""
-		# Lex an identifier or keyword.
-		elif text[i].isalpha() or text[i] == "_":
-			while i < len(text) and (text[i].isalnum() or text[i] == "_"):
-				currentToken += text[i]
-				i += 1
-			tokens.append(Token("keyword" if currentToken in keywords else "identifier", currentToken))
-			currentToken = ""
-		# Lex an operator.
-		else:
-			for operator in operators:
-				if text.startswith(operator, i):
-					if operator == "<" and i > 0 and text[i-1] not in whitespace:
-						tokens.append(Token("operator", "generic <"))
-					else:
-						tokens.append(Token("operator", operator))
-					i += len(operator)
-					break
+		rest = operatorTrieToPattern(child)
+		if rest and "" in child:
+			rest = f"(?:{rest})?"
+		elif rest:
+			rest = f"(?:{rest})"
+		alternatives.append(re.escape(character) + rest)
+	return "|".join(alternatives)
+
+operatorTrie = buildOperatorTrie(operators)
+
+# Matches one token, skipping any whitespace and comments before it. The name of the matched group is
+# the kind of the token. Unclosed quotes and invalid tokens run to the end of the line. Every position
+# matches something, so consecutive matches cover the whole text without gaps.
+tokenPattern = re.compile(
+	r"(?:[ \t\r\n]++|//[^\n]*+)*+"
+	r"(?:"
+	r"(?P<number>\d++)"
+	r"|(?P<identifier>[^\W\d]\w*+)"
+	r"|(?P<operator>" + operatorTrieToPattern(operatorTrie) + r")"
+	r"|(?P<character>'(?:[^'\n\\]|\\'|\\(?!'))*+')"
+	r"|(?P<string>\"(?:[^\"\n\\]|\\\"|\\(?!\"))*+\")"
+	r"|(?P<unclosedCharacter>'(?:[^'\n\\]|\\'|\\(?!'))*+)"
+	r"|(?P<unclosedString>\"(?:[^\"\n\\]|\\\"|\\(?!\"))*+)"
+	r"|(?P<invalid>[^\n]++)"
+	r"|(?P<end>\Z)"
+	r")"
+)
+
+# The operators that end the statement or block around generic arguments, which closes any of them that
+# were left open by mistake.
+genericBoundaries = frozenset([";", "{", "}"])
+
+# Returns the end of the `>` characters at the start of the operator `start:end` in `text` that close
+# open generic arguments, of which there are `openCount`. A `>>`, `>=` or `>>=` that closes them is split
+# into `>` tokens and the rest, so `List<List<int32>>` ends with two `>` tokens.
+def getClosingEnd(text, start, end, openCount):
+	position = start
+	while position < end and position - start < openCount and text[position] == ">":
+		position += 1
+	return position
+
+# Turns token matches into tokens, appending any errors to `errors`. `offset` is added to the positions
+# of the matches to give the offsets of the tokens. `openGenerics` holds the number of generic arguments
+# that are open, so it can be carried from one batch of matches to the next. Each token is made by
+# `makeToken(type, text, start, end)`, so every lexer shares these rules whatever it stores.
+def tokensFromMatches(matches, errors, offset=0, openGenerics=None, makeToken=Token):
+	if openGenerics is None:
+		openGenerics = [0]
+	for match in matches:
+		kind = match.lastgroup
+		(start, end) = match.span(kind)
+		tokenText = match.string[start:end]
+		if kind == "identifier":
+			yield makeToken("keyword" if tokenText in keywords else "identifier", tokenText, start + offset, end + offset)
+		elif kind == "operator":
+			# A `<` directly after a token opens generic arguments.
+			if tokenText == "<" and start > 0 and match.string[start - 1] not in whitespace:
+				openGenerics[0] += 1
+				yield makeToken("operator", "generic <", start + offset, end + offset)
+			elif openGenerics[0] and tokenText[0] == ">":
+				closingEnd = getClosingEnd(match.string, start, end, openGenerics[0])
+				openGenerics[0] -= closingEnd - start
+				for position in range(start, closingEnd):
+					yield makeToken("operator", ">", position + offset, position + 1 + offset)
+				if closingEnd < end:
+					yield makeToken("operator", match.string[closingEnd:end], closingEnd + offset, end + offset)
 			else:
-				while i < len(text) and text[i] != "\n":
-					currentToken += text[i]
-					i += 1
-				errors.append(LexerError("Invalid token.", currentToken))
-				currentToken = ""
+				if tokenText in genericBoundaries:
+					openGenerics[0] = 0
+				yield makeToken("operator", tokenText, start + offset, end + offset)
+		elif kind == "unclosedCharacter":
+			errors.append(LexerError("Unclosed single quote.", tokenText, start + offset, end + offset))
+		elif kind == "unclosedString":
+			errors.append(LexerError("Unclosed double quote.", tokenText, start + offset, end + offset))
+		elif kind == "invalid":
+			errors.append(LexerError("Invalid token.", tokenText, start + offset, end + offset))
+		elif kind != "end":
+			yield makeToken(kind, tokenText, start + offset, end + offset)
+
+# Yields the text of `source` in chunks. `source` can be a string, a text or binary file, an mmap or
+# an iterable of string or byte chunks. Bytes are decoded as UTF-8 and may split characters.
+def readChunks(source, chunkSize):
+	if isinstance(source, str):
+		yield source
+		return
+	if hasattr(source, "read"):
+		chunks = iter(lambda: source.read(chunkSize) or None, None)
+	else:
+		chunks = iter(source)
+	decoder = codecs.getincrementaldecoder("utf-8")()
+	for chunk in chunks:
+		if not isinstance(chunk, str):
+			chunk = decoder.decode(chunk)
+		if chunk:
+			yield chunk
+	decoder.decode(b"", final=True)
+
+# Yields the token matches over a sequence of chunks in batches, each with the offset of the text it
+# matched in. A match that reaches the end of the buffer could still grow (an identifier, `>` before
+# `>=`, an unterminated string or comment), so it is only taken once more text has arrived or the input
+# has ended.
+def matchChunks(chunks):
+	buffer = ""
+	offset = 0
+	position = 0
+	for chunk in chunks:
+		# Drop the consumed text but keep one character, which decides whether `<` is generic.
+		consumed = max(position - 1, 0)
+		buffer = buffer[consumed:] + chunk
+		offset += consumed
+		position -= consumed
+		matches = []
+		while (match := tokenPattern.match(buffer, position)).end() < len(buffer):
+			position = match.end()
+			matches.append(match)
+		yield (offset, matches)
+	yield (offset, tokenPattern.finditer(buffer, position))
+
+def lex(text, instrumentation=None):
+	errors = []
+	with measure(instrumentation, "lex"):
+		tokens = list(tokensFromMatches(tokenPattern.finditer(text), errors))
 	return (tokens, errors)
+
+# Lexes `text` into a `TokenBuffer` instead of a list of tokens.
+def lexBuffer(text):
+	tokens = TokenBuffer(text)
+	errors = []
+	kindIds = {type: id for (id, (type, fixedText)) in enumerate(TokenBuffer.kinds) if fixedText is None}
+	genericId = TokenBuffer.kindIds[("operator", "generic <")]
+	append = tokens.append
+
+	def appendToken(type, tokenText, start, end):
+		append(genericId if tokenText == "generic <" else kindIds[type], start, end)
+
+	for _ in tokensFromMatches(tokenPattern.finditer(text), errors, makeToken=appendToken):
+		pass
+	return (tokens, errors)
+
+# Lazily lexes `source` (see `readChunks`) without holding all of it in memory. Errors are appended to
+# `errors` as they are found.
+def lexStream(source, errors=None, chunkSize=1 << 16):
+	if errors is None:
+		errors = []
+	openGenerics = [0]
+	for (offset, matches) in matchChunks(readChunks(source, chunkSize)):
+		yield from tokensFromMatches(matches, errors, offset, openGenerics)
@@ -1,21 +1,28 @@
+import json
+import sys
 from lexer import *
 from parser import *
 from object import *
 
 if __name__ == "__main__":
 	text = """ namespace hello; var f int32; pub var a int32;"""
-	(tokens, lexerErrors) = lex(text)
+	# With `--profile`, the phases are measured and a report is printed at the end.
+	instrumentation = Instrumentation(memory=True) if "--profile" in sys.argv[1:] else None
+	(tokens, lexerErrors) = lex(text, instrumentation)
 	print("---- TOKENS ----")
 	print("\n".join(map(str, tokens)))
+	locateErrors(lexerErrors, text)
 	print("\n---- LEXER ERRORS ----")
 	print("\n".join(map(str, lexerErrors)))
-	(tree, parserErrors) = parse(tokens)
+	(tree, parserErrors) = parse(tokens, instrumentation=instrumentation)
 	print("\n---- SYNTAX TREE ----")
 	tree.prettyPrint()
+	locateErrors(parserErrors, text)
 	print("\n---- PARSER ERRORS ----")
 	print("\n".join(map(str, parserErrors)))
 
-	(object, compilerErrors) = validate(tree)
+	(object, compilerErrors) = validate(tree, instrumentation=instrumentation)
+	locateErrors(compilerErrors, text)
 	print("\n---- PUBLIC SYMBOLS ----")
 	for name in object.publicSymbols.keys():
 		print(f"{name}: {str(object.getPublicSymbol(name))}")
@@ -24,4 +31,7 @@ if __name__ == "__main__":
 		print(f"{name}: {str(object.getPrivateSymbol(name))}")
 	print("\n---- COMPILER ERRORS ----")
 	for error in compilerErrors:
-		print(error)	
+		print(error)
+	if instrumentation is not None:
+		print("\n---- PROFILE ----")
+		print(json.dumps(instrumentation.report(), indent="\t"))	
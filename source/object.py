@@ -1,14 +1,27 @@
+from concurrent.futures import ProcessPoolExecutor
+import multiprocessing
+import os
+import sys
 from typing import Any
 from lexer import *
 from parser import *
+from walker import *
+from constants import *
+from typetable import *
+from generics import *
+from dispatch import *
 
 class CompilerError:
-	def __init__(self, message):
+	def __init__(self, message, start=None, end=None):
 		self.message = message
+		self.start = start
+		self.end = end
+		self.location = None
 
 	def __repr__(self):
-		return self.message
+		return formatErrorMessage(self, self.message)
 
+# A declared name. The type of a symbol is canonical (see `TypeTable`), or None if it has none.
 class Symbol:
 	def __init__(self, name, visibility, type, value):
 		self.name = name
@@ -20,100 +33,188 @@ class Symbol:
 		return self.name
 	
 	def __eq__(self, other):
-		return self.visibility == other.visibility and self.name == other.name and self.type == other.type 
+		return self.visibility == other.visibility and self.name == other.name and self.type is other.type
+
+# Adds `value` to `symbols` under the qualified name `name`, along with any namespaces that lead up to it.
+# Returns whether the name was already taken.
+def addToSymbolTable(symbols, name, value):
+	name = sys.intern(name)
+	if name in symbols:
+		return True
+	(namespaceName, _, identifier) = name.rpartition(".")
+	if namespaceName:
+		namespace = symbols.get(namespaceName)
+		if namespace is None:
+			addToSymbolTable(symbols, namespaceName, {})
+			namespace = symbols[namespaceName]
+		elif not isinstance(namespace, dict):
+			return True
+		namespace[sys.intern(identifier)] = value
+	symbols[name] = value
+	return False
+
+# Replaces the value of the qualified name `name` in `symbols`, and in its namespace, with `value`.
+def replaceInSymbolTable(symbols, name, value):
+	(namespaceName, _, identifier) = name.rpartition(".")
+	if namespaceName:
+		symbols[namespaceName][identifier] = value
+	symbols[name] = value
 
 class Object:
 	def __init__(self):
+		# Each table maps the qualified names of symbols and namespaces to their values. The value of a
+		# namespace is the index of its members by identifier, so a lookup is one hash no matter how deep the
+		# namespace is and the members of a namespace can be listed without searching.
 		self.publicSymbols = {}
 		self.privateSymbols = {}
+		# The `DispatchTables` of the methods, once the object is validated.
+		self.dispatchTables = None
 
 	def getPublicSymbol(self, name):
-		identifiers = name.split(".")
-		namespace = self.publicSymbols
-		for identifier in identifiers:
-			if identifier not in namespace:
-				return None
-			namespace = namespace[identifier]
-		return namespace
+		return self.publicSymbols.get(name)
 
 	def getPrivateSymbol(self, name):
-		identifiers = name.split(".")
-		namespace = self.privateSymbols
-		for identifier in identifiers:
-			if identifier not in namespace:
-				return None
-			namespace = namespace[identifier]
-		return namespace
+		return self.privateSymbols.get(name)
 	
 	def getSymbol(self, name):
-		symbol = self.getPublicSymbol(name)
+		symbol = self.publicSymbols.get(name)
 		if symbol is not None:
 			return symbol
-		return self.getPrivateSymbol(name)
+		return self.privateSymbols.get(name)
 	
 	def addPublicSymbol(self, name, value):
-		if self.getPublicSymbol(name) is not None:
-			return True
-		identifiers = name.split(".")
-		namespace = self.publicSymbols
-		for identifier in identifiers[:-1]:
-			namespace[identifier] = {}
-			namespace = namespace[identifier]
-		namespace[identifiers[-1]] = value
-		return False
+		return addToSymbolTable(self.publicSymbols, name, value)
 	
 	def addPrivateSymbol(self, name, value):
-		if self.getPrivateSymbol(name) is not None:
-			return True
-		identifiers = name.split(".")
-		namespace = self.privateSymbols
-		for identifier in identifiers[:-1]:
-			namespace[identifier] = {}
-			namespace = namespace[identifier]
-		namespace[identifiers[-1]] = value
-		return False
+		return addToSymbolTable(self.privateSymbols, name, value)
 
-class Scope:
-	def __init__(self):
-		self.symbols = {}
+	# Replaces the symbol `name`, which must be defined, with `value`.
+	def replaceSymbol(self, name, value):
+		replaceInSymbolTable(self.publicSymbols if name in self.publicSymbols else self.privateSymbols, name, value)
 
-	def getSymbol(self, name):
-		return self.symbols.get(name)
+	# Returns the public and private members of the namespace `name` by identifier, as used by `using
+	# name.*`.
+	def getMembers(self, name):
+		members = {}
+		for symbols in (self.privateSymbols, self.publicSymbols):
+			namespace = symbols.get(name)
+			if isinstance(namespace, dict):
+				members.update(namespace)
+		return members
 
-	def addSymbol(self, symbol):
-		if self.getSymbol(symbol.name) is not None:
-			return True
-		self.symbols[symbol.name] = symbol
+	# Adds the symbols of `other` to this object. Namespaces are combined, and so are the overloads of a
+	# function. Returns the names of the symbols that were already defined.
+	def merge(self, other):
+		redefinitions = []
+		for (symbols, addSymbol) in ((other.publicSymbols, self.addPublicSymbol), (other.privateSymbols, self.addPrivateSymbol)):
+			for (name, value) in symbols.items():
+				existing = self.getSymbol(name)
+				if isinstance(value, dict):
+					if existing is None:
+						addSymbol(name, {})
+				elif existing is None:
+					addSymbol(name, value)
+				else:
+					overloads = None if isinstance(existing, dict) else combineOverloads(existing, value)
+					if overloads is None:
+						redefinitions.append(name)
+					else:
+						self.replaceSymbol(name, overloads)
+		return redefinitions
 
+# The symbols in scope. Each name maps to a chain of bindings, innermost first, where a binding is a pair
+# of a symbol and the binding it shadows, so lookups, pushes and pops don't depend on how deeply scopes are
+# nested. Each scope only remembers the names it bound, so popping it can unbind them.
 class Environment:
 	def __init__(self):
+		self.bindings = {}
 		self.scopes = []
+		# Whether `bindings` is shared with a snapshot and must be copied before it is changed.
+		self.shared = False
 
 	def pushScope(self):
-		self.scopes.append(Scope())
+		self.scopes.append([])
 	
 	def popScope(self):
-		self.scopes.pop()
+		names = self.scopes.pop()
+		if names and self.shared:
+			self.bindings = dict(self.bindings)
+			self.shared = False
+		for name in names:
+			(symbol, shadowed) = self.bindings[name]
+			if shadowed is None:
+				del self.bindings[name]
+			else:
+				self.bindings[name] = shadowed
 
 	def getSymbol(self, name):
-		for i in range(len(self.scopes) - 1, -1, -1):
-			symbol = self.scopes[i].getSymbol(name)
-			if symbol is not None:
-				return symbol
-		return None
+		binding = self.bindings.get(name)
+		if binding is None:
+			return None
+		return binding[0]
 	
-	def addSymbol(self, symbol):
-		if self.getSymbol(symbol.name) is not None:
+	# Binds `symbol` in the innermost scope. Returns True instead if the name is already bound, unless
+	# `shadow` is set, in which case the outer binding comes back once the scope is popped.
+	def addSymbol(self, symbol, shadow=False):
+		binding = self.bindings.get(symbol.name)
+		if binding is not None and not shadow:
 			return True
-		self.scopes[-1].addSymbol(symbol)
+		if self.shared:
+			self.bindings = dict(self.bindings)
+			self.shared = False
+		self.bindings[symbol.name] = (symbol, binding)
+		self.scopes[-1].append(symbol.name)
 		return False
 
-class Visitor:
-	def __init__(self):
+	# Returns an environment with the symbols in scope right now, in a scope of its own that can't be popped
+	# past. Changes to either environment don't affect the other. The bindings are only copied once one of
+	# them changes.
+	def snapshot(self):
+		environment = Environment()
+		environment.bindings = self.bindings
+		environment.scopes = [[]]
+		environment.shared = self.shared = True
+		return environment
+
+# Returns the name of a definition, which is its first identifier token.
+def getDefinitionName(tree):
+	for child in tree.children:
+		if isinstance(child, Token) and child.type == "identifier":
+			return child
+	return None
+
+def getChildOfKind(tree, kinds):
+	for child in tree.children:
+		if isinstance(child, Node) and child.kind in kinds:
+			return child
+	return None
+
+# Collects the symbols that a program declares at the top level into an object, along with the function
+# definitions whose bodies are left to `checkFunctionBody`.
+class Visitor(Analysis):
+	enterHandlers = {
+		"namespace statement": "visitNamespaceStatement",
+		"variable definition": "visitDefinition",
+		"function definition": "visitDefinition",
+		"method definition": "visitDefinition",
+		"struct definintion": "visitDefinition",
+		"trait definintion": "visitDefinition",
+	}
+	programKind = nodeKindOf("program")
+	variableDefinitionKind = nodeKindOf("variable definition")
+	functionDefinitionKind = nodeKindOf("function definition")
+	assignmentKinds = frozenset([nodeKindOf("assignment")])
+	qualifiedNameKinds = frozenset([nodeKindOf("qualified name")])
+
+	def __init__(self, libraries=(), instrumentation=None):
 		self.object = None
+		self.instrumentation = instrumentation
+		# Prebuilt objects, such as opened object files, whose public symbols can be used.
+		self.libraries = libraries
 		self.environment = None
 		self.errors = []
 		self.currentNamespace = ""
+		self.functions = []
 
 	def resolveSymbol(self, name):
 		value = self.environment.getSymbol(name)
@@ -122,90 +223,230 @@ class Visitor:
 		value = self.object.getPrivateSymbol(name)
 		if value is not None:
 			return value
-		return self.object.getPublicSymbol(name)
-	
-	# Does depth-first left to right traversal of the tree.
-	def visitWith(self, tree, function):
-		if isinstance(tree, Token):
-			return function(tree)
-		for child in tree.children:
-			if function(child): return True
-		return function(tree)
-
-	def validateIdentifiers(self, tree):
-		if isinstance(tree, Token):
-			pass
-		match tree.type:
-			case "namespace statement":
-				self.currentNamespace = qualifiedNameToStr(tree.children[-2])
-				if self.object.getSymbol(self.currentNamespace) is not None:
-					self.errors.append(CompilerError(f"Redefinition of namespace `{self.currentNamespace}`."))
-					return True
-				if tree.children[0].text == "pub":
-					self.object.addPublicSymbol(self.currentNamespace, {})
-				else:
-					self.object.addPrivateSymbol(self.currentNamespace, {})
-			case "using statement":
-				pass
-			case "variable definition":
-				# pub var name type = value ;
-				if tree.children[0].text == "pub":
-					qualifiedName = self.currentNamespace + "." + tree.children[2].text
-					type = tree.children[3]
-					value = None
-					if len(tree.children) >= 7:
-						value = tree.children[5]
-					if self.object.getSymbol(qualifiedName):
-						self.errors.append(CompilerError(f"Redefinition of symbol `{qualifiedName}`."))
-						return True
-					self.object.addPublicSymbol(qualifiedName, Symbol(qualifiedName, "pub", type, value))
-				# var name type = value ;
-				else:
-					qualifiedName = self.currentNamespace + "." + tree.children[1].text
-					type = tree.children[2]
-					value = None
-					if len(tree.children) >= 6:
-						value = tree.children[4]
-					if self.object.getSymbol(qualifiedName):
-						self.errors.append(CompilerError(f"Redefinition of symbol `{qualifiedName}`."))
-						return True
-					self.object.addPrivateSymbol(qualifiedName, Symbol(qualifiedName, "priv", type, value))
-			case "function definition":
-				# pub func name(arg type) type {body}
-				# 0   1    2   3          4    5
-				if tree.children[0].text == "pub":
-					qualifiedName = self.currentNamespace + "." + tree.children[2].text
-					arguments = tree.children[3]
-					returnType = tree.children[4]
-					body = tree.children[5]
-					if self.object.getSymbol(qualifiedName):
-						self.errors.append(CompilerError(f"Redefinition of symbol `{qualifiedName}`."))
-						return True
-				# func name(arg type) type {body}
-				# 0    1   2          3    4 
-				else:
-					qualifiedName = self.currentNamespace + "." + tree.children[1].text
-					arguments = tree.children[2]
-					returnType = tree.children[3]
-					body = tree.children[4]
-					if self.object.getSymbol(qualifiedName):
-						self.errors.append(CompilerError(f"Redefinition of symbol `{qualifiedName}`."))
-						return True
+		value = self.object.getPublicSymbol(name)
+		if value is not None:
+			return value
+		for library in self.libraries:
+			value = library.getPublicSymbol(name)
+			if value is not None:
+				return value
+		return None
+
+	def visitNamespaceStatement(self, tree, parent):
+		# A statement with a syntax error may have no name.
+		name = getChildOfKind(tree, self.qualifiedNameKinds)
+		if name is None:
+			return False
+		self.currentNamespace = qualifiedNameToStr(name)
+		if self.object.getSymbol(self.currentNamespace) is not None:
+			self.errors.append(CompilerError(f"Redefinition of namespace `{self.currentNamespace}`.", name.start, name.end))
+			return True
+		if tree.children[0].text == "pub":
+			self.object.addPublicSymbol(self.currentNamespace, {})
+		else:
+			self.object.addPrivateSymbol(self.currentNamespace, {})
+
+	# Adds the symbol of a top-level variable, function, method, struct or trait definition. The symbol of a
+	# variable has its type and initial value, the others have their definition as their value, and
+	# functions and methods have their function type. Functions and methods with the same name are
+	# overloads, kept in an `OverloadSet`, as long as their parameter types differ.
+	def visitDefinition(self, tree, parent):
+		if parent is None or parent.kind != self.programKind:
+			return False
+		# A definition with a syntax error may have no name, and is left out.
+		name = getDefinitionName(tree)
+		if name is None:
+			return False
+		qualifiedName = self.currentNamespace + "." + name.text
+		if tree.kind == self.variableDefinitionKind:
+			# pub var name type = value ;
+			type = internType(getChildOfKind(tree, typeKinds))
+			assignment = getChildOfKind(tree, self.assignmentKinds)
+			value = None if assignment is None else assignment.children[-1]
+		elif tree.kind in overloadableKinds:
+			(type, value) = (internSignature(tree), tree)
+		else:
+			(type, value) = (None, tree)
+		symbol = Symbol(qualifiedName, "pub" if tree.children[0].text == "pub" else "priv", type, value)
+		existing = self.object.getSymbol(qualifiedName)
+		if existing:
+			if isinstance(existing, dict) or not (isOverloadable(symbol) and (isinstance(existing, OverloadSet) or isOverloadable(existing))):
+				self.errors.append(CompilerError(f"Redefinition of symbol `{qualifiedName}`.", name.start, name.end))
+				return True
+			if existing.visibility != symbol.visibility:
+				self.errors.append(CompilerError(f"The overloads of `{qualifiedName}` must all be public or all be private.", name.start, name.end))
+				return True
+			if not isinstance(existing, OverloadSet):
+				overloads = OverloadSet(qualifiedName, existing.visibility)
+				overloads.add(existing)
+				self.object.replaceSymbol(qualifiedName, overloads)
+				existing = overloads
+			if existing.add(symbol):
+				self.errors.append(CompilerError(f"Redefinition of `{qualifiedName}` with the same parameter types.", name.start, name.end))
+				return True
+		elif symbol.visibility == "pub":
+			self.object.addPublicSymbol(qualifiedName, symbol)
+		else:
+			self.object.addPrivateSymbol(qualifiedName, symbol)
+		if tree.kind == self.functionDefinitionKind:
+			self.functions.append(tree)
 		return False
 
-	def validate(self, tree):
+	def begin(self):
 		self.object = Object()
 		self.environment = Environment()
+		if self.instrumentation is not None:
+			self.instrumentation.countLookups(self.object, ("getPublicSymbol", "getPrivateSymbol", "getSymbol", "getMembers"))
+			self.instrumentation.countLookups(self.environment, ("getSymbol", "addSymbol"))
 		self.environment.pushScope()
 		self.errors = []
 		self.currentNamespace = ""
-		if self.visitWith(tree, self.validateIdentifiers): return True
-		return False
+		self.functions = []
+
+	# Walks `tree` for the declarations, along with `analyses`, which need the same walk.
+	def validate(self, tree, analyses=()):
+		self.begin()
+		walker = Walker([self, *analyses])
+		walker.walk(tree)
+		return self in walker.stopped
+
+# Checks the body of a function on its own: no local name may be defined twice, even in an inner scope,
+# and `break` and `continue` must be inside a loop.
+class BodyChecker(Analysis):
+	enterHandlers = {
+		"function definition": "enterFunction",
+		"block": "enterScope",
+		"for loop": "enterForLoop",
+		"while loop": "enterLoop",
+		"variable definition": "visitVariableDefinition",
+		"break statement": "visitLoopStatement",
+		"continue statement": "visitLoopStatement",
+	}
+	exitHandlers = {
+		"function definition": "exitFunction",
+		"block": "exitScope",
+		"for loop": "exitForLoop",
+		"while loop": "exitLoop",
+	}
+
+	def __init__(self):
+		self.environment = Environment()
+		self.errors = []
+		self.loopDepth = 0
+		# The loop depths of the enclosing functions.
+		self.loopDepths = []
+
+	# Binds the name of the identifier token `name`, which is None if a syntax error left it out.
+	def addLocal(self, name):
+		if name is None:
+			return
+		if self.environment.addSymbol(Symbol(name.text, "priv", None, None)):
+			self.errors.append(CompilerError(f"Redefinition of local symbol `{name.text}`.", name.start, name.end))
+
+	def enterFunction(self, tree, parent):
+		# A nested function is a local symbol of the function around it.
+		if parent is not None:
+			self.addLocal(getDefinitionName(tree))
+		self.loopDepths.append(self.loopDepth)
+		self.loopDepth = 0
+		self.environment.pushScope()
+		for child in tree.children:
+			if isinstance(child, Node) and child.type == "function parameters":
+				for parameter in child.children:
+					if isinstance(parameter, Node):
+						self.addLocal(parameter.children[0])
+
+	def exitFunction(self, tree, parent):
+		self.environment.popScope()
+		self.loopDepth = self.loopDepths.pop()
+
+	def enterScope(self, tree, parent):
+		self.environment.pushScope()
+
+	def exitScope(self, tree, parent):
+		self.environment.popScope()
+
+	# for name type in expression {body}
+	def enterForLoop(self, tree, parent):
+		self.environment.pushScope()
+		self.addLocal(tree.children[1] if len(tree.children) > 1 else None)
+		self.loopDepth += 1
+
+	def exitForLoop(self, tree, parent):
+		self.environment.popScope()
+		self.loopDepth -= 1
+
+	def enterLoop(self, tree, parent):
+		self.loopDepth += 1
+
+	def exitLoop(self, tree, parent):
+		self.loopDepth -= 1
+
+	def visitVariableDefinition(self, tree, parent):
+		self.addLocal(getDefinitionName(tree))
+
+	def visitLoopStatement(self, tree, parent):
+		if self.loopDepth == 0:
+			self.errors.append(CompilerError(f"`{tree.children[0].text}` outside of a loop.", tree.start, tree.end))
+
+# Returns the errors in the body of the function definition `tree`.
+def checkFunctionBody(tree, instrumentation=None):
+	checker = BodyChecker()
+	if instrumentation is not None:
+		instrumentation.countLookups(checker.environment, ("getSymbol", "addSymbol"))
+	Walker([checker]).walk(tree)
+	return checker.errors
+
+# The functions being checked by `checkFunctionBodies`, which forked worker processes inherit instead of
+# having every tree pickled and sent to them.
+forkedFunctions = None
+
+def checkForkedFunctions(start, end):
+	return [checkFunctionBody(tree) for tree in forkedFunctions[start:end]]
+
+# Checks the bodies of `functions`, spreading them over `jobs` processes (one per core if None). The
+# errors are returned in the order of the functions, whatever the number of jobs. Lookups are only
+# counted by `instrumentation` when the bodies are checked in this process.
+def checkFunctionBodies(functions, jobs=1, instrumentation=None):
+	global forkedFunctions
+	if jobs == 1 or len(functions) <= 1:
+		return [error for tree in functions for error in checkFunctionBody(tree, instrumentation)]
+	jobs = jobs or os.cpu_count() or 1
+	chunkSize = max(1, len(functions)//(4*jobs))
+	if "fork" in multiprocessing.get_all_start_methods():
+		forkedFunctions = functions
+		try:
+			with ProcessPoolExecutor(jobs, mp_context=multiprocessing.get_context("fork")) as executor:
+				starts = range(0, len(functions), chunkSize)
+				results = [errors for chunk in executor.map(checkForkedFunctions, starts, [start + chunkSize for start in starts]) for errors in chunk]
+		finally:
+			forkedFunctions = None
+	else:
+		with ProcessPoolExecutor(jobs) as executor:
+			results = list(executor.map(checkFunctionBody, functions, chunksize=chunkSize))
+	return [error for errors in results for error in errors]
 
+# Returns the text of the qualified name node `name`. After a syntax error, the nodes that the parser went on
+# to build can be children of the name, and are left out.
 def qualifiedNameToStr(name):
-	return ".".join(child.text for child in name.children)
+	return "".join(child.text for child in name.children if isinstance(child, Token))
 
-def validate(tree):
-	visitor = Visitor()
-	visitor.validate(tree)
-	return (visitor.object, visitor.errors)
+# Validates `tree` in phases, after folding its constant expressions into a copy. The symbols declared at
+# the top level and the uses of generic definitions are collected first. Then the uses are instantiated,
+# sharing the instances in `instantiations` (see `InstantiationCache`), and the function bodies are
+# checked on `jobs` processes, and the dispatch tables of the methods are built (see `DispatchTables`).
+def validate(tree, libraries=(), jobs=1, instrumentation=None, instantiations=None):
+	with measure(instrumentation, "validate"):
+		with measure(instrumentation, "constants"):
+			(tree, constantErrors) = foldConstants(tree) if tree is not None else (tree, [])
+		visitor = Visitor(libraries, instrumentation)
+		instantiator = Instantiator(libraries, instantiations, instrumentation=instrumentation)
+		with measure(instrumentation, "declarations"):
+			visitor.validate(tree, [instantiator])
+		with measure(instrumentation, "generics"):
+			instantiationErrors = instantiator.instantiateUses(visitor.object)
+		with measure(instrumentation, "bodies", functions=len(visitor.functions)):
+			errors = checkFunctionBodies(visitor.functions, jobs, instrumentation)
+		with measure(instrumentation, "dispatch"):
+			dispatchTables = visitor.object.dispatchTables = DispatchTables(visitor.object, libraries)
+	return (visitor.object, constantErrors + visitor.errors + instantiationErrors + errors + dispatchTables.errors)
@@ -0,0 +1,252 @@
+from array import array
+from bisect import bisect_left
+from lexer import *
+from parser import *
+from object import *
+from serialize import *
+
+objectMagic = b"PLO1"
+objectFormatVersion = 2
+
+# The kinds of symbol records.
+symbolRecord = 0
+namespaceRecord = 1
+# One overload of a function, which is next to the other overloads with the same name.
+overloadRecord = 2
+
+# Each record is a name, a kind, and the payloads of the type and value (-1 if there isn't one).
+recordSize = 4
+
+# Writes `object` to `path` as an object file. The file holds a header (the format version and the number
+# of public and private records), the string table, the symbol records sorted by visibility and then by
+# name so a name can be found by binary search, and the types and values of the symbols, which are
+# encoded as trees with a shared token table and only decoded when a symbol is used.
+def writeObjectFile(path, object):
+	strings = StringTable()
+	tokens = TokenTable(strings)
+	items = array("q")
+	childCounts = array("Q")
+	payloadItemOffsets = array("Q", [0])
+	payloadCountOffsets = array("Q", [0])
+
+	def addPayload(tree):
+		if tree is None:
+			return -1
+		(treeItems, treeChildCounts) = encodeTree(tree, tokens)
+		items.extend(treeItems)
+		childCounts.extend(treeChildCounts)
+		payloadItemOffsets.append(len(items))
+		payloadCountOffsets.append(len(childCounts))
+		return len(payloadItemOffsets) - 2
+
+	records = array("q")
+	counts = []
+	for symbols in (object.publicSymbols, object.privateSymbols):
+		entries = sorted(symbols.items())
+		count = 0
+		for (name, value) in entries:
+			if isinstance(value, dict):
+				records.extend((strings.add(name), namespaceRecord, -1, -1))
+				count += 1
+				continue
+			kind = overloadRecord if isinstance(value, OverloadSet) else symbolRecord
+			for symbol in getOverloads(value):
+				records.extend((strings.add(name), kind, addPayload(None if symbol.type is None else symbol.type.toTree()), addPayload(symbol.value)))
+				count += 1
+		counts.append(count)
+	header = array("Q", [objectFormatVersion, *counts])
+	# The token table adds the types and texts of the tokens to the string table, so it is encoded first.
+	tokenSections = tokens.encode()
+	writeSections(path, objectMagic, [header, *strings.encode(), records, payloadItemOffsets, payloadCountOffsets, items, childCounts, *tokenSections])
+
+# Reads tokens out of the sections written by `TokenTable.encode`, building each one when it is first
+# used. The same index always gives the same token.
+class TokenReader:
+	def __init__(self, sections, strings):
+		(self.types, self.texts, self.starts, self.ends) = sections
+		self.strings = strings
+		self.tokens = [None]*len(self.types)
+
+	def __getitem__(self, index):
+		token = self.tokens[index]
+		if token is None:
+			(start, end) = (self.starts[index], self.ends[index])
+			if start < 0:
+				(start, end) = (None, None)
+			token = self.tokens[index] = Token(self.strings[self.types[index]], self.strings[self.texts[index]], start, end)
+		return token
+
+	def __len__(self):
+		return len(self.tokens)
+
+# The members of a namespace in an object file by identifier. It is a dictionary, like a namespace in an
+# `Object`, but only holds the records of its members until they are read, and then decodes them.
+class NamespaceMembers(dict):
+	def __init__(self, objectFile, visibility):
+		super().__init__()
+		self.objectFile = objectFile
+		self.visibility = visibility
+		# The first record of each member that isn't decoded yet, with the end of the namespace's records.
+		self.records = {}
+
+	def addRecord(self, identifier, record, high):
+		self.records[identifier] = (record, high)
+		dict.__setitem__(self, identifier, None)
+
+	def __getitem__(self, identifier):
+		records = self.records.get(identifier)
+		if records is None:
+			return dict.__getitem__(self, identifier)
+		value = self.objectFile.getRecord(*records, self.visibility)
+		dict.__setitem__(self, identifier, value)
+		del self.records[identifier]
+		return value
+
+	# Copying and updating from a dictionary that overrides iteration goes through `keys` and `__getitem__`,
+	# so the members get decoded.
+	def __iter__(self):
+		return dict.__iter__(self)
+
+	def get(self, identifier, default=None):
+		return self[identifier] if identifier in self else default
+
+	def values(self):
+		return [self[identifier] for identifier in self]
+
+	def items(self):
+		return [(identifier, self[identifier]) for identifier in self]
+
+	def copy(self):
+		return dict(self.items())
+
+# An object file opened with a memory map. It can be used in place of an `Object`: looking up a symbol
+# finds its record by binary search and only then decodes its name, type and value. A namespace is
+# returned as a dictionary of its members, like in an `Object`. Must be closed once it is no longer used.
+class ObjectFile:
+	def __init__(self, path):
+		result = readSections(path, objectMagic)
+		if result is None:
+			raise ValueError(f"`{path}` is not an object file.")
+		(self.map, self.sections) = result
+		# The version is checked first, since other versions can have other sections.
+		version = self.sections[0][0] if self.sections and len(self.sections[0]) else None
+		if version != objectFormatVersion:
+			self.close()
+			raise ValueError(f"`{path}` has object format version {version}, expected {objectFormatVersion}.")
+		(header, offsets, blob, self.records, self.payloadItemOffsets, self.payloadCountOffsets, self.items, self.childCounts, *tokenSections) = self.sections
+		self.publicCount = header[1]
+		self.privateCount = header[2]
+		self.strings = StringReader(offsets, blob)
+		self.tokens = TokenReader(tokenSections, self.strings)
+		self.symbols = {}
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, *exception):
+		self.close()
+
+	def close(self):
+		if self.map is None:
+			return
+		for section in self.sections:
+			section.release()
+		self.map.close()
+		self.map = None
+
+	def getName(self, record):
+		return self.strings[self.records[record*recordSize]]
+
+	# Returns the index of the first record from `low` to `high` whose name isn't less than `name`.
+	def findRecord(self, name, low, high):
+		return bisect_left(range(low, high), name, key=self.getName) + low
+
+	def decodePayload(self, payload):
+		if payload < 0:
+			return None
+		(itemStart, itemEnd) = self.payloadItemOffsets[payload:payload + 2]
+		(countStart, countEnd) = self.payloadCountOffsets[payload:payload + 2]
+		return decodeTree(self.items[itemStart:itemEnd], self.childCounts[countStart:countEnd], self.tokens, self.strings)
+
+	# Returns the index of the record after the records named like `record`, which are the overloads of a
+	# function, or only `record`.
+	def skipRecord(self, record, high):
+		name = self.records[record*recordSize]
+		record += 1
+		while record < high and self.records[record*recordSize] == name:
+			record += 1
+		return record
+
+	def decodeSymbol(self, record, visibility):
+		(nameIndex, kind, typePayload, valuePayload) = self.records[record*recordSize:(record + 1)*recordSize]
+		return Symbol(self.strings[nameIndex], visibility, internType(self.decodePayload(typePayload)), self.decodePayload(valuePayload))
+
+	# Returns the symbol, overload set or namespace of `record`, which is the first record with its name.
+	# The records from `record` to `high` are searched for the other overloads and the members of a
+	# namespace. The members are only decoded once they are read (see `NamespaceMembers`).
+	def getRecord(self, record, high, visibility):
+		symbol = self.symbols.get(record)
+		if symbol is not None:
+			return symbol
+		(nameIndex, kind) = self.records[record*recordSize:record*recordSize + 2]
+		if kind == symbolRecord:
+			symbol = self.decodeSymbol(record, visibility)
+		elif kind == overloadRecord:
+			symbol = OverloadSet(self.strings[nameIndex], visibility)
+			for overload in range(record, self.skipRecord(record, high)):
+				symbol.add(self.decodeSymbol(overload, visibility))
+		else:
+			# The members of a namespace directly follow it, since `.` sorts before any identifier character.
+			prefix = self.strings[nameIndex] + "."
+			symbol = NamespaceMembers(self, visibility)
+			end = self.findRecord(prefix + "\U0010ffff", record + 1, high)
+			member = record + 1
+			while member < end:
+				memberName = self.getName(member)
+				if "." not in memberName[len(prefix):]:
+					symbol.addRecord(memberName[len(prefix):], member, end)
+				member = self.skipRecord(member, end)
+		self.symbols[record] = symbol
+		return symbol
+
+	def lookUp(self, name, low, high, visibility):
+		record = self.findRecord(name, low, high)
+		if record == high or self.getName(record) != name:
+			return None
+		return self.getRecord(record, high, visibility)
+
+	def getPublicSymbol(self, name):
+		return self.lookUp(name, 0, self.publicCount, "pub")
+
+	def getPrivateSymbol(self, name):
+		return self.lookUp(name, self.publicCount, self.publicCount + self.privateCount, "priv")
+
+	def getSymbol(self, name):
+		symbol = self.getPublicSymbol(name)
+		if symbol is not None:
+			return symbol
+		return self.getPrivateSymbol(name)
+
+	def getMembers(self, name):
+		members = {}
+		for namespace in (self.getPrivateSymbol(name), self.getPublicSymbol(name)):
+			if isinstance(namespace, dict):
+				members.update(namespace)
+		return members
+
+	# Decodes the whole file into an `Object`.
+	def toObject(self):
+		object = Object()
+		for (low, high, visibility, addSymbol) in ((0, self.publicCount, "pub", object.addPublicSymbol), (self.publicCount, self.publicCount + self.privateCount, "priv", object.addPrivateSymbol)):
+			record = low
+			while record < high:
+				if self.records[record*recordSize + 1] == namespaceRecord:
+					addSymbol(self.getName(record), {})
+				else:
+					addSymbol(self.getName(record), self.getRecord(record, high, visibility))
+				record = self.skipRecord(record, high)
+		return object
+
+def readObjectFile(path):
+	with ObjectFile(path) as objectFile:
+		return objectFile.toObject()
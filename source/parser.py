@@ -1,20 +1,106 @@
+from collections import OrderedDict
 from lexer import *
 
 # An error encountered during parsing.
 class ParserError:
-	def __init__(self, message):
+	def __init__(self, message, start=None, end=None):
 		self.message = message
+		self.start = start
+		self.end = end
+		self.location = None
 
 	def __repr__(self):
-		return self.message
-
-# A node in the parse tree.
+		return formatErrorMessage(self, self.message)
+
+# The types of nodes in the parse tree. A node stores the index of its type here as its kind.
+nodeTypes = [
+	"program",
+	"namespace statement",
+	"using statement",
+	"qualified name",
+	"variable definition",
+	"assignment",
+	"function definition",
+	"method definition",
+	"struct definintion",
+	"trait definintion",
+	"generic parameters",
+	"type parameter",
+	"struct body",
+	"struct field",
+	"using type",
+	"type cases",
+	"enum case",
+	"block",
+	"if statement",
+	"else-if block",
+	"else block",
+	"while loop",
+	"for loop",
+	"break statement",
+	"continue statement",
+	"return statement",
+	"expression or assignment",
+	"infix expression",
+	"prefix expression",
+	"tuple type",
+	"array type",
+	"pointer type",
+	"function type",
+	"function parameters",
+	"function parameter",
+	"mutable type",
+	"basic type",
+	"generic arguments",
+	"error",
+]
+nodeKinds = {type: kind for (kind, type) in enumerate(nodeTypes)}
+
+# Returns the kind of a node type, adding the type if it is new.
+def nodeKindOf(type):
+	kind = nodeKinds.get(type)
+	if kind is None:
+		kind = nodeKinds[type] = len(nodeTypes)
+		nodeTypes.append(type)
+	return kind
+
+# A node in the parse tree. The children of a finished node are a tuple. Nodes don't point to their
+# parents, see `getParents`.
 class Node:
-	def __init__(self, type, parent, *children):
-		self.type = type
-		self.parent = parent
+	__slots__ = ("kind", "children")
+
+	def __init__(self, type, *children):
+		self.kind = nodeKindOf(type)
 		self.children = list(children)
 
+	@property
+	def type(self):
+		return nodeTypes[self.kind]
+
+	# The offsets of the first and last tokens of the node, found when they are asked for. None if the
+	# node has no tokens or they have no offsets.
+	@property
+	def start(self):
+		node = self
+		while isinstance(node, Node):
+			if not node.children:
+				return None
+			node = node.children[0]
+		return node.start
+
+	@property
+	def end(self):
+		node = self
+		while isinstance(node, Node):
+			if not node.children:
+				return None
+			node = node.children[-1]
+		return node.end
+
+	# Pickles the type by name, since kinds that were added at runtime can differ between processes.
+	def __reduce__(self):
+		return (Node, (self.type, *self.children))
+
 	def __repr__(self):
 		return f"{self.type}({', '.join(map(str, self.children))})"
 
@@ -27,6 +113,43 @@ class Node:
 			else:
 				print((indentation + 1)*"| " + str(child))
 
+# Returns the texts of the tokens of `tree` in order.
+def getTokenTexts(tree):
+	texts = []
+	stack = [tree]
+	while stack:
+		node = stack.pop()
+		if isinstance(node, Node):
+			stack.extend(reversed(node.children))
+		else:
+			texts.append(node.text)
+	return tuple(texts)
+
+# Returns a dictionary from each node in `tree` to its parent.
+def getParents(tree):
+	parents = {}
+	stack = [tree]
+	while stack:
+		node = stack.pop()
+		for child in node.children:
+			if isinstance(child, Node):
+				parents[child] = node
+				stack.append(child)
+	return parents
+
+# The types of tokens that are expressions on their own.
+basicExpressionTypes = frozenset(["number", "character", "string", "identifier"])
+
+# Raised in recovery mode once the parser has reported as many errors as it is allowed to.
+class TooManyErrors(Exception):
+	pass
+
+# The keywords that start a statement, where recovery mode can pick up parsing again after an error.
+statementKeywords = frozenset(["namespace", "using", "pub", "var", "func", "method", "struct", "trait", "if", "do", "while", "for", "break", "continue", "return"])
+
+# Returned by `Parser.parseExpression` for an expression with an error.
+expressionError = object()
+
 class Parser:
 	prefixPrecedences = {
 		"(": 2000,
@@ -72,15 +195,109 @@ class Parser:
 		"and": 300,
 		"xor": 200,
 		"or": 100,
+		"thru": 50,
+		"until": 50,
+		"by": 40,
 	}
 
-	def __init__(self, tokens):
+	# The rules that packrat mode memoizes: the ones that several alternatives can reach at the same token.
+	memoizedRules = [
+		"parseGenericArguments",
+		"parseFunctionParameters",
+		"parseType",
+		"parseInfixExpression",
+		"parseBlock",
+		"parseStructBody",
+		"parseGenericParameters",
+		"parseTypeCases",
+	]
+
+	# The alternatives to try for each first token of a program statement, block statement, type case or
+	# type, taken from the FIRST sets of the rules in notes/grammar.txt. Keywords and operators are keyed
+	# by their text and other tokens by their type. The `None` entry is used for any other token. A `pub`
+	# program statement is dispatched on the token after it.
+	programStatementRules = {
+		"using": [("parseUsingStatement",)],
+		"var": [("parseVariableDefinition",)],
+		"func": [("parseFunctionDefinition",)],
+		"method": [("parseMethodDefinition",)],
+		"struct": [("parseStructDefinition",)],
+		"trait": [("parseTraitDefinition",)],
+	}
+	blockStatementRules = {
+		"using": [("parseUsingStatement",)],
+		# Every definition rejects `pub` here, so the first one reports it.
+		"pub": [("parseVariableDefinition", False)],
+		"var": [("parseVariableDefinition", False)],
+		"func": [("parseFunctionDefinition", False)],
+		"method": [("parseMethodDefinition", False)],
+		"struct": [("parseStructDefinition", False)],
+		"trait": [("parseTraitDefinition", False)],
+		"{": [("parseBlock",)],
+		"if": [("parseIfStatement",)],
+		"do": [("parseWhileLoop",)],
+		"while": [("parseWhileLoop",)],
+		"for": [("parseForLoop",)],
+		"break": [("parseBreakStatement",)],
+		"continue": [("parseContinueStatement",)],
+		"return": [("parseReturnStatement",)],
+		None: [("parseExpressionOrAssignment",)],
+	}
+	typeCaseRules = {
+		"using": [("parseUsingStatement",)],
+		"pub": [("parseStructDefinition", False)],
+		"struct": [("parseStructDefinition", False)],
+		"trait": [("parseTraitDefinition", False)],
+		"identifier": [("parseEnumCase",)],
+	}
+	typeRules = {
+		"(": [("parseTupleType",)],
+		"[": [("parseArrayType",)],
+		"&": [("parsePointerType",)],
+		"func": [("parseFunctionType",)],
+		"mut": [("parseMutableType",)],
+		"identifier": [("parseBasicType",)],
+	}
+
+	def __init__(self, tokens, memoize=False, memoSize=1 << 16, recover=False, maxErrors=100, instrumentation=None):
 		self.tokens = tokens
 		self.currentTokenIndex = 0
 		self.tree = None
 		self.currentNode = self.tree
 		self.errors = []
 		self.tokenIndexStack = []
+		self.nodeStack = []
+		self.memo = None
+		self.memoSize = memoSize
+		self.memoHits = 0
+		self.memoMisses = 0
+		# The rules are counted first, so the memoized, recovering and dispatched rules are the counted ones.
+		if instrumentation is not None:
+			instrumentation.countRules(self, self.ruleNames)
+		if memoize:
+			self.memo = OrderedDict()
+			for name in self.memoizedRules:
+				setattr(self, name, self.memoizeRule(getattr(self, name)))
+		self.programStatementDispatch = self.bindRules(self.programStatementRules)
+		self.blockStatementDispatch = self.bindRules(self.blockStatementRules)
+		self.typeCaseDispatch = self.bindRules(self.typeCaseRules)
+		self.typeDispatch = self.bindRules(self.typeRules)
+		self.nodeCount = 0
+		self.backtrackCount = 0
+		self.maxErrors = maxErrors
+		self.recoveredErrorCount = 0
+		# The token index and precedence of every expression that `parseExpression` failed on. They're only
+		# parsed with the rules that build nodes after that, or each level of a broken, nested expression
+		# would try both ways again and double the work.
+		self.failedExpressions = set()
+		if recover:
+			self.parseNamespaceStatement = self.recoverRule(self.parseNamespaceStatement, None)
+			self.parseProgramStatement = self.recoverRule(self.parseProgramStatement, ())
+			self.parseBlockStatement = self.recoverRule(self.parseBlockStatement, ("}",))
+
+	# Turns a table of rule names and arguments into a table of bound rules and arguments.
+	def bindRules(self, rules):
+		return {key: [(getattr(self, name), arguments) for (name, *arguments) in alternatives] for (key, alternatives) in rules.items()}
 
 	@property
 	def currentToken(self):
@@ -92,6 +309,23 @@ class Parser:
 	def peekTokenText(self, *texts):
 		return self.currentTokenIndex < len(self.tokens) and self.currentToken.text in texts
 
+	# Returns the key of the token `offset` tokens ahead in the dispatch tables.
+	def peekTokenKey(self, offset=0):
+		index = self.currentTokenIndex + offset
+		if index >= len(self.tokens):
+			return None
+		token = self.tokens[index]
+		return token.text if token.type in ("keyword", "operator") else token.type
+
+	# Tries the alternatives in `dispatch` for the token with key `key`.
+	def parseAlternatives(self, dispatch, key):
+		alternatives = dispatch.get(key)
+		if alternatives is None:
+			alternatives = dispatch.get(None, ())
+		for (rule, arguments) in alternatives:
+			if rule(*arguments): return True
+		return False
+
 	def consumeTokenType(self, *types):
 		if self.peekTokenType(*types):
 			self.currentNode.children.append(self.currentToken)
@@ -119,32 +353,142 @@ class Parser:
 		return 0
 	
 	def beginNode(self, type):
+		self.nodeCount += 1
 		self.tokenIndexStack.append(self.currentTokenIndex)
+		self.nodeStack.append(self.currentNode)
+		node = Node(type)
 		if self.tree is None:
-			self.tree = Node(type, None)
-			self.currentNode = self.tree
-			return True
-		self.currentNode.children.append(Node(type, self.currentNode))
-		self.currentNode = self.currentNode.children[-1]
+			self.tree = node
+		else:
+			self.currentNode.children.append(node)
+		self.currentNode = node
 		return True
 	
+	# Finishes the current node. Its children are frozen into a tuple, which takes less memory than a list.
 	def endNode(self):
 		self.tokenIndexStack.pop()
-		self.currentNode = self.currentNode.parent
+		self.currentNode.children = tuple(self.currentNode.children)
+		self.currentNode = self.nodeStack.pop()
 		return True
 	
 	def backtrack(self):
+		self.backtrackCount += 1
 		self.currentTokenIndex = self.tokenIndexStack.pop()
-		self.currentNode = self.currentNode.parent
+		self.currentNode = self.nodeStack.pop()
 		if self.currentNode:
 			self.currentNode.children.pop()
 		return False
 	
+	# Wraps `rule` so it runs at most once per token index and arguments, replaying the nodes, tokens and
+	# errors it added on later calls. A rule that stops at an error leaves the parser inside an unfinished
+	# node, so only results that leave the parser where it started are remembered. The least recently
+	# used results are dropped once there are more than `memoSize` of them.
+	def memoizeRule(self, rule):
+		name = rule.__name__
+		def memoizedRule(*arguments):
+			key = (name, arguments, self.currentTokenIndex)
+			node = self.currentNode
+			if (entry := self.memo.get(key)) is not None:
+				self.memo.move_to_end(key)
+				self.memoHits += 1
+				(result, endIndex, children, errors) = entry
+				node.children.extend(children)
+				self.errors.extend(errors)
+				self.currentTokenIndex = endIndex
+				return result
+
+			self.memoMisses += 1
+			if node is None:
+				return rule(*arguments)
+			childCount = len(node.children)
+			errorCount = len(self.errors)
+			depth = len(self.tokenIndexStack)
+			result = rule(*arguments)
+			if self.currentNode is node and len(self.tokenIndexStack) == depth:
+				self.memo[key] = (result, self.currentTokenIndex, node.children[childCount:], self.errors[errorCount:])
+				if len(self.memo) > self.memoSize:
+					self.memo.popitem(last=False)
+			return result
+		return memoizedRule
+
+	# Wraps the statement rule `rule` so a statement with an error is replaced by an "error" node holding
+	# its tokens, up to the next synchronization point, and parsing goes on after it. Only the first error
+	# of the statement is kept, besides those of inner statements that were recovered from, since the rest
+	# tend to follow from it. If nothing parses at a token that isn't in `closingTexts`, that is an error
+	# too, unless `closingTexts` is None. Raises `TooManyErrors` once there are `maxErrors` errors.
+	def recoverRule(self, rule, closingTexts):
+		def recoveringRule(*arguments):
+			node = self.currentNode
+			(startIndex, childCount, errorCount) = (self.currentTokenIndex, len(node.children), len(self.errors))
+			(depth, tokenDepth) = (len(self.nodeStack), len(self.tokenIndexStack))
+			result = rule(*arguments)
+			# Errors of inner statements that were already recovered from are kept.
+			recoveredErrorCount = max(self.recoveredErrorCount, errorCount)
+			if len(self.errors) == recoveredErrorCount and self.currentNode is node and len(self.nodeStack) == depth:
+				if result or closingTexts is None or self.currentTokenIndex >= len(self.tokens) or self.currentToken.text in closingTexts:
+					return result
+				self.emitError("Expected a statement.")
+			errorIndex = self.currentTokenIndex
+			self.currentNode = node
+			del node.children[childCount:]
+			del self.errors[recoveredErrorCount + 1:]
+			del self.nodeStack[depth:]
+			del self.tokenIndexStack[tokenDepth:]
+			self.recoveredErrorCount = len(self.errors)
+			if len(self.errors) >= self.maxErrors:
+				raise TooManyErrors()
+			self.skipToSynchronizationPoint(startIndex, errorIndex, closingTexts or ())
+			return True
+		return recoveringRule
+
+	# Skips from the statement at `startIndex`, which has an error at `errorIndex`, to the next
+	# synchronization point, adding the skipped tokens to an "error" node. The statement ends after a `;`
+	# or once a block it opened closes, or before a statement keyword past the error or a closing brace in
+	# `closingTexts`. Braces are matched, so a statement's own blocks are skipped as a whole.
+	def skipToSynchronizationPoint(self, startIndex, errorIndex, closingTexts):
+		tokens = self.tokens
+		index = startIndex
+		depth = 0
+		while index < len(tokens):
+			token = tokens[index]
+			if depth == 0 and index > startIndex and index >= errorIndex and token.type == "keyword" and token.text in statementKeywords:
+				break
+			if token.text == "{":
+				depth += 1
+			elif token.text == "}":
+				if depth == 0:
+					if token.text not in closingTexts:
+						index += 1
+					break
+				depth -= 1
+				if depth == 0 and index >= errorIndex:
+					index += 1
+					break
+			elif token.text == ";" and depth == 0:
+				index += 1
+				break
+			index += 1
+		if index == startIndex:
+			index += 1
+		self.currentNode.children.append(Node("error", *tokens[startIndex:index]))
+		self.currentNode.children[-1].children = tuple(self.currentNode.children[-1].children)
+		self.currentTokenIndex = index
+
+	# Returns an error at the current token, or just past the last token at the end.
+	def makeError(self, message):
+		if self.currentTokenIndex < len(self.tokens):
+			return ParserError(message, self.currentToken.start, self.currentToken.end)
+		if self.tokens:
+			return ParserError(message, self.tokens[-1].end, self.tokens[-1].end)
+		return ParserError(message)
+
 	def emitError(self, type):
-		self.errors.append(ParserError(type))
+		self.errors.append(self.makeError(type))
 
+	# A generic argument is a type or an expression with operators that bind tighter than shifts, so `>`
+	# and `>>` can close the arguments.
 	def parseGenericArgument(self):
-		return self.parseType() or self.parseInfixExpression(0)
+		return self.parseType() or self.parseInfixExpression(self.infixPrecedences[">>"])
 
 	def parseGenericArguments(self):
 		self.beginNode("generic arguments")
@@ -213,13 +557,7 @@ class Parser:
 		return self.endNode()
 
 	def parseType(self):
-		if self.parseTupleType(): return True
-		if self.parseArrayType(): return True
-		if self.parsePointerType(): return True
-		if self.parseFunctionType(): return True
-		if self.parseMutableType(): return True
-		if self.parseBasicType(): return True
-		return False
+		return self.parseAlternatives(self.typeDispatch, self.peekTokenKey())
 	
 	def parseBasicExpression(self):
 		return self.consumeTokenType("number", "character", "string", "identifier")
@@ -232,7 +570,131 @@ class Parser:
 			self.parseInfixExpression(0)
 		return True
 
-	def parsePrefixExpression(self, precedence: int):
+	# Parses an expression with operators that bind tighter than `precedence`, using the operator tables
+	# directly. Nodes are only built once an operator binds, so a leaf is returned as its token. Returns
+	# the expression, None if there is no expression here, or `expressionError`, after adding the start of
+	# every expression with an error to `failedExpressions`. Doesn't report errors or touch the node stack,
+	# except through the rule for types.
+	def parseExpression(self, precedence):
+		tokens = self.tokens
+		startIndex = self.currentTokenIndex
+		if startIndex >= len(tokens):
+			return None
+		token = tokens[startIndex]
+		# Operators and keywords are the only tokens whose texts are in the tables.
+		if (prefixPrecedence := self.prefixPrecedences.get(token.text)):
+			self.currentTokenIndex += 1
+			children = [token]
+			if token.text == "(" or token.text == "[":
+				if not self.parseExpressionList(children, ")" if token.text == "(" else "]"):
+					return self.failExpression(startIndex, precedence)
+			elif (operand := self.parseExpression(prefixPrecedence)) is None or operand is expressionError:
+				return self.failExpression(startIndex, precedence)
+			else:
+				children.append(operand)
+			left = Node("prefix expression")
+			left.children = tuple(children)
+			self.nodeCount += 1
+		elif token.type in basicExpressionTypes:
+			self.currentTokenIndex += 1
+			left = token
+		else:
+			return None
+
+		children = None
+		infixPrecedences = self.infixPrecedences
+		while self.currentTokenIndex < len(tokens):
+			token = tokens[self.currentTokenIndex]
+			infixPrecedence = infixPrecedences.get(token.text)
+			if infixPrecedence is None or infixPrecedence <= precedence:
+				break
+			self.currentTokenIndex += 1
+			if children is None:
+				children = [left]
+			children.append(token)
+			if token.text == "(" or token.text == "[":
+				if not self.parseExpressionList(children, ")" if token.text == "(" else "]"):
+					return self.failExpression(startIndex, precedence)
+			elif token.text == "as":
+				if not self.parseInto(children, self.parseType):
+					return self.failExpression(startIndex, precedence)
+			elif (right := self.parseExpression(infixPrecedence)) is None or right is expressionError:
+				return self.failExpression(startIndex, precedence)
+			else:
+				children.append(right)
+		if children is None:
+			return left
+		node = Node("infix expression")
+		node.children = tuple(children)
+		self.nodeCount += 1
+		return node
+
+	# Runs `rule`, which adds to the current node, with its children going to `children` instead.
+	def parseInto(self, children, rule, *arguments):
+		node = self.currentNode
+		holder = Node("infix expression")
+		holder.children = children
+		self.currentNode = holder
+		result = rule(*arguments)
+		self.currentNode = node
+		return result
+
+	# Parses a comma separated list and its closing bracket into `children` with `parseExpression`, the
+	# way `parseCommaList` does. Returns False if an expression has an error or the bracket is missing.
+	def parseExpressionList(self, children, closingBracket):
+		tokens = self.tokens
+		expression = self.parseExpression(0)
+		if expression is not None:
+			while True:
+				if expression is expressionError:
+					return False
+				if expression is not None:
+					children.append(expression)
+				if self.currentTokenIndex >= len(tokens) or tokens[self.currentTokenIndex].text != ",":
+					break
+				children.append(tokens[self.currentTokenIndex])
+				self.currentTokenIndex += 1
+				expression = self.parseExpression(0)
+		if self.currentTokenIndex >= len(tokens) or tokens[self.currentTokenIndex].text != closingBracket:
+			return False
+		children.append(tokens[self.currentTokenIndex])
+		self.currentTokenIndex += 1
+		return True
+
+	# Remembers that the expression at `startIndex` with operators that bind tighter than `precedence` has
+	# an error, and returns `expressionError`.
+	def failExpression(self, startIndex, precedence):
+		self.failedExpressions.add((startIndex, precedence))
+		return expressionError
+
+	# Parses an expression into the current node with `parseExpression`. If the expression has an error,
+	# the parser is put back and the expression is parsed again with the rules that build a node for each
+	# level, which report the error and leave the parser in the state that error handling expects.
+	def parseInfixExpression(self, precedence: int):
+		key = (self.currentTokenIndex, precedence)
+		if key in self.failedExpressions:
+			return self.parseInfixExpressionWithNodes(precedence)
+		node = self.currentNode
+		(startIndex, childCount, errorCount) = (self.currentTokenIndex, len(node.children), len(self.errors))
+		(depth, tokenDepth) = (len(self.nodeStack), len(self.tokenIndexStack))
+		expression = self.parseExpression(precedence)
+		if expression is not expressionError and len(self.errors) == errorCount:
+			if expression is None:
+				return False
+			node.children.append(expression)
+			return True
+		self.failedExpressions.add(key)
+		self.currentTokenIndex = startIndex
+		self.currentNode = node
+		del node.children[childCount:]
+		del self.errors[errorCount:]
+		del self.nodeStack[depth:]
+		del self.tokenIndexStack[tokenDepth:]
+		return self.parseInfixExpressionWithNodes(precedence)
+
+	# The rules that `parseExpression` stands in for. They open a node at every level and unwrap it again
+	# when no operator binds.
+	def parsePrefixExpressionWithNodes(self, precedence: int):
 		self.beginNode("prefix expression")
 		# Parse a prefix expression or list.
 		if (newPrecedence := self.consumePrefixOperator(precedence)):
@@ -256,9 +718,9 @@ class Parser:
 			return True
 		return self.endNode()
 
-	def parseInfixExpression(self, precedence: int):
+	def parseInfixExpressionWithNodes(self, precedence: int):
 		self.beginNode("infix expression")
-		if not self.parsePrefixExpression(precedence): return self.backtrack()
+		if not self.parsePrefixExpressionWithNodes(precedence): return self.backtrack()
 		while (newPrecedence := self.consumeInfixOperator(precedence)):
 			if self.currentNode.children[-1].text == "(":
 				self.parseCommaList()
@@ -354,21 +816,7 @@ class Parser:
 		return self.endNode()
 
 	def parseBlockStatement(self):
-		if self.parseUsingStatement(): return True
-		if self.parseVariableDefinition(False): return True
-		if self.parseFunctionDefinition(False): return True
-		if self.parseMethodDefinition(False): return True
-		if self.parseStructDefinition(False): return True
-		if self.parseTraitDefinition(False): return True
-		if self.parseBlock(): return True
-		if self.parseIfStatement(): return True
-		if self.parseWhileLoop(): return True
-		if self.parseForLoop(): return True
-		if self.parseBreakStatement(): return True
-		if self.parseContinueStatement(): return True
-		if self.parseReturnStatement(): return True
-		if self.parseExpressionOrAssignment(): return True
-		return False
+		return self.parseAlternatives(self.blockStatementDispatch, self.peekTokenKey())
 	
 	def parseBlock(self):
 		self.beginNode("block")
@@ -385,10 +833,7 @@ class Parser:
 		return self.endNode()
 
 	def parseTypeCase(self):
-		if self.parseUsingStatement(): return True
-		if self.parseStructDefinition(False): return True
-		if self.parseTraitDefinition(False): return True
-		return self.parseEnumCase()
+		return self.parseAlternatives(self.typeCaseDispatch, self.peekTokenKey())
 	
 	def parseTypeCases(self):
 		self.beginNode("type cases")
@@ -528,13 +973,10 @@ class Parser:
 		return self.endNode()
 
 	def parseProgramStatement(self):
-		if self.parseUsingStatement(): return True
-		if self.parseVariableDefinition(): return True
-		if self.parseFunctionDefinition(): return True
-		if self.parseMethodDefinition(): return True
-		if self.parseStructDefinition(): return True
-		if self.parseTraitDefinition(): return True
-		return False
+		key = self.peekTokenKey()
+		if key == "pub":
+			key = self.peekTokenKey(1)
+		return self.parseAlternatives(self.programStatementDispatch, key)
 
 	def parseNamespaceStatement(self):
 		self.beginNode("namespace statement")
@@ -547,12 +989,26 @@ class Parser:
 	
 	def parseProgram(self):
 		self.beginNode("program")
-		self.parseNamespaceStatement()
-		while self.parseProgramStatement(): pass
+		try:
+			self.parseNamespaceStatement()
+			while self.parseProgramStatement(): pass
+		except TooManyErrors:
+			self.emitError(f"Stopped after {self.maxErrors} errors.")
+			while self.nodeStack[-1] is not None:
+				self.endNode()
+			return self.endNode()
 		if self.currentTokenIndex < len(self.tokens): return self.emitError("Tokens left after parsing.")
 		self.endNode()
 
-def parse(tokens):
-	parser = Parser(tokens)
-	parser.parseProgram()
+# The grammar rules, which are counted when parsing with instrumentation. `parseExpression` and
+# `parseProgram` are left out since they don't return whether they succeeded, and so are the helpers that
+# run other rules.
+Parser.ruleNames = [name for name in vars(Parser) if name.startswith("parse") and name not in ("parseAlternatives", "parseExpression", "parseInto", "parseExpressionList", "parseProgram")]
+
+# Parses `tokens` into a tree. In recovery mode, statements with errors become "error" nodes and parsing
+# goes on, so one pass reports every independent error.
+def parse(tokens, memoize=False, recover=False, instrumentation=None):
+	parser = Parser(tokens, memoize, recover=recover, instrumentation=instrumentation)
+	with measure(instrumentation, "parse"):
+		parser.parseProgram()
 	return (parser.tree, parser.errors)
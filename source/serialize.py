@@ -0,0 +1,165 @@
+from array import array
+import mmap
+import os
+import struct
+from lexer import *
+from parser import *
+
+# A file is a magic number, the number of sections and a header for each section (its array type code
+# and length in bytes), followed by the sections. Sections start on 8-byte boundaries so they can be read
+# in place from a memory map. Numbers are in the byte order of the machine.
+sectionCountFormat = struct.Struct("<4sI")
+sectionHeaderFormat = struct.Struct("<cxxxxxxxQ")
+
+def align(offset):
+	return (offset + 7) & ~7
+
+def writeSections(path, magic, sections):
+	# Write to a temporary file first so a reader never sees half a file.
+	temporaryPath = f"{path}.{os.getpid()}.tmp"
+	with open(temporaryPath, "wb") as file:
+		file.write(sectionCountFormat.pack(magic, len(sections)))
+		for section in sections:
+			file.write(sectionHeaderFormat.pack(section.typecode.encode(), len(section)*section.itemsize))
+		for section in sections:
+			file.write(bytes(align(file.tell()) - file.tell()))
+			section.tofile(file)
+	os.replace(temporaryPath, path)
+
+# Memory maps the file at `path` and returns the map and a view of each section, or None if the file
+# doesn't start with `magic`. The views must be released before the map is closed. Raises ValueError if
+# the file is cut short.
+def readSections(path, magic):
+	with open(path, "rb") as file:
+		if os.fstat(file.fileno()).st_size < sectionCountFormat.size:
+			return None
+		map = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+	(fileMagic, sectionCount) = sectionCountFormat.unpack_from(map)
+	if fileMagic != magic:
+		map.close()
+		return None
+	view = memoryview(map)
+	sections = []
+	offset = sectionCountFormat.size + sectionCount*sectionHeaderFormat.size
+	try:
+		for i in range(sectionCount):
+			(typecode, length) = sectionHeaderFormat.unpack_from(map, sectionCountFormat.size + i*sectionHeaderFormat.size)
+			offset = align(offset)
+			if offset + length > len(map):
+				raise ValueError(f"`{path}` is cut short.")
+			sections.append(view[offset:offset + length].cast(typecode.decode()))
+			offset += length
+	except Exception:
+		for section in sections:
+			section.release()
+		view.release()
+		map.close()
+		raise
+	view.release()
+	return (map, sections)
+
+# The strings of a file, each stored once. They are written as one UTF-8 blob and the offsets of the
+# strings in it.
+class StringTable:
+	def __init__(self):
+		self.strings = []
+		self.indices = {}
+
+	def add(self, string):
+		index = self.indices.get(string)
+		if index is None:
+			index = self.indices[string] = len(self.strings)
+			self.strings.append(string)
+		return index
+
+	def encode(self):
+		offsets = array("Q", [0])
+		blob = bytearray()
+		for string in self.strings:
+			blob += string.encode("utf-8")
+			offsets.append(len(blob))
+		return [offsets, array("B", blob)]
+
+# Reads strings out of the sections written by `StringTable.encode`, decoding each one when it is first
+# used.
+class StringReader:
+	def __init__(self, offsets, blob):
+		self.offsets = offsets
+		self.blob = blob
+		self.strings = [None]*(len(offsets) - 1)
+
+	def __getitem__(self, index):
+		string = self.strings[index]
+		if string is None:
+			string = self.strings[index] = str(self.blob[self.offsets[index]:self.offsets[index + 1]], "utf-8")
+		return string
+
+	def __len__(self):
+		return len(self.strings)
+
+# The tokens of a file, each stored once. Missing offsets are stored as -1.
+class TokenTable:
+	def __init__(self, strings):
+		self.strings = strings
+		self.tokens = []
+		self.indices = {}
+
+	def add(self, token):
+		index = self.indices.get(id(token))
+		if index is None:
+			index = self.indices[id(token)] = len(self.tokens)
+			self.tokens.append(token)
+		return index
+
+	def encode(self):
+		add = self.strings.add
+		return [
+			array("I", (add(token.type) for token in self.tokens)),
+			array("I", (add(token.text) for token in self.tokens)),
+			array("q", (-1 if token.start is None else token.start for token in self.tokens)),
+			array("q", (-1 if token.end is None else token.end for token in self.tokens)),
+		]
+
+def decodeTokens(sections, strings):
+	(types, texts, starts, ends) = sections
+	tokens = list(map(Token, map(strings.__getitem__, types), map(strings.__getitem__, texts), starts, ends))
+	for token in tokens:
+		if token.start < 0:
+			(token.start, token.end) = (None, None)
+	return tokens
+
+# Encodes a tree in postorder as two arrays. In the first, a token is its index in the token table and
+# a node is the negated index of its type in the string table minus one. The second holds the number of
+# children of each node.
+def encodeTree(tree, tokens):
+	items = array("q")
+	childCounts = array("Q")
+	# Nodes are pushed twice, the second time (with `visited` set) after their children.
+	stack = [] if tree is None else [(tree, False)]
+	while stack:
+		(node, visited) = stack.pop()
+		if not isinstance(node, Node):
+			items.append(tokens.add(node))
+		elif visited:
+			items.append(-tokens.strings.add(node.type) - 1)
+			childCounts.append(len(node.children))
+		else:
+			stack.append((node, True))
+			stack.extend((child, False) for child in reversed(node.children))
+	return [items, childCounts]
+
+def decodeTree(items, childCounts, tokens, strings):
+	stack = []
+	childCounts = iter(childCounts)
+	for item in items:
+		if item >= 0:
+			stack.append(tokens[item])
+			continue
+		node = Node(strings[-item - 1])
+		if childCount := next(childCounts):
+			node.children = tuple(stack[-childCount:])
+			del stack[-childCount:]
+		else:
+			node.children = ()
+		stack.append(node)
+	return stack[-1] if stack else None
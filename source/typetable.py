@@ -0,0 +1,326 @@
+import sys
+from lexer import *
+from parser import *
+from constants import *
+
+# The node types that a type can be.
+typeKinds = frozenset(map(nodeKindOf, ["tuple type", "array type", "pointer type", "function type", "mutable type", "basic type"]))
+functionParametersKind = nodeKindOf("function parameters")
+
+# Returns a part of a type as it is written. Parts that are missing from a type with syntax errors are
+# None.
+def formatTypePart(part):
+	return "?" if part is None else str(part)
+
+# A type, as made by a `TypeTable`. The table makes one object per structure, so two types are equal only
+# if they are the same object, and comparing or hashing a type is as cheap as for any object. Names are
+# kept as they are written, so `S` and `n.S` are different types even if they name the same struct.
+# `getParts` returns the types and generic arguments that a type is made of. A type that is unpickled, like
+# one in the results of another process, is made by the default table, so it is canonical too.
+class Type:
+	__slots__ = ()
+
+	def __reduce__(self):
+		return (getCanonicalType, (type(self), *(getattr(self, slot) for slot in self.__slots__)))
+
+# A named type, like `int32` or `List<T, 4>`. A generic argument is a type, the value of a constant
+# expression or the text of any other expression.
+class BasicType(Type):
+	__slots__ = ("name", "arguments")
+
+	def __init__(self, name, arguments):
+		self.name = name
+		self.arguments = arguments
+
+	def __repr__(self):
+		if not self.arguments:
+			return self.name
+		return f"{self.name}<{', '.join(map(formatTypePart, self.arguments))}>"
+
+	def getParts(self):
+		return self.arguments
+
+	def toTree(self):
+		children = []
+		for (i, identifier) in enumerate(self.name.split(".")):
+			if i > 0:
+				children.append(Token("operator", "."))
+			children.append(Token("identifier", identifier))
+		if self.arguments:
+			arguments = [Token("operator", "generic <")]
+			for (i, argument) in enumerate(self.arguments):
+				if i > 0:
+					arguments.append(Token("operator", ","))
+				arguments.append(argumentToTree(argument))
+			arguments.append(Token("operator", ">"))
+			children.append(Node("generic arguments", *arguments))
+		return Node("basic type", *children)
+
+class PointerType(Type):
+	__slots__ = ("target",)
+
+	def __init__(self, target):
+		self.target = target
+
+	def __repr__(self):
+		return "&" + formatTypePart(self.target)
+
+	def getParts(self):
+		return (self.target,)
+
+	def toTree(self):
+		return Node("pointer type", Token("operator", "&"), *typeToTrees(self.target))
+
+class MutableType(Type):
+	__slots__ = ("target",)
+
+	def __init__(self, target):
+		self.target = target
+
+	def __repr__(self):
+		return "mut " + formatTypePart(self.target)
+
+	def getParts(self):
+		return (self.target,)
+
+	def toTree(self):
+		return Node("mutable type", Token("keyword", "mut"), *typeToTrees(self.target))
+
+# An array with a size like a generic argument's, or None for `[]`.
+class ArrayType(Type):
+	__slots__ = ("size", "element")
+
+	def __init__(self, size, element):
+		self.size = size
+		self.element = element
+
+	def __repr__(self):
+		return f"[{'' if self.size is None else self.size}]{formatTypePart(self.element)}"
+
+	def getParts(self):
+		return (self.size, self.element)
+
+	def toTree(self):
+		size = () if self.size is None else (argumentToTree(self.size),)
+		return Node("array type", Token("operator", "["), *size, Token("operator", "]"), *typeToTrees(self.element))
+
+class TupleType(Type):
+	__slots__ = ("elements",)
+
+	def __init__(self, elements):
+		self.elements = elements
+
+	def __repr__(self):
+		return f"({', '.join(map(formatTypePart, self.elements))})"
+
+	def getParts(self):
+		return self.elements
+
+	def toTree(self):
+		children = [Token("operator", "(")]
+		for (i, element) in enumerate(self.elements):
+			if i > 0:
+				children.append(Token("operator", ","))
+			children.extend(typeToTrees(element))
+		children.append(Token("operator", ")"))
+		return Node("tuple type", *children)
+
+# The type of a function, which is only its parameter types and result type (None if it has none). The
+# names of the parameters don't matter.
+class FunctionType(Type):
+	__slots__ = ("parameters", "result")
+
+	def __init__(self, parameters, result):
+		self.parameters = parameters
+		self.result = result
+
+	def __repr__(self):
+		result = "" if self.result is None else " " + str(self.result)
+		return f"func({', '.join(map(formatTypePart, self.parameters))}){result}"
+
+	def getParts(self):
+		return (*self.parameters, self.result)
+
+	def toTree(self):
+		parameters = [Token("operator", "(")]
+		for (i, parameter) in enumerate(self.parameters):
+			if i > 0:
+				parameters.append(Token("operator", ","))
+			parameters.append(Node("function parameter", Token("identifier", "_"), *typeToTrees(parameter)))
+		parameters.append(Token("operator", ")"))
+		return Node("function type", Token("keyword", "func"), Node("function parameters", *parameters), *typeToTrees(self.result))
+
+# Returns the children that stand for the type `type` in a tree, which are none if it is missing.
+def typeToTrees(type):
+	return () if type is None else (type.toTree(),)
+
+def argumentToTree(argument):
+	if isinstance(argument, Type):
+		return argument.toTree()
+	if isinstance(argument, int):
+		return Token("number", str(argument))
+	return Token("identifier", argument)
+
+# Makes the canonical `Type` of each type tree. A type is looked up by its class and parts, which are
+# canonical themselves, so it is built only once however many trees spell it.
+class TypeTable:
+	treeHandlers = {
+		"basic type": "internBasicType",
+		"pointer type": "internPointerType",
+		"mutable type": "internMutableType",
+		"array type": "internArrayType",
+		"tuple type": "internTupleType",
+		"function type": "internFunctionType",
+	}
+
+	def __init__(self):
+		self.types = {}
+		self.handlers = {nodeKindOf(type): getattr(self, name) for (type, name) in self.treeHandlers.items()}
+
+	def __len__(self):
+		return len(self.types)
+
+	def getType(self, typeClass, *parts):
+		key = (typeClass, *parts)
+		type = self.types.get(key)
+		if type is None:
+			type = self.types[key] = typeClass(*parts)
+		return type
+
+	def getBasicType(self, name, arguments=()):
+		return self.getType(BasicType, sys.intern(name), tuple(arguments))
+
+	def getPointerType(self, target):
+		return self.getType(PointerType, target)
+
+	def getMutableType(self, target):
+		return self.getType(MutableType, target)
+
+	def getArrayType(self, size, element):
+		return self.getType(ArrayType, size, element)
+
+	def getTupleType(self, elements):
+		return self.getType(TupleType, tuple(elements))
+
+	def getFunctionType(self, parameters, result):
+		return self.getType(FunctionType, tuple(parameters), result)
+
+	# Returns the part `part` of a type with the generic parameters in `substitution` replaced by their
+	# arguments. A parameter is a basic type without generic arguments or the text of an expression, like
+	# the size of `[N]int32`. `memo` holds the types substituted so far, since types share their parts.
+	def substitute(self, part, substitution, memo):
+		if isinstance(part, str):
+			return substitution.get(part, part)
+		if not isinstance(part, Type):
+			return part
+		result = memo.get(part)
+		if result is None:
+			result = memo[part] = self.substituteType(part, substitution, memo)
+		return result
+
+	def substituteType(self, type, substitution, memo):
+		if isinstance(type, BasicType):
+			if not type.arguments:
+				return substitution.get(type.name, type)
+			return self.getBasicType(type.name, [self.substitute(argument, substitution, memo) for argument in type.arguments])
+		if isinstance(type, PointerType):
+			return self.getPointerType(self.substitute(type.target, substitution, memo))
+		if isinstance(type, MutableType):
+			return self.getMutableType(self.substitute(type.target, substitution, memo))
+		if isinstance(type, ArrayType):
+			return self.getArrayType(self.substitute(type.size, substitution, memo), self.substitute(type.element, substitution, memo))
+		if isinstance(type, TupleType):
+			return self.getTupleType([self.substitute(element, substitution, memo) for element in type.elements])
+		return self.getFunctionType([self.substitute(parameter, substitution, memo) for parameter in type.parameters], self.substitute(type.result, substitution, memo))
+
+	# Returns the type of the type tree `tree`, or None if there is no tree.
+	def intern(self, tree):
+		if tree is None:
+			return None
+		return self.handlers[tree.kind](tree)
+
+	# Returns the type of `tree` if it is a type tree, or None.
+	def internChild(self, tree):
+		if isinstance(tree, Node) and tree.kind in typeKinds:
+			return self.intern(tree)
+		return None
+
+	# Returns a generic argument or an array size: a type, the value of a folded constant or number, or the
+	# text of the expression.
+	def internArgument(self, tree):
+		if isinstance(tree, Node):
+			return self.intern(tree) if tree.kind in typeKinds else " ".join(getTokenTexts(tree))
+		if type(tree) is Constant:
+			return tree.value
+		if tree.type == "number":
+			value = ConstantPool.decode(tree)
+			if value is not notConstant:
+				return value
+		return tree.text
+
+	# Returns the function type of a function or method definition, from the types of its parameters and
+	# its result.
+	def internSignature(self, tree):
+		parameters = []
+		result = None
+		for child in tree.children:
+			if not isinstance(child, Node):
+				continue
+			if child.kind == functionParametersKind:
+				parameters = [self.internChild(parameter.children[-1]) for parameter in child.children if isinstance(parameter, Node)]
+			elif child.kind in typeKinds:
+				result = self.intern(child)
+		return self.getFunctionType(parameters, result)
+
+	# name [. name]* [generic arguments]
+	def internBasicType(self, tree):
+		names = []
+		arguments = ()
+		for child in tree.children:
+			if isinstance(child, Node):
+				arguments = [self.internArgument(argument) for argument in child.children if isinstance(argument, Node) or argument.type != "operator"]
+			else:
+				names.append(child.text)
+		return self.getBasicType("".join(names), arguments)
+
+	# & type
+	def internPointerType(self, tree):
+		return self.getPointerType(self.internChild(tree.children[-1]))
+
+	# mut type
+	def internMutableType(self, tree):
+		return self.getMutableType(self.internChild(tree.children[-1]))
+
+	# [size] type
+	def internArrayType(self, tree):
+		children = tree.children
+		size = None
+		if len(children) > 1 and not (isinstance(children[1], Token) and children[1].text == "]"):
+			size = self.internArgument(children[1])
+		return self.getArrayType(size, self.internChild(children[-1]))
+
+	# (type, type, ...)
+	def internTupleType(self, tree):
+		return self.getTupleType(self.intern(child) for child in tree.children if isinstance(child, Node))
+
+	# func (name type, ...) type
+	def internFunctionType(self, tree):
+		children = tree.children
+		parameters = []
+		if len(children) > 1 and isinstance(children[1], Node):
+			for parameter in children[1].children:
+				if isinstance(parameter, Node):
+					parameters.append(self.internChild(parameter.children[-1]))
+		return self.getFunctionType(parameters, self.internChild(children[-1]) if len(children) > 2 else None)
+
+# The table that the compiler makes its types with, so the types of all objects can be compared.
+defaultTypeTable = TypeTable()
+
+def getCanonicalType(typeClass, *parts):
+	return defaultTypeTable.getType(typeClass, *parts)
+
+def internType(tree):
+	return defaultTypeTable.intern(tree)
+
+def internSignature(tree):
+	return defaultTypeTable.internSignature(tree)
@@ -0,0 +1,65 @@
+from lexer import *
+from parser import *
+
+# An analysis of a parse tree. `enterHandlers` and `exitHandlers` map node types to the names of the
+# methods to call, as `handler(node, parent)`, before and after the children of such a node are walked.
+# A handler that returns True stops the analysis, while the others keep going.
+class Analysis:
+	enterHandlers = {}
+	exitHandlers = {}
+
+# Walks a tree once for any number of analyses. The handlers of every analysis are gathered into tables
+# indexed by node kind, so each node costs one lookup no matter how many analyses there are. The walk
+# keeps its own stack instead of recursing, so deep trees can't hit the recursion limit.
+class Walker:
+	def __init__(self, analyses):
+		self.analyses = list(analyses)
+		self.stopped = set()
+		self.buildTables()
+
+	def buildTables(self):
+		self.enterTable = self.buildTable("enterHandlers")
+		self.exitTable = self.buildTable("exitHandlers")
+
+	def buildTable(self, attribute):
+		handlers = {}
+		for analysis in self.analyses:
+			if analysis in self.stopped:
+				continue
+			for (type, name) in getattr(analysis, attribute).items():
+				handlers.setdefault(nodeKindOf(type), []).append((analysis, getattr(analysis, name)))
+		table = [()]*len(nodeTypes)
+		for (kind, kindHandlers) in handlers.items():
+			table[kind] = tuple(kindHandlers)
+		return table
+
+	def stop(self, analysis):
+		self.stopped.add(analysis)
+		self.buildTables()
+
+	# Walks `tree` depth-first from left to right.
+	def walk(self, tree):
+		if not isinstance(tree, Node):
+			return
+		# Node types can be added while parsing, after the tables were built.
+		if len(self.enterTable) < len(nodeTypes):
+			self.buildTables()
+		# The stack holds nodes to enter with their parents, and nodes to exit with a parent of `exit`.
+		exit = object()
+		stack = [(tree, None)]
+		while stack:
+			(node, parent) = stack.pop()
+			if parent is exit:
+				(node, parent) = node
+				for (analysis, handler) in self.exitTable[node.kind]:
+					if handler(node, parent) and analysis not in self.stopped:
+						self.stop(analysis)
+				continue
+			for (analysis, handler) in self.enterTable[node.kind]:
+				if handler(node, parent) and analysis not in self.stopped:
+					self.stop(analysis)
+			if self.exitTable[node.kind]:
+				stack.append(((node, parent), exit))
+			for child in reversed(node.children):
+				if isinstance(child, Node):
+					stack.append((child, node))